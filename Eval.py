@@ -2,12 +2,15 @@ import os
 import json
 from datetime import datetime
 
-from evaluation import evaluate_methods
+from evaluation import evaluate_methods, evaluation_config
+from evaluation.results_store import ResultsStore
 
 methods = ["SAITS", "BRITS", "CSDI"]
 timespans = [25]
 repeats = 1
-results = evaluate_methods(methods=methods, sensorid="01975", timespans=timespans, repeats=repeats)
+# Every finished result is stored right away, so rerunning this script after a crash only runs what is missing
+store = ResultsStore(".data/results/results.sqlite")
+results = evaluate_methods(methods=methods, sensorid="01975", timespans=timespans, repeats=repeats, seed=0, store=store)
 
 results_dir = "./.data/results"
 os.makedirs(results_dir, exist_ok=True)
@@ -21,8 +24,16 @@ filepath = os.path.join(results_dir, filename)
 for timespan in timespans:
   method_results = results[timespan]
   for result in method_results:
+    if result['average_rmse'] is None:
+      print(f"{result['method']} -- {timespan} years of data: every repeat failed")
+      continue
     print(f"{result['method']} -- {timespan} years of data lead to a root mean square error: {result['average_rmse']:.4f}, and a mean absolute error: {result['average_mae']:.4f}")
 
+# Results of all runs of this sensor with the same configuration, data and code so far
+config = evaluation_config(sensorid="01975", seed=0)
+for result in store.aggregate(group_by=("method", "timespan"), sensor_id="01975", config=config):
+  print(f"{result['method']} -- {result['timespan']} years over {result['n']} stored runs: rmse {result['average_rmse']:.4f} ± {result['std_rmse']:.4f}, mae {result['average_mae']:.4f} ± {result['std_mae']:.4f}")
+
 # Save results as JSON
 with open(filepath, "w") as f:
   json.dump(results, f, indent=2)
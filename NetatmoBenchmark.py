@@ -0,0 +1,104 @@
+import os
+import time
+import resource
+import tracemalloc
+
+from dotenv import load_dotenv
+
+from db import SensorDB, DBConfig
+from db.netatmo_inserter import NetAtmoInserter, NetAtmoFetcher
+from db.netatmo_simulator import NetAtmoSimulator
+from db.rate_limiter import RateLimiter
+from models import Position, Rectangle
+
+
+class CountingSensorDB(SensorDB):
+  """
+  SensorDB stand-in that only counts the rows it would insert, to measure the ingestion without database bandwidth.
+  """
+  def __init__(self):
+    super().__init__(config=None)
+    self.rows = 0
+    self.next_sensor_id = 1
+
+  def upsert_sensor(self, sensor):
+    sensor.set_sensor_id(self.next_sensor_id)
+    self.next_sensor_id += 1
+    return sensor
+
+  def insert_batch_measurements(self, measurements):
+    self.rows += len(measurements)
+    return len(measurements)
+
+  def insert_batch_aggregated_measurements(self, measurements):
+    self.rows += len(measurements)
+    return len(measurements)
+
+
+# Hamburg, see README
+area = Rectangle(north_east=Position(53.605044, 9.947162), south_west=Position(53.591585, 9.915843))
+n_stations = 50
+history_days = 5 * 365
+latency = 0.02
+throttle_rps = 200
+requests_per_second = 150
+use_database = False
+modes = ["serial", "stream", "stream-optimize"]
+
+if use_database:
+  load_dotenv()
+  db_config = DBConfig(
+      dbname=os.getenv("DB_NAME"),
+      user=os.getenv("DB_USER"),
+      password=os.getenv("DB_PASSWORD"),
+      host=os.getenv("DB_HOST"),
+      port=os.getenv("DB_PORT")
+  )
+
+results = []
+
+with NetAtmoSimulator(area, n_stations=n_stations, history_days=history_days, latency=latency, throttle_rps=throttle_rps) as simulator:
+  date_begin = simulator.history_begin
+
+  for mode in modes:
+    db = SensorDB(db_config) if use_database else CountingSensorDB()
+    fetcher = NetAtmoFetcher(rate_limiter=RateLimiter(requests_per_second, burst=10), api_url=simulator.api_url, auth_url=simulator.auth_url)
+    inserter = NetAtmoInserter(db, fetcher=fetcher)
+
+    sensors = inserter.fetch_sensors_in_area(area, store_sensors=True, square_size_m=500, request_delay=0, max_workers=8)
+
+    requests_before = simulator.total_requests
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = 0
+
+    for sensor in sensors:
+      if mode == "serial":
+        measurements = inserter.fetch_data_from_sensor(sensor, 'all', "1day", date_begin)
+        rows += inserter.store_measurements(sensor, measurements, "1day")
+      else:
+        rows += inserter.stream_data_from_sensor(sensor, 'all', "1day", date_begin, optimize=mode == "stream-optimize")
+
+    seconds = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    requests = simulator.total_requests - requests_before
+
+    results.append({
+      "mode": mode,
+      "sensors": len(sensors),
+      "requests": requests,
+      "rows": rows,
+      "seconds": seconds,
+      "requests_per_second": requests / seconds,
+      "rows_per_second": rows / seconds,
+      "peak_memory_mb": peak_memory / 1024**2,
+    })
+
+  throttled = simulator.throttled
+
+print(f"\n{n_stations} simulated stations, {history_days} days of history, {latency * 1000:.0f}ms latency, {throttled} throttled requests")
+for result in results:
+  print(f"{result['mode']:>16}: {result['requests']} requests in {result['seconds']:.1f}s ({result['requests_per_second']:.1f} requests/s), "
+        f"{result['rows']} rows ({result['rows_per_second']:.0f} rows/s), peak traced memory {result['peak_memory_mb']:.1f} MiB")
+print(f"Max resident memory of the process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
@@ -0,0 +1,147 @@
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import threading
+import numpy as np
+
+
+class DatasetCache:
+  """
+  On-disk cache of preprocessed datasets (see preprocess_dwd), keyed by a fingerprint of everything the dataset depends on.
+  Every dataset is stored in its own directory, with one .npy file per array and the remaining entries (e.g. the scaler) pickled.
+  Cached arrays are loaded memory-mapped and read-only, so a hit costs almost nothing until the data is actually used.
+  If the cache grows beyond `max_size_bytes`, the least recently used datasets are removed.
+  Args:
+    cache_dir (str, optional): Directory the datasets are stored in. Defaults to ".data/cache/datasets".
+    max_size_bytes (int, optional): Upper bound of the total size of all cached datasets. Defaults to 10 GiB.
+  """
+  META_FILE = "meta.pkl"
+
+  def __init__(self, cache_dir = ".data/cache/datasets", max_size_bytes = 10*1024**3):
+    self.cache_dir = cache_dir
+    self.max_size_bytes = max_size_bytes
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+  @staticmethod
+  def make_key(sensor_id, watermark, timespan, sliding_window_size, gap_len, miss_rate, seed, code_version, **params) -> str:
+    """
+    Builds the fingerprint of a dataset.
+    Args:
+      sensor_id (str): The original id of the sensor.
+      watermark (str): The number and latest timestamp of the sensor's data, see get_dwd_sensor_watermark, so changed data invalidates the dataset.
+      timespan (int): The number of years of data.
+      sliding_window_size, gap_len, miss_rate: The parameters of preprocess_dwd.
+      seed (int): The seed of the artificial missingness.
+      code_version (str): Version of the code that creates the dataset, see source_fingerprint.
+      **params: Further parameters the dataset depends on.
+    """
+    fingerprint = {
+      "sensor_id": str(sensor_id),
+      "watermark": str(watermark),
+      "timespan": timespan,
+      "sliding_window_size": sliding_window_size,
+      "gap_len": gap_len,
+      "miss_rate": miss_rate,
+      "seed": seed,
+      "code_version": code_version,
+      **params
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+  @staticmethod
+  def source_fingerprint(*modules) -> str:
+    """
+    Hashes the source files of modules, e.g. of the preprocessing, so changing their code invalidates the cached datasets.
+    """
+    sha256 = hashlib.sha256()
+    for module in modules:
+      with open(module.__file__, "rb") as f:
+        sha256.update(f.read())
+    return sha256.hexdigest()[:16]
+
+  def get(self, key) -> dict:
+    """
+    Returns the cached dataset for the given key with memory-mapped arrays, or None if it is not cached.
+    """
+    path = self._path(key)
+    try:
+      with open(os.path.join(path, self.META_FILE), "rb") as f:
+        dataset = pickle.load(f)
+      for name in dataset.pop("_arrays"):
+        dataset[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+      self.misses += 1
+      return None
+
+    # Touching the directory marks it as recently used for the LRU eviction
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      pass
+    self.hits += 1
+    return dataset
+
+  def put(self, key, dataset: dict) -> dict:
+    """
+    Stores a dataset and returns it loaded back from the cache, so callers work on memory-mapped arrays either way.
+    """
+    path = self._path(key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    arrays = [name for name, value in dataset.items() if isinstance(value, np.ndarray)]
+    for name in arrays:
+      np.save(os.path.join(tmp_path, f"{name}.npy"), dataset[name])
+    meta = {name: value for name, value in dataset.items() if name not in arrays}
+    meta["_arrays"] = arrays
+    with open(os.path.join(tmp_path, self.META_FILE), "wb") as f:
+      pickle.dump(meta, f)
+
+    with self.lock:
+      if os.path.exists(path):
+        shutil.rmtree(tmp_path)
+      else:
+        os.replace(tmp_path, path)
+
+      if self._size(self.cache_dir) > self.max_size_bytes:
+        self._evict(keep=path)
+
+    return self.get(key)
+
+  def clear(self):
+    """
+    Removes all cached datasets.
+    """
+    with self.lock:
+      for entry in os.scandir(self.cache_dir):
+        if entry.is_dir():
+          shutil.rmtree(entry.path)
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key)
+
+  def _size(self, path):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+  def _evict(self, keep):
+    # Evict down to 90% of the bound, so not every following put has to scan the cache again
+    target = self.max_size_bytes * 0.9
+    datasets = sorted((os.path.getmtime(entry.path), self._size(entry.path), entry.path)
+                      for entry in os.scandir(self.cache_dir) if entry.is_dir() and entry.path != keep)
+    size_bytes = self._size(self.cache_dir)
+
+    evicted = 0
+    for _, size, path in datasets:
+      if size_bytes <= target:
+        break
+      shutil.rmtree(path)
+      size_bytes -= size
+      evicted += 1
+
+    print(f"Evicted {evicted} datasets from the dataset cache, {size_bytes / 1024**2:.1f} MiB remaining")
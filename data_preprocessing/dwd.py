@@ -1,9 +1,13 @@
+import numpy as np
+import pandas as pd
+
+from numpy.lib.stride_tricks import sliding_window_view
 from benchpots.utils import create_missingness, sliding_window
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 
 
-def preprocess_dwd(data, sliding_window_size = 150, gap_len=10, miss_rate=0.2):
+def preprocess_dwd(data, sliding_window_size = 150, gap_len=10, miss_rate=0.2, lazy = False, stride = None, subsample = 1, seed = None):
 
   """
   Prepares the DWD dataset of a sensor for use with PyPots.
@@ -19,6 +23,13 @@ def preprocess_dwd(data, sliding_window_size = 150, gap_len=10, miss_rate=0.2):
       Controls how many consecutive values are set as missing. Default is 10.
     miss_rate (float, optional): Proportion of values to be set as missing in each window (between 0 and 1).
       Determines the overall missingness rate. Default is 0.2.
+    lazy (bool, optional): Build the windows as read-only strided views over one float32 array per split instead of copying
+      every window, and return the artificial missingness as boolean masks instead of copies with NaNs, see lazy_windows
+      and apply_missingness. Default is False.
+    stride (int, optional): Number of time steps between the starts of two windows, only used if lazy. Default is None,
+      which uses the window size like benchpots' sliding_window, so windows don't overlap.
+    subsample (int, optional): Keep only every n-th window, only used if lazy. Default is 1.
+    seed (int, optional): Seed of the random missingness, the same seed always creates the same gaps. Default is None.
   Returns:
     dict: Dictionary with the following keys:
       - "n_steps": Length of the sliding windows (int)
@@ -30,25 +41,30 @@ def preprocess_dwd(data, sliding_window_size = 150, gap_len=10, miss_rate=0.2):
       - "va_X_ori": Original validation data without missingness (np.ndarray)
       - "test_X": Test data with artificially missing values (np.ndarray)
       - "test_X_ori": Original test data without missingness (np.ndarray)
+      - "train_doy", "val_doy", "test_doy": Day of year of every time step of the windows (np.ndarray), if data has a 'timestamp'
+    If lazy, the "*_X_ori" entries are float32 views and the "*_X" entries are replaced by "*_X_mask" entries, boolean masks
+    that are True for the artificially missing values.
   """
   
-  # 80% Training, 20% Test
-  train_val, test = train_test_split(data, test_size=0.2, shuffle=False)
-
-  # 75% Training, 25% Validation
-  train, val = train_test_split(train_val, test_size=0.25, shuffle=False)
+  train_X, val_X, test_X, scaler, features = split_and_scale(data)
 
-  # features contain all rows but (not timestamps)
-  features = [col for col in train.columns if col not in ['timestamp', 'month', 'year']]
-  
-  scaler = StandardScaler()
-  train_X = train.copy()
-  val_X = val.copy()
-  test_X = test.copy()
+  if lazy:
+    rng = np.random.default_rng(seed)
+    processed_dataset = {
+      "n_steps": sliding_window_size,
+      "n_features": len(features),
+      "scaler": scaler,
+    }
+    for split, values in [("train", train_X), ("val", val_X), ("test", test_X)]:
+      windows = lazy_windows(values, sliding_window_size, stride, subsample)
+      processed_dataset[f"{split}_X_ori"] = windows
+      processed_dataset[f"{split}_X_mask"] = subseq_missing_mask(windows.shape, miss_rate, gap_len, rng)
+    processed_dataset.update(day_of_year_windows(data, sliding_window_size, stride, subsample))
+    return processed_dataset
 
-  train_X = scaler.fit_transform(train[features])
-  val_X = scaler.transform(val[features])
-  test_X = scaler.transform(test[features])
+  if seed is not None:
+    # benchpots draws the missingness from NumPy's global random state
+    np.random.seed(seed)
 
   train_X_ori = sliding_window(train_X, sliding_window_size)
   val_X_ori = sliding_window(val_X, sliding_window_size)
@@ -74,5 +90,163 @@ def preprocess_dwd(data, sliding_window_size = 150, gap_len=10, miss_rate=0.2):
       "test_X": test_X,
       "test_X_ori": test_X_ori
   }
+  processed_dataset.update(day_of_year_windows(data, sliding_window_size))
   
-  return processed_dataset
\ No newline at end of file
+  return processed_dataset
+
+
+def split_and_scale(data):
+  """
+  Splits the measurements of a sensor chronologically into 60% training, 20% validation and 20% test data and
+  standardizes them with a scaler fitted on the training data only.
+  Args:
+    data (pd.DataFrame): DataFrame containing time series measurements of a sensor, see preprocess_dwd.
+  Returns:
+    tuple: The scaled training, validation and test values (np.ndarray [time, features]), the scaler and the feature names.
+  """
+  # 80% Training, 20% Test
+  train_val, test = train_test_split(data, test_size=0.2, shuffle=False)
+
+  # 75% Training, 25% Validation
+  train, val = train_test_split(train_val, test_size=0.25, shuffle=False)
+
+  # features contain all rows but (not timestamps)
+  features = [col for col in train.columns if col not in ['timestamp', 'month', 'year']]
+
+  scaler = StandardScaler()
+  train_X = scaler.fit_transform(train[features])
+  val_X = scaler.transform(val[features])
+  test_X = scaler.transform(test[features])
+  return train_X, val_X, test_X, scaler, features
+
+
+def preprocess_dwd_shared(data, sliding_window_size = 150, gap_len = 10, miss_rate = 0.2, n_masks = 1, seed = None, stride = None, subsample = 1):
+  """
+  Prepares the DWD dataset of a sensor once for several evaluation repeats.
+  The split, the scaler and the windows are computed a single time and n_masks missingness masks are drawn up front from one
+  seeded generator, so every repeat and every method of a repeat sees exactly the same inputs. All arrays are read-only,
+  so they can be shared between methods without copies. Use select_masks to get the dataset of a single repeat.
+  Args:
+    data (pd.DataFrame): DataFrame containing time series measurements of a sensor, see preprocess_dwd.
+    sliding_window_size, gap_len, miss_rate: See preprocess_dwd.
+    n_masks (int, optional): Number of missingness masks, usually the number of repeats. Default is 1.
+    seed (int, optional): Seed of the masks. Default is None.
+    stride, subsample: See lazy_windows.
+  Returns:
+    dict: "n_steps", "n_features", "n_masks", "scaler", the windows "<split>_X_ori" (float32 [windows, n_steps, features])
+      and the masks "<split>_X_masks" (bool [n_masks, windows, n_steps, features]) of the splits "train", "val" and "test".
+  """
+  train_X, val_X, test_X, scaler, features = split_and_scale(data)
+  rng = np.random.default_rng(seed)
+
+  shared_dataset = {
+    "n_steps": sliding_window_size,
+    "n_features": len(features),
+    "n_masks": n_masks,
+    "scaler": scaler,
+  }
+  for split, values in [("train", train_X), ("val", val_X), ("test", test_X)]:
+    windows = lazy_windows(values, sliding_window_size, stride, subsample)
+    masks = np.stack([subseq_missing_mask(windows.shape, miss_rate, gap_len, rng) for _ in range(n_masks)])
+    masks.setflags(write=False)
+    shared_dataset[f"{split}_X_ori"] = windows
+    shared_dataset[f"{split}_X_masks"] = masks
+  shared_dataset.update(day_of_year_windows(data, sliding_window_size, stride, subsample))
+  return shared_dataset
+
+
+def select_masks(shared_dataset, index) -> dict:
+  """
+  Returns the dataset of one repeat of a shared dataset (see preprocess_dwd_shared) in the lazy format of preprocess_dwd,
+  with "<split>_X_ori" and "<split>_X_mask" entries that are views into the shared arrays.
+  """
+  dataset = {key: shared_dataset[key] for key in ["n_steps", "n_features", "scaler"]}
+  for split in ["train", "val", "test"]:
+    dataset[f"{split}_X_ori"] = shared_dataset[f"{split}_X_ori"]
+    dataset[f"{split}_X_mask"] = shared_dataset[f"{split}_X_masks"][index]
+    if f"{split}_doy" in shared_dataset:
+      dataset[f"{split}_doy"] = shared_dataset[f"{split}_doy"]
+  return dataset
+
+
+def day_of_year_windows(data, sliding_window_size, stride = None, subsample = 1) -> dict:
+  """
+  Windows the day of year (1-366) of every time step exactly like the measurements of preprocess_dwd, e.g. for climatologies.
+  Args:
+    data (pd.DataFrame): The measurements of preprocess_dwd, with a 'timestamp' column.
+    sliding_window_size, stride, subsample: See lazy_windows.
+  Returns:
+    dict: "<split>_doy" windows (np.ndarray int16 [windows, n_steps]) of every split, empty if data has no 'timestamp'.
+  """
+  if 'timestamp' not in data.columns:
+    return {}
+
+  day_of_year = pd.to_datetime(data['timestamp']).dt.dayofyear.to_numpy(dtype=np.int16)
+  train_val, test = train_test_split(day_of_year, test_size=0.2, shuffle=False)
+  train, val = train_test_split(train_val, test_size=0.25, shuffle=False)
+
+  windows = {}
+  for split, values in [("train", train), ("val", val), ("test", test)]:
+    windows[f"{split}_doy"] = lazy_windows(values[:, None], sliding_window_size, stride, subsample)[:, :, 0].astype(np.int16)
+  return windows
+
+
+def lazy_windows(values, window_size, stride = None, subsample = 1):
+  """
+  Segments a time series into windows without copying them. The series is converted to float32 once and every window
+  is a read-only view into it, so the windows take no memory of their own, however much they overlap.
+  Args:
+    values (np.ndarray): Time series of shape [time, features].
+    window_size (int): Number of time steps per window.
+    stride (int, optional): Number of time steps between the starts of two windows. Defaults to the window size.
+    subsample (int, optional): Keep only every n-th window. Defaults to 1.
+  Returns:
+    np.ndarray: Read-only view of shape [windows, window_size, features].
+  """
+  base = np.ascontiguousarray(values, dtype=np.float32)
+  if len(base) < window_size:
+    return np.empty((0, window_size, base.shape[1]), dtype=np.float32)
+  # sliding_window_view appends the window axis last: [start, features, window_size]
+  windows = sliding_window_view(base, window_size, axis=0).transpose(0, 2, 1)
+  return windows[::(stride or window_size) * subsample]
+
+
+def subseq_missing_mask(shape, miss_rate, gap_len, rng = None):
+  """
+  Creates the mask of artificially missing values for windows, following the "subseq" pattern of benchpots' create_missingness:
+  every feature of every window loses miss_rate of its time steps in gaps of gap_len consecutive steps.
+  The gaps are placed on non-overlapping slots, so the missing rate is met exactly.
+  Args:
+    shape (tuple): Shape of the windows, [windows, n_steps, features].
+    miss_rate (float): Proportion of missing values per feature and window.
+    gap_len (int): Length of every gap.
+    rng (np.random.Generator, optional): Random generator. Defaults to a new unseeded generator.
+  Returns:
+    np.ndarray: Boolean mask of the given shape, True for the artificially missing values.
+  """
+  rng = rng if rng is not None else np.random.default_rng()
+  n_windows, n_steps, n_features = shape
+  n_slots = n_steps // gap_len
+  n_gaps = min(n_slots, int(round(n_steps * miss_rate / gap_len)))
+
+  # A random permutation of the slots of every window and feature, of which the first n_gaps become gaps
+  slots = np.argsort(rng.random((n_windows, n_features, n_slots)), axis=2)[:, :, :n_gaps]
+  gaps = np.zeros((n_windows, n_features, n_slots), dtype=bool)
+  np.put_along_axis(gaps, slots, True, axis=2)
+
+  mask = np.zeros((n_windows, n_features, n_steps), dtype=bool)
+  mask[:, :, :n_slots * gap_len] = np.repeat(gaps, gap_len, axis=2)
+  return mask.transpose(0, 2, 1)
+
+
+def apply_missingness(windows, mask):
+  """
+  Materializes windows with their artificially missing values set to NaN, e.g. right before handing them to a model.
+  This is the only copy of the windows, as float32.
+  Args:
+    windows (np.ndarray): Windows of shape [windows, n_steps, features], see lazy_windows.
+    mask (np.ndarray): Boolean mask of the same shape, see subseq_missing_mask.
+  Returns:
+    np.ndarray: The windows with NaN where the mask is True.
+  """
+  return np.where(mask, np.float32(np.nan), windows)
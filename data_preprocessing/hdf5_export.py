@@ -0,0 +1,76 @@
+import os
+import h5py
+import numpy as np
+
+
+SPLITS = ["train", "val", "test"]
+
+
+def export_dataset_hdf5(dataset, directory, chunk_windows = 256, compression = None) -> dict:
+  """
+  Writes the splits of a preprocessed dataset (see preprocess_dwd) into one HDF5 file per split, laid out the way PyPOTS
+  reads datasets lazily from files: "X" holds the windows with the artificially missing values as NaN and "X_ori" the
+  original windows, both float32 of shape [windows, n_steps, features] and chunked by windows, so PyPOTS' data loaders
+  only read the batches they need. The day of year of the windows is stored as "doy" if the dataset has it.
+  Lazy datasets additionally store their "missing_mask" and are written chunk by chunk,
+  so the windows with missing values never exist in memory as a whole.
+  Args:
+    dataset (dict): Dataset with "<split>_X" and "<split>_X_ori", or "<split>_X_ori" and "<split>_X_mask" (lazy) entries.
+    directory (str): Directory the files "train.h5", "val.h5" and "test.h5" are written to.
+    chunk_windows (int, optional): Number of windows per HDF5 chunk. Defaults to 256.
+    compression (str, optional): HDF5 compression filter, e.g. "lzf". Defaults to None, which reads fastest.
+  Returns:
+    dict: Path of the file of every split, e.g. to pass as train_set, val_set and test_set to PyPOTS models.
+  """
+  os.makedirs(directory, exist_ok=True)
+
+  paths = {}
+  for split in SPLITS:
+    X_ori = dataset[f"{split}_X_ori"]
+    mask = dataset.get(f"{split}_X_mask")
+    X = dataset.get(f"{split}_X")
+    chunks = (max(1, min(chunk_windows, len(X_ori))),) + X_ori.shape[1:]
+
+    path = os.path.join(directory, f"{split}.h5")
+    tmp_path = f"{path}.tmp"
+    with h5py.File(tmp_path, "w") as f:
+      f.attrs["n_steps"] = dataset["n_steps"]
+      f.attrs["n_features"] = dataset["n_features"]
+      X_ori_data = f.create_dataset("X_ori", shape=X_ori.shape, dtype=np.float32, chunks=chunks, compression=compression)
+      X_data = f.create_dataset("X", shape=X_ori.shape, dtype=np.float32, chunks=chunks, compression=compression)
+      mask_data = f.create_dataset("missing_mask", shape=X_ori.shape, dtype=bool, chunks=chunks, compression=compression) if mask is not None else None
+
+      for begin in range(0, len(X_ori), chunks[0]):
+        end = begin + chunks[0]
+        X_ori_data[begin:end] = X_ori[begin:end]
+        if mask is not None:
+          mask_data[begin:end] = mask[begin:end]
+          X_data[begin:end] = np.where(mask[begin:end], np.float32(np.nan), X_ori[begin:end])
+        else:
+          X_data[begin:end] = X[begin:end]
+
+      if f"{split}_doy" in dataset:
+        f.create_dataset("doy", data=np.asarray(dataset[f"{split}_doy"]))
+    os.replace(tmp_path, path)
+
+    paths[split] = path
+    print(f"Exported {len(X_ori)} {split} windows to {path}")
+
+  return paths
+
+
+def dataset_nbytes(dataset) -> int:
+  """
+  Returns the number of bytes the arrays of a dataset take once they are loaded into memory.
+  """
+  return sum(value.size * value.itemsize for value in dataset.values() if isinstance(value, np.ndarray))
+
+
+def load_array(data, key = "X_ori") -> np.ndarray:
+  """
+  Returns an array of a dataset that was given either as dict or as HDF5 file path, see export_dataset_hdf5.
+  """
+  if isinstance(data, str):
+    with h5py.File(data, "r") as f:
+      return f[key][:]
+  return data[key]
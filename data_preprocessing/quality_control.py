@@ -0,0 +1,198 @@
+import warnings
+import numpy as np
+
+from models import QCFlag
+from data_preprocessing.tensor_builder import rows_to_tensor
+
+
+def grid_from_rows(sensor_index, timestamps, values, n_sensors, step, start = None):
+  """
+  Places long-format measurement rows onto a regular [time, sensors] grid in one vectorized pass.
+  Every row falls into the cell of its sensor and the time step its timestamp is floored to, see rows_to_tensor.
+  Cells hit by more than one row hold the mean of their values, cells without a row are NaN.
+  Args:
+    sensor_index (np.ndarray): Column of every row in the grid (0 <= index < n_sensors).
+    timestamps (np.ndarray): Timestamp of every row in seconds.
+    values (np.ndarray): Value of every row.
+    n_sensors (int): Number of columns of the grid.
+    step (int): Length of a time step in seconds.
+    start (int, optional): Timestamp of the first time step. Defaults to the earliest timestamp floored to the step.
+  Returns:
+    tuple: The grid (np.ndarray [time, sensors], float64), the timestamp of its first step and the time index of every row.
+  """
+  timestamps = np.asarray(timestamps, dtype=np.int64)
+  values = np.asarray(values, dtype=np.float64)
+  sensor_index = np.asarray(sensor_index, dtype=np.int64)
+
+  if start is None:
+    start = int(timestamps.min() // step * step) if len(timestamps) else 0
+  time_index = (timestamps - start) // step
+  n_steps = int(time_index.max()) + 1 if len(time_index) else 0
+
+  grid, _ = rows_to_tensor(time_index, sensor_index, np.zeros_like(time_index), values, (n_steps, n_sensors, 1), dtype=np.float64)
+  return grid[:, :, 0], start, time_index
+
+
+def spatial_outlier_flags(values, positions = None, radius_km = None, z_min = -2.33, z_max = 1.65, min_stations = 5, chunk_size = 256):
+  """
+  Flags values that deviate from the other stations at the same time step, using a robust z-score
+  (median and scaled median absolute deviation instead of mean and standard deviation).
+  By default all stations of the grid are compared with each other like CrowdQC's m2 check, whose thresholds correspond to
+  the 1% and 95% quantiles of a normal distribution, since warm outliers (sun exposure, indoor placement) are the common error.
+  If a radius is given, every station is only compared with its neighbours within that radius.
+  Args:
+    values (np.ndarray): Values of shape [time, stations] with NaN for missing values.
+    positions (np.ndarray, optional): Latitude and longitude of every station, shape [stations, 2]. Required with radius_km.
+    radius_km (float, optional): Neighbourhood radius. Defaults to None, comparing all stations.
+    z_min (float, optional): Lowest accepted z-score. Defaults to -2.33.
+    z_max (float, optional): Highest accepted z-score. Defaults to 1.65.
+    min_stations (int, optional): Minimum number of values a reference needs, otherwise nothing is flagged. Defaults to 5.
+    chunk_size (int, optional): Number of time steps processed at once in neighbour mode, bounds the memory. Defaults to 256.
+  Returns:
+    np.ndarray: Boolean array of shape [time, stations], True for outliers.
+  """
+  if radius_km is None:
+    with warnings.catch_warnings():
+      # np.nanmedian warns for time steps without any value, which are expected in sparse crowdsourced data
+      warnings.simplefilter("ignore", RuntimeWarning)
+      median = np.nanmedian(values, axis=1, keepdims=True)
+      mad = np.nanmedian(np.abs(values - median), axis=1, keepdims=True) * 1.4826
+    counts = np.sum(~np.isnan(values), axis=1, keepdims=True)
+    return _outside(values, median, mad, counts, z_min, z_max, min_stations)
+
+  if positions is None:
+    raise Exception("Positions of the stations are required to compare them with their neighbours.")
+
+  # Every station gets the column indices of its neighbours, padded with an index pointing to an all-NaN column
+  neighbours = haversine_distances(positions) <= radius_km
+  n_stations = values.shape[1]
+  n_neighbours = neighbours.sum(axis=1)
+  neighbour_index = np.full((n_stations, n_neighbours.max()), n_stations)
+  rows, columns = np.nonzero(neighbours)
+  neighbour_index[rows, np.arange(len(rows)) - np.repeat(np.cumsum(n_neighbours) - n_neighbours, n_neighbours)] = columns
+
+  outliers = np.zeros(values.shape, dtype=bool)
+  for begin in range(0, values.shape[0], chunk_size):
+    chunk = values[begin:begin + chunk_size]
+    padded = np.concatenate([chunk, np.full((chunk.shape[0], 1), np.nan)], axis=1)
+    # [time, station, neighbour]
+    reference = padded[:, neighbour_index]
+    with warnings.catch_warnings():
+      warnings.simplefilter("ignore", RuntimeWarning)
+      median = np.nanmedian(reference, axis=2)
+      mad = np.nanmedian(np.abs(reference - median[:, :, None]), axis=2) * 1.4826
+    counts = np.sum(~np.isnan(reference), axis=2)
+    outliers[begin:begin + chunk_size] = _outside(chunk, median, mad, counts, z_min, z_max, min_stations)
+
+  return outliers
+
+
+def spike_flags(values, max_delta):
+  """
+  Flags isolated spikes: values that differ by more than max_delta from both the previous and the next time step
+  of the same station. Values next to a missing value are not judged, since a single jump can't be told apart from a level shift.
+  Args:
+    values (np.ndarray): Values of shape [time, stations].
+    max_delta (float): Largest plausible change between two time steps.
+  Returns:
+    np.ndarray: Boolean array of shape [time, stations], True for spikes.
+  """
+  jumps = np.abs(np.diff(values, axis=0))
+  spikes = np.zeros(values.shape, dtype=bool)
+  with np.errstate(invalid="ignore"):
+    spikes[1:-1] = (jumps[:-1] > max_delta) & (jumps[1:] > max_delta)
+  return spikes
+
+
+def constant_flags(values, min_run_length):
+  """
+  Flags values that are part of a run of at least min_run_length identical consecutive values of a station (stuck sensors).
+  Args:
+    values (np.ndarray): Values of shape [time, stations].
+    min_run_length (int): Number of identical values from which on a run is flagged.
+  Returns:
+    np.ndarray: Boolean array of shape [time, stations], True for values of constant runs.
+  """
+  series = values.T
+  starts = np.ones(series.shape, dtype=bool)
+  # NaN never equals NaN, so missing values always end a run
+  starts[:, 1:] = series[:, 1:] != series[:, :-1]
+
+  run_ids = np.cumsum(starts.ravel()) - 1
+  run_lengths = np.bincount(run_ids)[run_ids].reshape(series.shape)
+  return ((run_lengths >= min_run_length) & ~np.isnan(series)).T
+
+
+def coverage_flags(values, period, max_missing_fraction):
+  """
+  Flags all values of a station within a period (a block of time steps) in which too many of its values are missing.
+  Args:
+    values (np.ndarray): Values of shape [time, stations].
+    period (int): Number of time steps per block, e.g. 24*30 for months of hourly values.
+    max_missing_fraction (float): Highest accepted fraction of missing values per block.
+  Returns:
+    np.ndarray: Boolean array of shape [time, stations], True for values in insufficiently covered blocks.
+  """
+  n_steps, n_stations = values.shape
+  n_blocks = -(-n_steps // period)
+  missing = np.ones((n_blocks * period, n_stations), dtype=bool)
+  missing[:n_steps] = np.isnan(values)
+
+  missing_fraction = missing.reshape(n_blocks, period, n_stations).mean(axis=1)
+  # The last block is only judged by the time steps it actually has
+  if n_steps % period:
+    missing_fraction[-1] = np.isnan(values[(n_blocks - 1) * period:]).mean(axis=0)
+
+  return np.repeat(missing_fraction > max_missing_fraction, period, axis=0)[:n_steps]
+
+
+def run_quality_control(values, positions = None, radius_km = None, z_min = -2.33, z_max = 1.65, max_delta = None, min_run_length = None, coverage_period = None, max_missing_fraction = 0.2):
+  """
+  Runs all quality control checks over the values of many stations and combines their results into QCFlag bit flags.
+  Checks without their parameter (max_delta, min_run_length, coverage_period) are skipped. Nothing is removed,
+  callers decide which flags they filter by.
+  Args:
+    values (np.ndarray): Values of shape [time, stations] on a regular time grid, NaN for missing values.
+    positions (np.ndarray, optional): Latitude and longitude of every station, see spatial_outlier_flags.
+    radius_km (float, optional): Neighbourhood radius of the spatial check. Defaults to None, comparing all stations.
+    z_min (float, optional): Lowest accepted robust z-score. Defaults to -2.33.
+    z_max (float, optional): Highest accepted robust z-score. Defaults to 1.65.
+    max_delta (float, optional): Largest plausible change between two time steps. Defaults to None.
+    min_run_length (int, optional): Length from which on identical consecutive values are flagged. Defaults to None.
+    coverage_period (int, optional): Number of time steps per block of the coverage check. Defaults to None.
+    max_missing_fraction (float, optional): Highest accepted fraction of missing values per block. Defaults to 0.2.
+  Returns:
+    np.ndarray: Flags of shape [time, stations] (uint8), see QCFlag.
+  """
+  values = np.asarray(values, dtype=np.float64)
+  flags = np.zeros(values.shape, dtype=np.uint8)
+
+  flags[np.isnan(values)] |= np.uint8(QCFlag.MISSING)
+  flags[spatial_outlier_flags(values, positions, radius_km, z_min, z_max)] |= np.uint8(QCFlag.SPATIAL_OUTLIER)
+  if max_delta is not None:
+    flags[spike_flags(values, max_delta)] |= np.uint8(QCFlag.SPIKE)
+  if min_run_length is not None:
+    flags[constant_flags(values, min_run_length)] |= np.uint8(QCFlag.CONSTANT)
+  if coverage_period is not None:
+    flags[coverage_flags(values, coverage_period, max_missing_fraction)] |= np.uint8(QCFlag.LOW_COVERAGE)
+
+  return flags
+
+
+def haversine_distances(positions):
+  """
+  Distances in kilometers between all pairs of positions given as [stations, 2] array of latitude and longitude.
+  """
+  latitudes, longitudes = np.radians(positions[:, 0]), np.radians(positions[:, 1])
+  delta_lat = latitudes[:, None] - latitudes[None, :]
+  delta_lon = longitudes[:, None] - longitudes[None, :]
+  a = np.sin(delta_lat / 2) ** 2 + np.cos(latitudes[:, None]) * np.cos(latitudes[None, :]) * np.sin(delta_lon / 2) ** 2
+  return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _outside(values, median, mad, counts, z_min, z_max, min_stations):
+  deviation = values - median
+  with np.errstate(invalid="ignore", divide="ignore"):
+    # Without any spread every deviation from the median is an outlier, values equal to it get a NaN score and pass
+    z = np.where(mad == 0, np.sign(deviation) * np.inf, deviation / mad)
+  return ((z < z_min) | (z > z_max)) & (counts >= min_stations)
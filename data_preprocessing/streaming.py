@@ -0,0 +1,142 @@
+import os
+import math
+import numpy as np
+import pandas as pd
+
+from numpy.lib.format import open_memmap
+from sklearn.preprocessing import StandardScaler
+
+from data_preprocessing.dwd import lazy_windows, subseq_missing_mask
+from data_preprocessing.tensor_builder import build_sensor_tensor
+
+
+SPLITS = ["train", "val", "test"]
+
+
+def array_chunks(array, chunk_size = 100000):
+  """
+  Returns a chunk source over an array of shape [time, ...], e.g. a memory-mapped tensor, see preprocess_streaming.
+  Every chunk is flattened to [time, features], so [time, sensors, features] tensors give one column per sensor and feature.
+  Args:
+    array (np.ndarray): The array, only chunk_size time steps of it are read at once.
+    chunk_size (int, optional): Number of time steps per chunk. Defaults to 100000.
+  Returns:
+    tuple: The chunk source (a function returning a new iterator over the chunks) and the number of time steps.
+  """
+  def chunks():
+    for begin in range(0, len(array), chunk_size):
+      chunk = np.asarray(array[begin:begin + chunk_size], dtype=np.float32)
+      yield chunk.reshape(len(chunk), -1)
+  return chunks, len(array)
+
+
+def db_tensor_chunks(db, sensors, measurement_types, from_timestamp, to_timestamp, step, chunk_steps = 24*365):
+  """
+  Returns a chunk source that loads a multi-sensor tensor (see build_sensor_tensor) from the database time range by time range,
+  so only chunk_steps time steps of all sensors are in memory at once.
+  Args:
+    db (SensorDB): The database to load from.
+    sensors, measurement_types, from_timestamp, to_timestamp, step: See build_sensor_tensor.
+    chunk_steps (int, optional): Number of time steps per chunk. Defaults to one year of hourly steps.
+  Returns:
+    tuple: The chunk source (a function returning a new iterator over the chunks) and the number of time steps.
+  """
+  start = int(pd.Timestamp(from_timestamp).timestamp()) // step * step
+  end = int(pd.Timestamp(to_timestamp).timestamp())
+  n_rows = (end - start) // step + 1
+
+  def chunks():
+    for begin in range(0, n_rows, chunk_steps):
+      chunk_from = pd.Timestamp(start + begin * step, unit="s")
+      chunk_to = pd.Timestamp(start + (min(begin + chunk_steps, n_rows) - 1) * step, unit="s")
+      tensor = build_sensor_tensor(db, sensors, measurement_types, str(chunk_from), str(chunk_to), step)["tensor"]
+      yield tensor.reshape(len(tensor), -1)
+  return chunks, n_rows
+
+
+def split_bounds(n_rows) -> dict:
+  """
+  Returns the (begin, end) rows of the splits, identical to the chronological 60/20/20 split of preprocess_dwd.
+  """
+  n_test = math.ceil(n_rows * 0.2)
+  n_train_val = n_rows - n_test
+  n_val = math.ceil(n_train_val * 0.25)
+  n_train = n_train_val - n_val
+  return {"train": (0, n_train), "val": (n_train, n_train_val), "test": (n_train_val, n_rows)}
+
+
+def _split_parts(chunks, bounds):
+  """
+  Yields (split, rows) for the parts of every chunk that fall into the splits, and stops reading after the last split.
+  """
+  offset = 0
+  last_row = max(end for _, end in bounds.values())
+  for chunk in chunks:
+    if offset >= last_row:
+      break
+    for split, (begin, end) in bounds.items():
+      part = chunk[max(begin - offset, 0):max(end - offset, 0)]
+      if len(part):
+        yield split, part
+    offset += len(chunk)
+
+
+def preprocess_streaming(chunk_source, n_rows, directory, sliding_window_size = 150, gap_len = 10, miss_rate = 0.2,
+                         stride = None, subsample = 1, seed = None, chunk_windows = 1024) -> dict:
+  """
+  Prepares a time series that does not fit into memory, e.g. all Netatmo stations of a region, like preprocess_dwd(lazy=True).
+  The data is read twice chunk by chunk: first the scaler is fitted with partial_fit on the training rows, then every chunk is
+  scaled and written to one memory-mapped .npy file per split. The windows and masks are cut from these files and written to
+  disk in blocks of chunk_windows, so neither the raw nor the windowed data is ever in memory as a whole.
+  Missing values (NaN) are ignored by the scaler and stay NaN.
+  Args:
+    chunk_source (callable): Function returning a new iterator over chunks of shape [time, features], see array_chunks
+      and db_tensor_chunks.
+    n_rows (int): Number of time steps of all chunks together.
+    directory (str): Directory the .npy files are written to.
+    sliding_window_size, gap_len, miss_rate, stride, subsample, seed: See preprocess_dwd.
+    chunk_windows (int, optional): Number of windows written at once. Defaults to 1024.
+  Returns:
+    dict: The dataset in the lazy format of preprocess_dwd, with memory-mapped "<split>_X_ori" and "<split>_X_mask" arrays.
+  """
+  os.makedirs(directory, exist_ok=True)
+  bounds = split_bounds(n_rows)
+
+  scaler = StandardScaler()
+  for _, rows in _split_parts(chunk_source(), {"train": bounds["train"]}):
+    scaler.partial_fit(rows)
+  n_features = scaler.n_features_in_
+
+  series = {split: open_memmap(os.path.join(directory, f"{split}_series.npy"), mode="w+", dtype=np.float32, shape=(end - begin, n_features))
+            for split, (begin, end) in bounds.items()}
+  written = {split: 0 for split in SPLITS}
+  for split, rows in _split_parts(chunk_source(), bounds):
+    series[split][written[split]:written[split] + len(rows)] = scaler.transform(rows)
+    written[split] += len(rows)
+
+  rng = np.random.default_rng(seed)
+  dataset = {
+    "n_steps": sliding_window_size,
+    "n_features": n_features,
+    "scaler": scaler,
+  }
+  for split in SPLITS:
+    series[split].flush()
+    windows = lazy_windows(series[split], sliding_window_size, stride, subsample)
+    X_ori = open_memmap(os.path.join(directory, f"{split}_X_ori.npy"), mode="w+", dtype=np.float32, shape=windows.shape)
+    mask = open_memmap(os.path.join(directory, f"{split}_X_mask.npy"), mode="w+", dtype=bool, shape=windows.shape)
+    for begin in range(0, len(windows), chunk_windows):
+      block = windows[begin:begin + chunk_windows]
+      X_ori[begin:begin + len(block)] = block
+      mask[begin:begin + len(block)] = subseq_missing_mask(block.shape, miss_rate, gap_len, rng)
+    X_ori.flush()
+    mask.flush()
+    del series[split], windows, X_ori, mask
+
+    # Reopened read-only, like the arrays of the dataset cache
+    dataset[f"{split}_X_ori"] = np.load(os.path.join(directory, f"{split}_X_ori.npy"), mmap_mode="r")
+    dataset[f"{split}_X_mask"] = np.load(os.path.join(directory, f"{split}_X_mask.npy"), mmap_mode="r")
+    os.remove(os.path.join(directory, f"{split}_series.npy"))
+    print(f"Wrote {len(dataset[f'{split}_X_ori'])} {split} windows to {directory}")
+
+  return dataset
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from db import SensorDB
+from models import MeasurementType, Sensor
+
+
+def rows_to_tensor(time_index, sensor_index, feature_index, values, shape, dtype = np.float32):
+  """
+  Places long-format measurement rows into a dense [time, sensors, features] tensor in one vectorized pass.
+  Rows outside the shape are ignored and cells hit by more than one row hold the mean of their values.
+  Args:
+    time_index (np.ndarray): Time step of every row.
+    sensor_index (np.ndarray): Sensor of every row.
+    feature_index (np.ndarray): Feature of every row.
+    values (np.ndarray): Value of every row, NaN values are ignored.
+    shape (tuple): Shape of the tensor, (time steps, sensors, features).
+    dtype (np.dtype, optional): Type of the tensor. Defaults to np.float32.
+  Returns:
+    tuple: The tensor (np.ndarray, NaN for cells without a value) and its observed mask (np.ndarray, bool).
+  """
+  time_index = np.asarray(time_index, dtype=np.int64)
+  sensor_index = np.asarray(sensor_index, dtype=np.int64)
+  feature_index = np.asarray(feature_index, dtype=np.int64)
+  values = np.asarray(values, dtype=np.float64)
+
+  valid = ~np.isnan(values) & (time_index >= 0) & (time_index < shape[0])
+  cells = np.ravel_multi_index((time_index[valid], sensor_index[valid], feature_index[valid]), shape)
+  size = int(np.prod(shape))
+
+  # bincount sums all rows of a cell at once, which is much faster than np.add.at for millions of rows
+  sums = np.bincount(cells, weights=values[valid], minlength=size)
+  counts = np.bincount(cells, minlength=size)
+
+  observed = (counts > 0).reshape(shape)
+  with np.errstate(invalid="ignore", divide="ignore"):
+    tensor = (sums / counts).astype(dtype, copy=False).reshape(shape)
+  return tensor, observed
+
+
+def build_sensor_tensor(db: SensorDB, sensors: list[Sensor], measurement_types: list[MeasurementType], from_timestamp: str, to_timestamp: str, step: int,
+                        aggregated = False, aggregation_interval = None, aggregation_method = None) -> dict:
+  """
+  Aligns the measurements of many sensors, of any source, onto one regular time grid.
+  Every measurement type is loaded for all sensors with a single query and placed with rows_to_tensor, so no per-sensor
+  merges are needed and days on which only some values are missing keep all their other values.
+  The tensor feeds the windowing of preprocess_dwd directly, e.g. lazy_windows(result["tensor"].reshape(n_steps, -1), ...)
+  for windows with sensors × features columns.
+  Args:
+    db (SensorDB): The database to load from.
+    sensors (list[Sensor]): The stored sensors, in the order of the sensor axis.
+    measurement_types (list[MeasurementType]): The measurement types, in the order of the feature axis.
+    from_timestamp (str): Start of the grid (inclusive), in the ISO 8601 format (YYYY-MM-DD HH:MI:SS).
+    to_timestamp (str): End of the grid (inclusive), in the ISO 8601 format (YYYY-MM-DD HH:MI:SS).
+    step (int): Length of a time step in seconds, measurements are assigned to the step they fall into.
+    aggregated (bool, optional): Load aggregated measurements. Defaults to False.
+    aggregation_interval (int, optional): Aggregation interval of aggregated measurements. Defaults to None.
+    aggregation_method (str, optional): Aggregation method of aggregated measurements. Defaults to None.
+  Returns:
+    dict: The 'tensor' ([time, sensors, features], float32, NaN if missing), its 'observed_mask', the 'timestamps' of the
+          time steps (np.ndarray, datetime64), the 'sensor_ids' and the 'measurement_types' of the axes.
+  """
+  start = int(pd.Timestamp(from_timestamp).timestamp()) // step * step
+  end = int(pd.Timestamp(to_timestamp).timestamp())
+  shape = ((end - start) // step + 1, len(sensors), len(measurement_types))
+
+  sensor_ids = np.array([sensor.sensor_id for sensor in sensors], dtype=np.int64)
+  order = np.argsort(sensor_ids)
+
+  time_index, sensor_index, feature_index, values = [], [], [], []
+  for feature, measurement_type in enumerate(measurement_types):
+    rows = db.get_measurement_arrays(sensor_ids.tolist(), measurement_type.value, from_timestamp, to_timestamp,
+                                     aggregated, aggregation_interval, aggregation_method)
+    time_index.append((rows["timestamp"] - start) // step)
+    sensor_index.append(order[np.searchsorted(sensor_ids, rows["sensor_id"], sorter=order)])
+    feature_index.append(np.full(len(rows["value"]), feature, dtype=np.int64))
+    values.append(rows["value"])
+
+  tensor, observed_mask = rows_to_tensor(np.concatenate(time_index), np.concatenate(sensor_index),
+                                         np.concatenate(feature_index), np.concatenate(values), shape)
+
+  print(f"Built a {shape[0]}x{shape[1]}x{shape[2]} tensor, {observed_mask.mean() * 100:.1f}% of its values are observed")
+  return {
+    "tensor": tensor,
+    "observed_mask": observed_mask,
+    "timestamps": np.datetime64(start, "s") + np.arange(shape[0]) * np.timedelta64(step, "s"),
+    "sensor_ids": sensor_ids,
+    "measurement_types": list(measurement_types),
+  }
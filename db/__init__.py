@@ -1,5 +1,7 @@
 import psycopg2
+import numpy as np
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from typing import List
 from models import Measurement, AggregatedMeasurement, MeasurementType, Position, Sensor, Rectangle
 
@@ -9,6 +11,7 @@ class DBConfig:
     SENSOR_MEASUREMENT_TYPE_TABLE = "sensor_measurement_types"
     MEASUREMENT_TABLE = "measurement" 
     AGGREGATED_MEASUREMENT_TABLE ="agr_measurements"
+    QC_FLAG_TABLE = "measurement_qc_flags"
     
     def __init__(self, dbname, user, password, host, port):
         self.dbname = dbname
@@ -27,6 +30,8 @@ class DBConfig:
             }
 
 class SensorDB:
+    BATCH_PAGE_SIZE = 1000
+
     def __init__(self, config: DBConfig):
         self.config = config
         self.connection = None
@@ -328,7 +333,7 @@ class SensorDB:
 
             insert_query = sql.SQL("""
                 INSERT INTO {table} (measurement_type, position, timestamp, unit, value, sensor_id)
-                VALUES (%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s)
+                VALUES %s
             """).format(table=sql.Identifier(DBConfig.MEASUREMENT_TABLE))
 
             batch_data = [
@@ -344,10 +349,13 @@ class SensorDB:
                 for measurement in measurements
             ]
 
-            cursor.executemany(insert_query, batch_data)
+            # execute_values sends the rows in a few multi-row INSERTs instead of one statement per row
+            execute_values(cursor, insert_query, batch_data,
+                           template="(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s)",
+                           page_size=self.BATCH_PAGE_SIZE)
             self.connection.commit()
-            print(f"{cursor.rowcount} measurements added successfully.")
-            return cursor.rowcount
+            print(f"{len(batch_data)} measurements added successfully.")
+            return len(batch_data)
 
         except Exception as e:
             print(f"Error adding batch measurements: {e}")
@@ -371,7 +379,7 @@ class SensorDB:
 
             insert_query = sql.SQL("""
                 INSERT INTO {table} (measurement_type, position, timestamp, unit, value, sensor_id, agr_interval_sec, agr_method)
-                VALUES (%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s)
+                VALUES %s
             """).format(table=sql.Identifier(DBConfig.AGGREGATED_MEASUREMENT_TABLE))
 
             batch_data = [
@@ -389,10 +397,12 @@ class SensorDB:
                 for measurement in measurements
             ]
 
-            cursor.executemany(insert_query, batch_data)
+            execute_values(cursor, insert_query, batch_data,
+                           template="(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s, %s, %s, %s, %s)",
+                           page_size=self.BATCH_PAGE_SIZE)
             self.connection.commit()
-            print(f"{cursor.rowcount} aggregated measurements added successfully.")
-            return cursor.rowcount
+            print(f"{len(batch_data)} aggregated measurements added successfully.")
+            return len(batch_data)
 
         except Exception as e:
             print(f"Error adding batch aggregated measurements: {e}")
@@ -640,6 +650,313 @@ class SensorDB:
                 cursor.close()
             self.close()
             
+    def get_measurement_watermark(self, sensor_id: int, measurement_types: List[int], from_timestamp: str = None, to_timestamp: str = None) -> tuple:
+        """
+        Retrieves the number of measurements and their latest timestamp for some measurement types of a sensor in a single query.
+        Together they change whenever measurements in the range are added, removed or backfilled.
+
+        :param sensor_id: The ID of the sensor
+        :param measurement_types: The measurement types to count
+        :param from_timestamp: Optional timestamp to count measurements from (inclusive). The timestamp should be in the ISO 8601 format (YYYY-MM-DD HH:MI:SS)
+        :param to_timestamp: Optional timestamp to count measurements up to (inclusive). The timestamp should be in the ISO 8601 format (YYYY-MM-DD HH:MI:SS)
+        :return: A tuple of the number of measurements and the latest timestamp (None if there are none), or None on an error
+        """
+        try:
+            self.connect()
+            cursor = self.connection.cursor()
+
+            query = sql.SQL("""
+                SELECT COUNT(*), MAX(timestamp)
+                FROM {table}
+                WHERE sensor_id = %s AND measurement_type = ANY(%s)
+            """).format(table=sql.Identifier(DBConfig.MEASUREMENT_TABLE))
+
+            params = [sensor_id, list(measurement_types)]
+
+            if from_timestamp is not None:
+                query += sql.SQL(" AND timestamp >= %s")
+                params.append(from_timestamp)
+
+            if to_timestamp is not None:
+                query += sql.SQL(" AND timestamp <= %s")
+                params.append(to_timestamp)
+
+            cursor.execute(query, tuple(params))
+            count, latest_timestamp = cursor.fetchone()
+            return count, latest_timestamp
+
+        except Exception as e:
+            print(f"Error retrieving the measurement watermark of sensor {sensor_id}: {e}")
+            return None
+
+        finally:
+            if cursor:
+                cursor.close()
+            self.close()
+
+    def get_latest_timestamps_for_sensor(self, sensor_id: int, aggregated: bool = False, aggregation_interval: int = None) -> dict:
+        """
+        Retrieves the latest stored timestamp of every measurement type of a sensor in a single query.
+
+        :param sensor_id: The ID of the sensor
+        :param aggregated: If True, the aggregated measurements are queried, grouped by measurement type and aggregation method
+        :param aggregation_interval: Optional aggregation interval in seconds to filter the aggregated measurements by
+        :return: A dictionary mapping the measurement type (or a tuple of measurement type and aggregation method if aggregated) to the latest timestamp
+        """
+        try:
+            self.connect()
+            cursor = self.connection.cursor()
+
+            if aggregated:
+                query = sql.SQL("""
+                    SELECT measurement_type, agr_method, MAX(timestamp)
+                    FROM {table}
+                    WHERE sensor_id = %s
+                """).format(table=sql.Identifier(DBConfig.AGGREGATED_MEASUREMENT_TABLE))
+            else:
+                query = sql.SQL("""
+                    SELECT measurement_type, MAX(timestamp)
+                    FROM {table}
+                    WHERE sensor_id = %s
+                """).format(table=sql.Identifier(DBConfig.MEASUREMENT_TABLE))
+
+            params = [sensor_id]
+
+            if aggregated and aggregation_interval is not None:
+                query += sql.SQL(" AND agr_interval_sec = %s")
+                params.append(aggregation_interval)
+
+            if aggregated:
+                query += sql.SQL(" GROUP BY measurement_type, agr_method")
+            else:
+                query += sql.SQL(" GROUP BY measurement_type")
+
+            cursor.execute(query, tuple(params))
+            results = cursor.fetchall()
+
+            if aggregated:
+                return {(result[0], result[1]): result[2] for result in results}
+            return {result[0]: result[1] for result in results}
+
+        except Exception as e:
+            print(f"Error retrieving latest timestamps for sensor {sensor_id}: {e}")
+            return {}
+
+        finally:
+            if cursor:
+                cursor.close()
+            self.close()
+
+    def get_sensors_by_source(self, source: str) -> List[Sensor]:
+        """
+        Retrieves all sensors of a given source.
+
+        :param source: The source of the sensors
+        :return: List of Sensor objects ordered by their sensor_id
+        """
+        try:
+            self.connect()
+            cursor = self.connection.cursor()
+
+            query = sql.SQL("""
+                SELECT sensor_id, additional_information, original_id, 
+                       ST_AsText(position) AS position_wkt, 
+                       sensor_type, source
+                FROM {table}
+                WHERE source = %s
+                ORDER BY sensor_id
+            """).format(table=sql.Identifier(DBConfig.SENSOR_TABLE))
+
+            cursor.execute(query, (source,))
+            results = cursor.fetchall()
+
+            sensors = []
+            for result in results:
+                sensor = Sensor(
+                    sensor_id=result[0],
+                    additional_information=result[1],
+                    original_id=result[2],
+                    position=Position.from_wkt_position(result[3]),
+                    sensor_type=result[4],
+                    source=result[5]
+                )
+                sensors.append(sensor)
+
+            print(f"Retrieved {len(sensors)} sensors of source {source}.")
+            return sensors
+
+        except Exception as e:
+            print(f"Error retrieving sensors of source {source}: {e}")
+            return []
+
+        finally:
+            if cursor:
+                cursor.close()
+            self.close()
+
+    def get_measurement_arrays(self, sensor_ids: List[int], measurement_type: int, from_timestamp: str = None, to_timestamp: str = None, aggregated: bool = False, aggregation_interval: int = None, aggregation_method: str = None) -> dict:
+        """
+        Retrieves the measurements of many sensors for one measurement type with a single query as NumPy arrays.
+        Timestamps are returned as seconds since the epoch of the stored (time zone less) timestamps.
+
+        :param sensor_ids: The IDs of the sensors
+        :param measurement_type: The measurement type
+        :param from_timestamp: Optional timestamp to filter measurements from (inclusive), in the ISO 8601 format (YYYY-MM-DD HH:MI:SS)
+        :param to_timestamp: Optional timestamp to filter measurements up to (inclusive), in the ISO 8601 format (YYYY-MM-DD HH:MI:SS)
+        :param aggregated: If True, the aggregated measurements are queried
+        :param aggregation_interval: Optional aggregation interval in seconds to filter the aggregated measurements by
+        :param aggregation_method: Optional aggregation method to filter the aggregated measurements by
+        :return: A dictionary with the arrays 'sensor_id', 'timestamp' and 'value', ordered by sensor and timestamp
+        """
+        try:
+            self.connect()
+            cursor = self.connection.cursor()
+
+            table = DBConfig.AGGREGATED_MEASUREMENT_TABLE if aggregated else DBConfig.MEASUREMENT_TABLE
+            query = sql.SQL("""
+                SELECT sensor_id, EXTRACT(EPOCH FROM timestamp)::bigint, value
+                FROM {table}
+                WHERE sensor_id = ANY(%s) AND measurement_type = %s
+            """).format(table=sql.Identifier(table))
+
+            params = [list(sensor_ids), measurement_type]
+
+            if aggregated and aggregation_interval is not None:
+                query += sql.SQL(" AND agr_interval_sec = %s")
+                params.append(aggregation_interval)
+
+            if aggregated and aggregation_method is not None:
+                query += sql.SQL(" AND agr_method = %s")
+                params.append(aggregation_method)
+
+            if from_timestamp is not None:
+                query += sql.SQL(" AND timestamp >= %s")
+                params.append(from_timestamp)
+
+            if to_timestamp is not None:
+                query += sql.SQL(" AND timestamp <= %s")
+                params.append(to_timestamp)
+
+            query += sql.SQL(" ORDER BY sensor_id, timestamp")
+
+            cursor.execute(query, tuple(params))
+            results = cursor.fetchall()
+
+            arrays = {
+                "sensor_id": np.array([result[0] for result in results], dtype=np.int64),
+                "timestamp": np.array([result[1] for result in results], dtype=np.int64),
+                "value": np.array([result[2] for result in results], dtype=np.float64),
+            }
+            print(f"Retrieved {len(results)} {MeasurementType(measurement_type).name} measurements for {len(sensor_ids)} sensors.")
+            return arrays
+
+        except Exception as e:
+            print(f"Error retrieving measurements for {len(sensor_ids)} sensors: {e}")
+            return {"sensor_id": np.empty(0, dtype=np.int64), "timestamp": np.empty(0, dtype=np.int64), "value": np.empty(0)}
+
+        finally:
+            if cursor:
+                cursor.close()
+            self.close()
+
+    def create_qc_flag_table(self) -> bool:
+        """
+        Creates the table for quality control flags if it does not exist yet.
+        Flags are stored next to the measurements instead of removing flagged rows, keyed by sensor, measurement type, timestamp
+        and the aggregation of the flagged rows. Raw measurements are stored with an empty aggregation method and interval 0,
+        since the columns of a primary key can't be NULL. A table of an older version without the aggregation columns is migrated.
+
+        :return: True if the table exists afterwards, False otherwise
+        """
+        try:
+            self.connect()
+            cursor = self.connection.cursor()
+
+            create_query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    sensor_id INTEGER NOT NULL,
+                    measurement_type INTEGER NOT NULL,
+                    timestamp TIMESTAMP NOT NULL,
+                    aggregated BOOLEAN NOT NULL DEFAULT FALSE,
+                    agr_method TEXT NOT NULL DEFAULT '',
+                    agr_interval_sec INTEGER NOT NULL DEFAULT 0,
+                    flags SMALLINT NOT NULL,
+                    PRIMARY KEY (sensor_id, measurement_type, timestamp, aggregated, agr_method, agr_interval_sec)
+                )
+            """).format(table=sql.Identifier(DBConfig.QC_FLAG_TABLE))
+
+            cursor.execute(create_query)
+
+            cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'agr_interval_sec'",
+                           (DBConfig.QC_FLAG_TABLE,))
+            if cursor.fetchone() is None:
+                migrate_query = sql.SQL("""
+                    ALTER TABLE {table}
+                        ADD COLUMN aggregated BOOLEAN NOT NULL DEFAULT FALSE,
+                        ADD COLUMN agr_method TEXT NOT NULL DEFAULT '',
+                        ADD COLUMN agr_interval_sec INTEGER NOT NULL DEFAULT 0,
+                        DROP CONSTRAINT {pkey},
+                        ADD PRIMARY KEY (sensor_id, measurement_type, timestamp, aggregated, agr_method, agr_interval_sec)
+                """).format(table=sql.Identifier(DBConfig.QC_FLAG_TABLE),
+                            pkey=sql.Identifier(f"{DBConfig.QC_FLAG_TABLE}_pkey"))
+                cursor.execute(migrate_query)
+                print("Added the aggregation columns to the quality control flag table.")
+
+            self.connection.commit()
+            return True
+
+        except Exception as e:
+            print(f"Error creating quality control flag table: {e}")
+            return False
+
+        finally:
+            if cursor:
+                cursor.close()
+            self.close()
+
+    def upsert_batch_qc_flags(self, sensor_ids, measurement_type: int, timestamps, flags, aggregated: bool = False, aggregation_interval: int = None, aggregation_method: str = None) -> int:
+        """
+        Stores the quality control flags of many measurements, replacing flags of a previous run.
+
+        :param sensor_ids: The sensor ID of every flagged measurement
+        :param measurement_type: The measurement type of the flagged measurements
+        :param timestamps: The timestamp of every flagged measurement in seconds since the epoch, as returned by get_measurement_arrays
+        :param flags: The QCFlag bit flags of every measurement
+        :param aggregated: Whether the flagged measurements are aggregated measurements
+        :param aggregation_interval: The aggregation interval in seconds of aggregated measurements
+        :param aggregation_method: The aggregation method of aggregated measurements, e.g. MIN for the daily minimum
+        :return: The number of stored flags
+        """
+        try:
+            self.connect()
+            cursor = self.connection.cursor()
+
+            upsert_query = sql.SQL("""
+                INSERT INTO {table} (sensor_id, measurement_type, timestamp, aggregated, agr_method, agr_interval_sec, flags)
+                VALUES %s
+                ON CONFLICT (sensor_id, measurement_type, timestamp, aggregated, agr_method, agr_interval_sec) DO UPDATE SET flags = EXCLUDED.flags
+            """).format(table=sql.Identifier(DBConfig.QC_FLAG_TABLE))
+
+            aggregation = (True, aggregation_method or "", aggregation_interval or 0) if aggregated else (False, "", 0)
+            batch_data = [(sensor_id, measurement_type, timestamp, *aggregation, flag) for sensor_id, timestamp, flag
+                          in zip(np.asarray(sensor_ids).tolist(), np.asarray(timestamps).tolist(), np.asarray(flags).tolist())]
+
+            execute_values(cursor, upsert_query, batch_data,
+                           template="(%s, %s, to_timestamp(%s) AT TIME ZONE 'UTC', %s, %s, %s, %s)",
+                           page_size=self.BATCH_PAGE_SIZE)
+            self.connection.commit()
+            print(f"{len(batch_data)} quality control flags stored successfully.")
+            return len(batch_data)
+
+        except Exception as e:
+            print(f"Error storing quality control flags: {e}")
+            return 0
+
+        finally:
+            if cursor:
+                cursor.close()
+            self.close()
+
     def get_sensors_from_area(self, min_lat, min_lon, max_lat, max_lon): 
         """
         Retrieves all sensors within the specified bounding box (min_lat, min_lon, max_lat, max_lon).
@@ -1,13 +1,23 @@
 import os
+import io
+import glob
+import time
+import zipfile
+import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from db import SensorDB
-from models import Position, MeasurementType, AggregatedMeasurement, Sensor
+from db.dwd_station_catalog import DWDStationCatalog
+from models import Position, MeasurementType, AggregatedMeasurement, Sensor, Rectangle
 from typing import List
 
 class DWDInserter:
   IDENTIFIER = "DWD"
   TIME_COLUMN = "MESS_DATUM"
+  PRODUCT_PREFIX = "produkt_"
+  GEOGRAPHY_PREFIX = "Metadaten_Geographie"
   AGGREGATION_INTERVAL = 60*60*24 # 1 day in seconds
   DWD_TYPE_MAPPING = {
     "TMK": MeasurementType.TEMPERATURE,
@@ -29,21 +39,99 @@ class DWDInserter:
       MeasurementType.SUN: "AVERAGE",
       MeasurementType.HUMIDITY: "AVERAGE"
   }
+  # Aggregation method of values that are read at the end of their interval instead of aggregated over it
+  SAMPLE_METHOD = "SAMPLE"
+  # Products by the part of their file name between "produkt_" and the dates, e.g. "tu_stunde" for "produkt_tu_stunde_19510101_20231231_01975.txt".
+  # All products are stored as aggregated measurements with the interval and the aggregation method of every column, so the
+  # hourly, 10-minute and daily series of the same measurement type stay apart and each of them has its own watermark (see store_columns).
+  # The daily product keeps the methods of AGR_METHOD_MAPPING its stored rows were written with.
+  DEFAULT_PRODUCT = "klima_tag"
+  DWD_PRODUCTS = {
+    "klima_tag": {"time_format": "%Y%m%d", "interval": AGGREGATION_INTERVAL, "columns": DWD_TYPE_MAPPING, "methods": AGR_METHOD_MAPPING},
+    "tu_stunde": {"time_format": "%Y%m%d%H", "interval": 60*60, "columns": {
+      "TT_TU": MeasurementType.TEMPERATURE,
+      "RF_TU": MeasurementType.HUMIDITY,
+    }, "methods": {
+      MeasurementType.TEMPERATURE: SAMPLE_METHOD,
+      MeasurementType.HUMIDITY: SAMPLE_METHOD,
+    }},
+    "p0_stunde": {"time_format": "%Y%m%d%H", "interval": 60*60, "columns": {
+      "P": MeasurementType.PRESSURE,
+    }, "methods": {
+      MeasurementType.PRESSURE: SAMPLE_METHOD,
+    }},
+    "ff_stunde": {"time_format": "%Y%m%d%H", "interval": 60*60, "columns": {
+      "F": MeasurementType.WIND_STRENGTH,
+      "D": MeasurementType.WIND_ANGLE,
+    }, "methods": {
+      MeasurementType.WIND_STRENGTH: "AVERAGE",
+      MeasurementType.WIND_ANGLE: "AVERAGE",
+    }},
+    "rr_stunde": {"time_format": "%Y%m%d%H", "interval": 60*60, "columns": {
+      "R1": MeasurementType.RAIN_60MIN,
+    }, "methods": {
+      MeasurementType.RAIN_60MIN: "SUM",
+    }},
+    "n_stunde": {"time_format": "%Y%m%d%H", "interval": 60*60, "columns": {
+      "V_N": MeasurementType.CLOUD_COVERAGE,
+    }, "methods": {
+      MeasurementType.CLOUD_COVERAGE: SAMPLE_METHOD,
+    }},
+    "sd_stunde": {"time_format": "%Y%m%d%H:%M", "interval": 60*60, "columns": {
+      "SD_SO": MeasurementType.SUN,
+    }, "methods": {
+      MeasurementType.SUN: "SUM",
+    }},
+    "zehn_min_tu": {"time_format": "%Y%m%d%H%M", "interval": 60*10, "columns": {
+      "PP_10": MeasurementType.PRESSURE,
+      "TT_10": MeasurementType.TEMPERATURE,
+      "RF_10": MeasurementType.HUMIDITY,
+    }, "methods": {
+      MeasurementType.PRESSURE: SAMPLE_METHOD,
+      MeasurementType.TEMPERATURE: SAMPLE_METHOD,
+      MeasurementType.HUMIDITY: SAMPLE_METHOD,
+    }},
+    "zehn_min_ff": {"time_format": "%Y%m%d%H%M", "interval": 60*10, "columns": {
+      "FF_10": MeasurementType.WIND_STRENGTH,
+      "DD_10": MeasurementType.WIND_ANGLE,
+    }, "methods": {
+      MeasurementType.WIND_STRENGTH: "AVERAGE",
+      MeasurementType.WIND_ANGLE: "AVERAGE",
+    }},
+    "zehn_min_fx": {"time_format": "%Y%m%d%H%M", "interval": 60*10, "columns": {
+      "FX_10": MeasurementType.GUST_STRENGTH,
+    }, "methods": {
+      MeasurementType.GUST_STRENGTH: "MAX",
+    }},
+    "zehn_min_rr": {"time_format": "%Y%m%d%H%M", "interval": 60*10, "columns": {
+      "RWS_10": MeasurementType.RAIN,
+    }, "methods": {
+      MeasurementType.RAIN: "SUM",
+    }},
+    "zehn_min_sd": {"time_format": "%Y%m%d%H%M", "interval": 60*10, "columns": {
+      "SD_10": MeasurementType.SUN,
+    }, "methods": {
+      MeasurementType.SUN: "SUM",
+    }},
+  }
+  CHUNK_SIZE = 500000 # rows parsed at once
+  STORE_BATCH_SIZE = 100000 # measurements created and inserted at once
   
-  def __init__(self, db: SensorDB):
+  def __init__(self, db: SensorDB, catalog: DWDStationCatalog = None):
     self.db = db
+    self.catalog = catalog
     
   def get_sensor_by_id(self, originial_id) -> Sensor:
     return self.db.get_sensor_by_original_id_and_source(original_id=originial_id, source=self.IDENTIFIER)
   
-  def get_measurement_type(self, dwd_definition: str) -> MeasurementType:
-    
-    if dwd_definition not in self.DWD_TYPE_MAPPING: return MeasurementType.UNKNOWN
-    return self.DWD_TYPE_MAPPING.get(dwd_definition)
+  def get_measurement_type(self, dwd_definition: str, product = DEFAULT_PRODUCT) -> MeasurementType:
+    mapping = self.DWD_PRODUCTS[product]["columns"]
+    if dwd_definition not in mapping: return MeasurementType.UNKNOWN
+    return mapping.get(dwd_definition)
   
-  def insert_measurement_types_for_sensor(self, sensor: Sensor, measurement_types: List[str]):
+  def insert_measurement_types_for_sensor(self, sensor: Sensor, measurement_types: List[str], product = DEFAULT_PRODUCT):
     for type in measurement_types:
-      measurement_type = self.get_measurement_type(type)
+      measurement_type = self.get_measurement_type(type, product)
       
       if measurement_type == MeasurementType.UNKNOWN: continue
   
@@ -81,6 +169,29 @@ class DWDInserter:
     new_sensor = Sensor(additional_information=additional_information, original_id=original_id, position=position, sensor_type="", source=self.IDENTIFIER)
     return self.db.insert_sensor(new_sensor)
   
+  def register_stations(self, area: Rectangle = None, active_from = None, active_to = None, state: str = None) -> List[Sensor]:
+    """
+    Creates a sensor for every station of the catalog that matches the filters and isn't stored yet, see DWDStationCatalog.select.
+    Positions and names come from the catalog and the stored sensors are read once, so no station needs a lookup of its own.
+    Returns:
+      List[Sensor]: The created sensors.
+    """
+    if self.catalog is None:
+      raise Exception("A station catalog is needed to register stations.")
+    
+    stations = self.catalog.select(area, active_from, active_to, state)
+    existing = {sensor.original_id for sensor in self.db.get_sensors_by_source(self.IDENTIFIER)}
+    
+    created = []
+    for original_id, latitude, longitude, name in zip(stations.index, stations["latitude"].tolist(), stations["longitude"].tolist(), stations["name"].tolist()):
+      if original_id in existing:
+        continue
+      sensor = Sensor(additional_information=name, original_id=original_id, position=Position(latitude, longitude), sensor_type="", source=self.IDENTIFIER)
+      created.append(self.db.insert_sensor(sensor))
+    
+    print(f"Registered {len(created)} of {len(stations)} selected stations, {len(stations) - len(created)} were already stored")
+    return created
+  
   def clear_sensor_measurements(self, sensor_id) -> int:
     sensor = self.get_sensor_by_id(sensor_id)
     if sensor is None:
@@ -95,69 +206,328 @@ class DWDInserter:
     
   
   def store_csv(self, filename, file_path, create_sensor = False, position: Position = None) -> int:
-    original_id = filename.split("_")[5]
+    original_id = self.original_id_from_filename(filename)
+    product = self.product_from_filename(filename)
+    
+    sensor = self.resolve_sensor(original_id, create_sensor, position)
     
     if create_sensor:
+      self.insert_measurement_types_for_sensor(sensor=sensor, measurement_types=list(self.DWD_PRODUCTS[product]["columns"]), product=product)
+    
+    # Construct the full path to the CSV file
+    file_path = os.path.join(file_path, filename + ".csv")
+    with open(file_path, "rb") as file:
+      return self.store_product_stream(sensor, file, product)[0]
+  
+  def store_product_stream(self, sensor: Sensor, file, product = DEFAULT_PRODUCT, offset = 0) -> tuple:
+    """
+    Stores a product file chunk by chunk, so only CHUNK_SIZE rows are held in memory at once.
+    Args:
+      sensor (Sensor): The sensor the product belongs to.
+      file (file-like): Binary file object of the product file.
+      product (str, optional): The product of the file, see DWD_PRODUCTS. Defaults to "klima_tag".
+      offset (int, optional): Byte offset of the first row to read, see iter_product_chunks. Defaults to 0.
+    Returns:
+      tuple: The number of stored measurements and the last timestamp of the read data (None if there was none).
+    """
+    stored = 0
+    last_timestamp = None
+    for columns in self.iter_product_chunks(file, product, offset=offset):
+      stored += self.store_columns(sensor, columns, product)
+      last_timestamp = max(filter(None, [last_timestamp, self.last_timestamp(columns)]), default=None)
+    return stored, last_timestamp
+  
+  @staticmethod
+  def last_timestamp(columns: dict) -> str:
+    """
+    Returns the latest timestamp of parsed columns in the ISO 8601 format, or None if they are empty.
+    """
+    latest = [timestamps.max() for timestamps, _ in columns.values() if len(timestamps)]
+    return str(max(latest).astype("datetime64[s]")) if latest else None
+  
+  def store_directory(self, directory, create_sensors = False, positions: dict = None, max_workers: int = None, patterns = ("produkt_*", "*.zip")) -> dict:
+    """
+    Stores all DWD product files and station archives of a directory, e.g. the daily climate data of every German station.
+    Archives are read without extracting them, see store_archive.
+    The calling process resolves the sensor of every file, so sensors are only ever created by one process, and a pool
+    of worker processes streams the files into the database chunk by chunk (see store_file). Every worker holds at most
+    CHUNK_SIZE rows at once and writes them itself, so the memory stays bounded however large the files are and the
+    parsing isn't limited to one core. A failing file is reported and does not stop the others.
+    Args:
+      directory (str): The directory containing the product files.
+      create_sensors (bool, optional): Create sensors that are not stored yet. Requires their positions. Defaults to False.
+      positions (dict, optional): Position of every station by its original id. Stations without one take the position of
+                                  their archive's geography metadata, or otherwise of the station catalog. Defaults to None.
+      max_workers (int, optional): Number of worker processes, and thus of concurrent writers. Defaults to the number of CPUs.
+      patterns (tuple, optional): Glob patterns of the files within the directory. Defaults to ("produkt_*", "*.zip").
+    Returns:
+      dict: Result of every file by its file name, with its 'status' ("stored" or "failed"), the number of 'stored'
+            measurements and the 'error' message of failed files.
+    """
+    files = sorted({file_path for pattern in patterns for file_path in glob.glob(os.path.join(directory, pattern))})
+    print(f"Found {len(files)} product files and archives in {directory}")
+    
+    report = self.store_files(files, create_sensors, positions, max_workers)
+    return {os.path.basename(file_path): result for file_path, result in report.items()}
+  
+  def store_files(self, files: List[str], create_sensors = False, positions: dict = None, max_workers: int = None) -> dict:
+    """
+    Stores a list of DWD product files and station archives with a pool of worker processes, see store_directory.
+    Returns:
+      dict: Result of every file by its path, with its 'status' ("stored" or "failed"), the number of 'stored' measurements,
+            the 'last_timestamp' of its data and the 'error' message of failed files.
+    """
+    report = {}
+    started = time.monotonic()
+    
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      futures = {}
+      for file_path in files:
+        try:
+          sensor, product = self._resolve_file(file_path, create_sensors, positions)
+        except Exception as e:
+          report[file_path] = {"status": "failed", "stored": 0, "last_timestamp": None, "error": str(e)}
+          continue
+        futures[executor.submit(self.store_file, file_path, sensor, product)] = file_path
+      
+      for future in as_completed(futures):
+        file_path = futures[future]
+        try:
+          stored, last_timestamp = future.result()
+          report[file_path] = {"status": "stored", "stored": stored, "last_timestamp": last_timestamp, "error": None}
+        except Exception as e:
+          report[file_path] = {"status": "failed", "stored": 0, "last_timestamp": None, "error": str(e)}
+        print(f"File {len(report)}/{len(files)} ({os.path.basename(file_path)}): {report[file_path]['status']}")
+    
+    seconds = time.monotonic() - started
+    statuses = [result["status"] for result in report.values()]
+    stored = sum(result["stored"] for result in report.values())
+    print(f"Stored {stored} measurements of {statuses.count('stored')} files in {seconds:.1f}s, {statuses.count('failed')} files failed")
+    for file_path, result in report.items():
+      if result["status"] == "failed":
+        print(f"Failed to store {os.path.basename(file_path)}: {result['error']}")
+    
+    return report
+  
+  def _resolve_file(self, file_path, create_sensors, positions) -> tuple:
+    """
+    Returns the sensor and the product of a product file or station archive, creating the sensor if requested.
+    Only the file name is read, and of archives the name of their product and the geography metadata of new sensors.
+    """
+    position = None
+    if zipfile.is_zipfile(file_path):
+      with zipfile.ZipFile(file_path) as archive:
+        product_name = self._find_archive_product(archive, file_path)
+        if create_sensors:
+          position = self._read_archive_position(archive)
+    else:
+      product_name = file_path
+    
+    original_id = self.original_id_from_filename(product_name)
+    product = self.product_from_filename(product_name)
+    if positions is not None and original_id in positions:
+      position = positions[original_id]
+    sensor = self.resolve_sensor(original_id, create_sensors, position)
+    
+    if create_sensors:
+      self.insert_measurement_types_for_sensor(sensor=sensor, measurement_types=list(self.DWD_PRODUCTS[product]["columns"]), product=product)
+    return sensor, product
+  
+  def store_file(self, file_path, sensor: Sensor, product = DEFAULT_PRODUCT) -> tuple:
+    """
+    Streams a product file, or the product file of a station archive, into the database chunk by chunk, see store_product_stream.
+    Runs in the worker processes of store_files.
+    Returns:
+      tuple: The number of stored measurements and the last timestamp of the read data (None if there was none).
+    """
+    if zipfile.is_zipfile(file_path):
+      with zipfile.ZipFile(file_path) as archive, archive.open(self._find_archive_product(archive, file_path)) as file:
+        return self.store_product_stream(sensor, file, product)
+    
+    with open(file_path, "rb") as file:
+      return self.store_product_stream(sensor, file, product)
+  
+  def store_archive(self, archive_path, create_sensor = False, position: Position = None) -> int:
+    """
+    Stores the product file of a DWD station archive (e.g. "tageswerte_KL_01975_19340101_20231231_hist.zip") without extracting it.
+    The product is streamed out of the archive chunk by chunk, see store_product_stream.
+    If a sensor is created, its position is taken from the geography metadata of the archive unless a position is given.
+    Returns:
+      int: The number of stored measurements.
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+      product_name = self._find_archive_product(archive, archive_path)
+      original_id = self.original_id_from_filename(product_name)
+      product = self.product_from_filename(product_name)
+      
+      if create_sensor and position is None:
+        position = self._read_archive_position(archive)
+      sensor = self.resolve_sensor(original_id, create_sensor, position)
+      
+      if create_sensor:
+        self.insert_measurement_types_for_sensor(sensor=sensor, measurement_types=list(self.DWD_PRODUCTS[product]["columns"]), product=product)
+      
+      with archive.open(product_name) as file:
+        return self.store_product_stream(sensor, file, product)[0]
+  
+  @staticmethod
+  def _find_archive_product(archive: zipfile.ZipFile, archive_path) -> str:
+    products = [name for name in archive.namelist() if os.path.basename(name).startswith(DWDInserter.PRODUCT_PREFIX)]
+    if len(products) != 1:
+      raise Exception(f"Expected one product file in {archive_path}, found {len(products)}")
+    return products[0]
+  
+  @staticmethod
+  def _read_archive_position(archive: zipfile.ZipFile) -> Position:
+    geography = [name for name in archive.namelist() if os.path.basename(name).startswith(DWDInserter.GEOGRAPHY_PREFIX)]
+    if not geography:
+      return None
+    with archive.open(geography[0]) as metadata:
+      return DWDInserter.parse_geography(metadata)
+  
+  @staticmethod
+  def parse_geography(metadata) -> Position:
+    """
+    Reads the position of a station from its "Metadaten_Geographie" file, which lists every location the station
+    ever had. The entry without an end date, or otherwise the latest one, is the current position.
+    Args:
+      metadata (str or file-like): Path or binary file object of the metadata file.
+    Returns:
+      Position: The current position of the station.
+    """
+    df = pd.read_csv(metadata, sep=';', header=0, encoding="latin-1", dtype=str)
+    df.columns = df.columns.str.strip()
+    df = df.apply(lambda column: column.str.strip())
+    
+    df = df.sort_values("von_datum")
+    current = df[df["bis_datum"].isna() | (df["bis_datum"] == "")]
+    latest = current.iloc[-1] if len(current) else df.iloc[-1]
+    
+    return Position(float(latest["Geogr.Breite"]), float(latest["Geogr.Laenge"]))
+  
+  @staticmethod
+  def original_id_from_filename(filename) -> str:
+    """
+    Extracts the station id from the name of a DWD product file, e.g. "01975" from "produkt_klima_tag_19340101_20231231_01975.txt".
+    The station id is always the last part of the name, independent of how many parts the product name has.
+    """
+    return os.path.splitext(os.path.basename(filename))[0].split("_")[-1]
+  
+  @staticmethod
+  def product_from_filename(filename) -> str:
+    """
+    Extracts the product from the name of a DWD product file, e.g. "zehn_min_tu" from "produkt_zehn_min_tu_20200101_20231231_01975.txt".
+    Unknown products fall back to the daily climate data.
+    """
+    product = "_".join(os.path.splitext(os.path.basename(filename))[0].split("_")[1:-3])
+    if product not in DWDInserter.DWD_PRODUCTS:
+      print(f"Unknown product '{product}' of {filename}, reading it as {DWDInserter.DEFAULT_PRODUCT}")
+      return DWDInserter.DEFAULT_PRODUCT
+    return product
+  
+  def resolve_sensor(self, original_id, create_sensor = False, position: Position = None) -> Sensor:
+    if create_sensor:
+      if position is None and self.catalog is not None:
+        position = self.catalog.get_position(original_id)
       if position is None:
-        raise Exception(f"Can't store csv since the position of the sensor f{original_id} is unknown")
-      sensor = self.store_sensor(original_id, position)
+        raise Exception(f"Can't store csv since the position of the sensor {original_id} is unknown")
+      self.store_sensor(original_id, position)
       
     sensor = self.get_sensor_by_id(original_id)
     if sensor == None:
-      raise Exception("To store csv for an unknown sensor, set 'create_sensor' to True and provide the position of the sensor.")      
+      raise Exception("To store csv for an unknown sensor, set 'create_sensor' to True and provide the position of the sensor.")
+    return sensor
+  
+  @staticmethod
+  def iter_product_chunks(file, product = DEFAULT_PRODUCT, chunk_size = CHUNK_SIZE, offset = 0):
+    """
+    Reads a DWD product file in chunks of rows and yields every chunk as one column per known measurement type.
+    Only the time column and the columns of the product are parsed, with fixed dtypes, and missing values (-999) are removed.
+    Args:
+      file (file-like): Binary file object of the product file.
+      product (str, optional): The product of the file, see DWD_PRODUCTS. Defaults to "klima_tag".
+      chunk_size (int, optional): Number of rows per chunk. Defaults to CHUNK_SIZE.
+      offset (int, optional): Byte offset of the first row to read, e.g. the previous size of an appended file.
+                              The header is always read from the start of the file. Requires a seekable file. Defaults to 0.
+    Yields:
+      dict: The timestamps (np.ndarray, datetime64) and values (np.ndarray, float64) of every DWD column by its name.
+    """
+    definition = DWDInserter.DWD_PRODUCTS[product]
+    value_columns = list(definition["columns"])
     
-    # Construct the full path to the CSV file
-    file_path = os.path.join(file_path, filename + ".csv")
-
-    # Load the CSV file into a DataFrame and use the first row as column names
-    df = pd.read_csv(file_path, sep=';', header=0)
-
-    df.columns = df.columns.str.strip()
-    columns_of_interest = self.DWD_TYPE_MAPPING.keys()
+    # The DWD pads column names with spaces, so the header is read separately and passed on stripped
+    names = [name.strip() for name in file.readline().decode("latin-1").strip().split(";")]
+    if offset:
+      file.seek(offset)
+    text = io.TextIOWrapper(file, encoding="latin-1")
     
-    columns_of_interest = list(columns_of_interest) + [self.TIME_COLUMN]
-    print(f"Found columns of interest: {columns_of_interest}")
+    missing = set(value_columns + [DWDInserter.TIME_COLUMN]) - set(names)
+    if missing:
+      raise Exception(f"File {getattr(file, 'name', file)} is missing the columns {sorted(missing)}")
     
-    # Reduce the DataFrame to the defined columns of interest
-    df = df[columns_of_interest]
+    dtypes = {DWDInserter.TIME_COLUMN: str, **{column: np.float64 for column in value_columns}}
+    reader = pd.read_csv(text, sep=';', header=None, names=names, usecols=list(dtypes), dtype=dtypes,
+                         skipinitialspace=True, chunksize=chunk_size)
     
-    if create_sensor:
-      self.insert_measurement_types_for_sensor(sensor=sensor, measurement_types=df.columns.to_list())
-
-    # Convert the TIME_COLUMN to a datetime format
-    df[self.TIME_COLUMN] = pd.to_datetime(df[self.TIME_COLUMN], format='%Y%m%d')
-
-    for column in df.columns:
-      if column == self.TIME_COLUMN:
-        continue
-      measurement_type = self.get_measurement_type(column)
+    for df in reader:
+      # Convert the TIME_COLUMN to a datetime format
+      timestamps = pd.to_datetime(df[DWDInserter.TIME_COLUMN], format=definition["time_format"]).to_numpy()
       
-      last_measurement_str = self.db.get_latest_measurement_timestamp(sensor_id=sensor.sensor_id, measurement_type=measurement_type.value)
-      last_measurement = None
-      if last_measurement_str is not None:
-        last_measurement = pd.to_datetime(last_measurement_str)
+      columns = {}
+      for column in value_columns:
+        values = df[column].to_numpy()
+        valid = (values != -999) & ~np.isnan(values)
+        columns[column] = (timestamps[valid], values[valid])
       
+      yield columns
+  
+  def store_columns(self, sensor: Sensor, columns: dict, product = DEFAULT_PRODUCT) -> int:
+    """
+    Stores parsed columns (see iter_product_chunks) of a sensor, skipping everything up to the latest stored timestamp of each type.
+    The latest timestamps are read for the interval of the product only, so storing e.g. the hourly temperature isn't skipped
+    because of newer 10-minute temperatures, and the other way around. Every column is stored with the aggregation method
+    of its product, see DWD_PRODUCTS.
+    Measurements are created and inserted in batches of STORE_BATCH_SIZE, so long hourly and 10-minute series don't have
+    to exist as objects all at once. A batch that isn't stored completely raises, so callers never record a file as stored
+    that is missing data; the batches stored before it are skipped by the watermark on the next attempt.
+    Returns:
+      int: The number of stored measurements.
+    """
+    interval = self.DWD_PRODUCTS[product]["interval"]
+    methods = self.DWD_PRODUCTS[product]["methods"]
+    latest_timestamps = self.db.get_latest_timestamps_for_sensor(sensor.sensor_id, aggregated=True, aggregation_interval=interval)
+    
+    stored = 0
+    for column, (timestamps, values) in columns.items():
+      measurement_type = self.get_measurement_type(column, product)
       if measurement_type == MeasurementType.UNKNOWN:
         print(f"Skipping column {column} because of unknown measurement type")
         continue
       
-      measurements = []
-      for index, row in df.iterrows(): 
-        if row[column] == -999:
-          print(f"Ignoring row with timestamp {row[self.TIME_COLUMN]} since value is -999")
-          continue
-        if last_measurement is not None and row[self.TIME_COLUMN] <= last_measurement:
-          continue
-        measurement = AggregatedMeasurement(measurement_type=measurement_type.value, 
-                              position=sensor.position, 
-                              timestamp=row[self.TIME_COLUMN], 
-                              unit=MeasurementType.get_unit_for_type(measurement_type), 
-                              value=row[column], 
-                              sensor_id=sensor.sensor_id,
-                              interval_in_seconds=86400,
-                              aggregation_method=self.AGR_METHOD_MAPPING[measurement_type])
-        measurements.append(measurement)
+      aggregation_method = methods[measurement_type]
+      last_measurement = latest_timestamps.get((measurement_type.value, aggregation_method))
+      if last_measurement is not None:
+        newer = timestamps > np.datetime64(last_measurement)
+        timestamps, values = timestamps[newer], values[newer]
       
-      self.db.insert_batch_aggregated_measurements(measurements)
+      unit = MeasurementType.get_unit_for_type(measurement_type)
+      for begin in range(0, len(values), self.STORE_BATCH_SIZE):
+        batch = zip(timestamps[begin:begin + self.STORE_BATCH_SIZE].astype("datetime64[us]").tolist(), values[begin:begin + self.STORE_BATCH_SIZE].tolist())
+        measurements = [AggregatedMeasurement(measurement_type=measurement_type.value, 
+                          position=sensor.position, 
+                          timestamp=timestamp, 
+                          unit=unit, 
+                          value=value, 
+                          sensor_id=sensor.sensor_id,
+                          interval_in_seconds=interval,
+                          aggregation_method=aggregation_method)
+                        for timestamp, value in batch]
+        # SensorDB reports a failed insert only by its count, the file must not count as stored then
+        batch_stored = self.db.insert_batch_aggregated_measurements(measurements)
+        if batch_stored != len(measurements):
+          raise Exception(f"Storing {column} of sensor {sensor.original_id} failed, stored {batch_stored} of {len(measurements)} measurements")
+        stored += batch_stored
     
-    
\ No newline at end of file
+    print(f"Stored {stored} measurements for sensor {sensor.original_id}")
+    return stored
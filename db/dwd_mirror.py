@@ -0,0 +1,174 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import zipfile
+import threading
+
+from db.dwd_inserter import DWDInserter
+
+
+class DWDMirrorManifest:
+  """
+  Append-only record of the files of a local DWD mirror that were already ingested.
+  Every ingested file appends one JSON line with its size, modification time, content hash and the last ingested timestamp.
+  Loading replays all lines, the latest line per file wins, like the HarvestCheckpoint of the Netatmo harvester.
+  Args:
+    path (str): Path of the JSONL manifest file.
+  """
+  def __init__(self, path: str):
+    self.path = path
+    self.lock = threading.Lock()
+    self.files = {}
+
+    if os.path.exists(path):
+      with open(path, "r") as f:
+        for line in f:
+          line = line.strip()
+          if not line:
+            continue
+          try:
+            entry = json.loads(line)
+            self.files[entry["path"]] = entry
+          except json.JSONDecodeError:
+            # A crash while writing leaves at most one incomplete trailing line
+            print(f"Ignoring incomplete manifest line: {line}")
+      print(f"Loaded manifest with {len(self.files)} ingested files")
+    else:
+      os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+  def get(self, relative_path) -> dict:
+    return self.files.get(relative_path)
+
+  def record(self, relative_path, size, mtime, sha256, last_timestamp):
+    entry = {"path": relative_path, "size": size, "mtime": mtime, "sha256": sha256, "last_timestamp": last_timestamp}
+    with self.lock:
+      self.files[relative_path] = entry
+      with open(self.path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class DWDMirror:
+  """
+  Incremental ingestion of a local mirror of the DWD open data tree.
+  A sync compares every file with the manifest and only reads what changed:
+  files with the recorded size and modification time are skipped without being opened, files that only grew and still
+  start with the recorded content are read from their previous end on, and new or rewritten files are ingested
+  completely with the parallel bulk ingest of the inserter. The watermarks of the inserter still prevent duplicates
+  if a rewritten file repeats already stored data.
+  Args:
+    inserter (DWDInserter): The inserter that stores the data.
+    root (str): Root directory of the mirror.
+    manifest_path (str, optional): Path of the manifest. Defaults to ".data/output/dwd/mirror_manifest.jsonl".
+  """
+  HASH_BLOCK_SIZE = 1024*1024
+
+  def __init__(self, inserter: DWDInserter, root: str, manifest_path = ".data/output/dwd/mirror_manifest.jsonl"):
+    self.inserter = inserter
+    self.root = root
+    self.manifest = DWDMirrorManifest(manifest_path)
+
+  def sync(self, patterns = ("**/produkt_*", "**/*.zip"), create_sensors = False, positions: dict = None, max_workers: int = None) -> dict:
+    """
+    Brings the database up to date with the mirror.
+    Args:
+      patterns (tuple, optional): Glob patterns of the files relative to the root. Defaults to all product files and archives.
+      create_sensors (bool, optional): Create sensors that are not stored yet, see DWDInserter.store_directory. Defaults to False.
+      positions (dict, optional): Position of every station by its original id, see DWDInserter.store_directory. Defaults to None.
+      max_workers (int, optional): Number of parsing processes for new and rewritten files. Defaults to the number of CPUs.
+    Returns:
+      dict: Number of 'unchanged', 'appended', 'ingested' and 'failed' files, and the number of 'stored' measurements.
+    """
+    started = time.monotonic()
+    files = sorted({file_path for pattern in patterns for file_path in glob.glob(os.path.join(self.root, pattern), recursive=True)})
+
+    summary = {"unchanged": 0, "appended": 0, "ingested": 0, "failed": 0, "stored": 0}
+    changed = {}
+
+    for file_path in files:
+      relative_path = os.path.relpath(file_path, self.root)
+      stat = os.stat(file_path)
+      entry = self.manifest.get(relative_path)
+
+      if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        summary["unchanged"] += 1
+        continue
+
+      sha256 = self.hash_file(file_path)
+      if entry is not None and entry["sha256"] == sha256:
+        # Touched but identical, only the modification time changes
+        self.manifest.record(relative_path, stat.st_size, stat.st_mtime, sha256, entry["last_timestamp"])
+        summary["unchanged"] += 1
+        continue
+
+      if entry is not None and self._is_appended(file_path, entry):
+        try:
+          stored, last_timestamp = self._store_tail(file_path, entry["size"])
+        except Exception as e:
+          print(f"Failed to store the appended part of {relative_path}: {e}")
+          summary["failed"] += 1
+          continue
+        self.manifest.record(relative_path, stat.st_size, stat.st_mtime, sha256, last_timestamp or entry["last_timestamp"])
+        summary["appended"] += 1
+        summary["stored"] += stored
+        continue
+
+      changed[file_path] = (relative_path, stat, sha256)
+
+    if changed:
+      report = self.inserter.store_files(list(changed), create_sensors, positions, max_workers)
+      for file_path, result in report.items():
+        relative_path, stat, sha256 = changed[file_path]
+        if result["status"] != "stored":
+          summary["failed"] += 1
+          continue
+        self.manifest.record(relative_path, stat.st_size, stat.st_mtime, sha256, result["last_timestamp"])
+        summary["ingested"] += 1
+        summary["stored"] += result["stored"]
+
+    print(f"Mirror sync of {len(files)} files finished in {time.monotonic() - started:.1f}s: {summary}")
+    return summary
+
+  def _is_appended(self, file_path, entry) -> bool:
+    """
+    A file was appended to if it grew, its recorded part still has the recorded hash and that part ended with a complete line.
+    Archives are always rewritten as a whole.
+    """
+    if zipfile.is_zipfile(file_path) or os.path.getsize(file_path) <= entry["size"]:
+      return False
+
+    with open(file_path, "rb") as f:
+      f.seek(entry["size"] - 1)
+      if f.read(1) != b"\n":
+        return False
+
+    return self.hash_file(file_path, entry["size"]) == entry["sha256"]
+
+  def _store_tail(self, file_path, offset) -> tuple:
+    original_id = DWDInserter.original_id_from_filename(file_path)
+    product = DWDInserter.product_from_filename(file_path)
+    sensor = self.inserter.resolve_sensor(original_id)
+
+    with open(file_path, "rb") as file:
+      stored, last_timestamp = self.inserter.store_product_stream(sensor, file, product, offset=offset)
+    print(f"Stored {stored} appended measurements of {os.path.basename(file_path)}")
+    return stored, last_timestamp
+
+  @classmethod
+  def hash_file(cls, file_path, size = None) -> str:
+    """
+    Returns the SHA-256 of a file, or of its first size bytes.
+    """
+    sha256 = hashlib.sha256()
+    remaining = size if size is not None else os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+      while remaining > 0:
+        block = f.read(min(cls.HASH_BLOCK_SIZE, remaining))
+        if not block:
+          break
+        sha256.update(block)
+        remaining -= len(block)
+    return sha256.hexdigest()
@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import pandas as pd
+
+from models import Position, Rectangle
+
+
+class DWDStationCatalog:
+  """
+  Table of DWD stations with their position, height, active period and state, indexed by the station id.
+  It is built from the station description lists the DWD publishes next to every product
+  (e.g. "KL_Tageswerte_Beschreibung_Stationen.txt") and can be persisted as CSV, so positions and spatial selections
+  of hundreds of stations need neither the original list nor any per-station lookup.
+  Args:
+    stations (pd.DataFrame): The stations, indexed by their five digit id, with the columns of COLUMNS.
+  """
+  COLUMNS = ["from_date", "to_date", "height", "latitude", "longitude", "name", "state"]
+  DESCRIPTION_COLUMNS = {
+    "Stations_id": "station_id",
+    "von_datum": "from_date",
+    "bis_datum": "to_date",
+    "Stationshoehe": "height",
+    "geoBreite": "latitude",
+    "geoLaenge": "longitude",
+    "Stationsname": "name",
+    "Bundesland": "state",
+  }
+  DEFAULT_PATH = ".data/output/dwd/station_catalog.csv"
+
+  def __init__(self, stations: pd.DataFrame):
+    self.stations = stations
+
+  def __len__(self):
+    return len(self.stations)
+
+  def __contains__(self, station_id):
+    return station_id in self.stations.index
+
+  @classmethod
+  def from_description_file(cls, file_path) -> 'DWDStationCatalog':
+    """
+    Parses a DWD station description list.
+    The rows of the published lists don't line up with the dashes below their header, so they are split into fields instead:
+    the six numeric fields lead every row and the state (plus the 'Abgabe' column of newer lists) ends it,
+    everything in between is the station name, which may contain spaces.
+    Args:
+      file_path (str): Path of the station description list.
+    Returns:
+      DWDStationCatalog: The catalog of all listed stations.
+    """
+    with open(file_path, "r", encoding="latin-1") as f:
+      header = f.readline().split()
+      f.readline() # line of dashes
+      lines = pd.Series(f.read().splitlines())
+
+    if header[:len(cls.DESCRIPTION_COLUMNS)] != list(cls.DESCRIPTION_COLUMNS):
+      raise Exception(f"Can't parse {file_path}: unexpected columns {header}")
+
+    trailing = r"\s+(\S+)" * (len(header) - len(cls.DESCRIPTION_COLUMNS))
+    pattern = r"^\s*(\d+)\s+(\d{8})\s+(\d{8})\s+(-?\d+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(.+?)\s+(\S+)" + trailing + r"\s*$"
+    df = lines[lines.str.strip() != ""].str.extract(pattern)
+    df.columns = header
+    df = df.rename(columns=cls.DESCRIPTION_COLUMNS)
+
+    unparsed = df["station_id"].isna()
+    if unparsed.any():
+      print(f"Skipping {int(unparsed.sum())} unparsable lines of {file_path}")
+      df = df[~unparsed]
+
+    stations = df.assign(
+      station_id=df["station_id"].str.zfill(5),
+      from_date=pd.to_datetime(df["from_date"], format="%Y%m%d"),
+      to_date=pd.to_datetime(df["to_date"], format="%Y%m%d"),
+      height=df["height"].astype(float),
+      latitude=df["latitude"].astype(float),
+      longitude=df["longitude"].astype(float),
+    )[["station_id"] + cls.COLUMNS].set_index("station_id")
+
+    print(f"Parsed {len(stations)} stations from {file_path}")
+    return cls(stations)
+
+  @classmethod
+  def load(cls, path = DEFAULT_PATH) -> 'DWDStationCatalog':
+    stations = pd.read_csv(path, dtype={"station_id": str}, parse_dates=["from_date", "to_date"]).set_index("station_id")
+    return cls(stations)
+
+  def save(self, path = DEFAULT_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    self.stations.to_csv(path, date_format="%Y-%m-%d")
+    print(f"Saved catalog of {len(self.stations)} stations to {path}")
+
+  def get_position(self, station_id) -> Position:
+    """
+    Returns the position of a station, or None if the station is not listed.
+    """
+    if station_id not in self.stations.index:
+      return None
+    station = self.stations.loc[station_id]
+    return Position(float(station["latitude"]), float(station["longitude"]))
+
+  def get_positions(self, station_ids = None) -> dict:
+    """
+    Returns the positions of many stations by their id, e.g. for DWDInserter.store_directory.
+    Args:
+      station_ids (list, optional): The stations to return. Defaults to all stations of the catalog.
+    """
+    stations = self.stations if station_ids is None else self.stations[self.stations.index.isin(station_ids)]
+    return {station_id: Position(latitude, longitude)
+            for station_id, latitude, longitude in zip(stations.index, stations["latitude"].tolist(), stations["longitude"].tolist())}
+
+  def select(self, area: Rectangle = None, active_from = None, active_to = None, state: str = None) -> pd.DataFrame:
+    """
+    Selects stations with vectorized filters over the whole table.
+    Args:
+      area (Rectangle, optional): Only stations within this area. Defaults to None.
+      active_from (str or datetime, optional): Only stations that still reported at or after this date. Defaults to None.
+      active_to (str or datetime, optional): Only stations that already reported at or before this date. Defaults to None.
+      state (str, optional): Only stations of this state, e.g. "Hamburg". Defaults to None.
+    Returns:
+      pd.DataFrame: The selected stations.
+    """
+    mask = np.ones(len(self.stations), dtype=bool)
+    if area is not None:
+      mask &= self.stations["latitude"].between(area.south_west.latitude, area.north_east.latitude).to_numpy()
+      mask &= self.stations["longitude"].between(area.south_west.longitude, area.north_east.longitude).to_numpy()
+    if active_from is not None:
+      mask &= (self.stations["to_date"] >= pd.Timestamp(active_from)).to_numpy()
+    if active_to is not None:
+      mask &= (self.stations["from_date"] <= pd.Timestamp(active_to)).to_numpy()
+    if state is not None:
+      mask &= (self.stations["state"] == state).to_numpy()
+
+    return self.stations[mask]
+
+  def nearest(self, position: Position, n = 1) -> pd.DataFrame:
+    """
+    Returns the n stations closest to a position, with their distance in kilometers in the column 'distance_km'.
+    """
+    latitudes, longitudes = np.radians(self.stations["latitude"].to_numpy()), np.radians(self.stations["longitude"].to_numpy())
+    latitude, longitude = np.radians(position.latitude), np.radians(position.longitude)
+    a = np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    distances = 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+    closest = np.argsort(distances)[:n]
+    return self.stations.iloc[closest].assign(distance_km=distances[closest])
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class NetAtmoPageCache:
+  """
+  Content-addressed on-disk cache for single getmeasure response pages.
+  Every page is stored as a JSON file named after the hash of its request parameters. Pages that lie completely
+  in the past never change and are kept until they are evicted, the open-ended latest page of a series expires after `latest_ttl`.
+  If the cache grows beyond `max_size_bytes`, the least recently used pages are removed.
+  Args:
+    cache_dir (str, optional): Directory the pages are stored in. Defaults to ".data/cache/netatmo".
+    max_size_bytes (int, optional): Upper bound of the total size of all cached pages. Defaults to 1 GiB.
+    latest_ttl (int, optional): Time in seconds an incomplete (latest) page is served from the cache. Defaults to 15 minutes.
+  """
+  def __init__(self, cache_dir = ".data/cache/netatmo", max_size_bytes = 1024**3, latest_ttl = 15*60):
+    self.cache_dir = cache_dir
+    self.max_size_bytes = max_size_bytes
+    self.latest_ttl = latest_ttl
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+    os.makedirs(self.cache_dir, exist_ok=True)
+    self.size_bytes = sum(os.path.getsize(path) for path in self._cached_files())
+
+  @staticmethod
+  def make_key(device_id, module_id, scale, types, date_begin, date_end = None, **params) -> str:
+    """
+    Builds the cache key of a getmeasure page from its request parameters.
+    """
+    request = {
+      "device_id": device_id,
+      "module_id": module_id,
+      "scale": scale,
+      "type": list(types),
+      "date_begin": None if date_begin is None else str(date_begin),
+      "date_end": None if date_end is None else str(date_end),
+      **params
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+  def get(self, key):
+    """
+    Returns the cached page body for the given key, or None if it is not cached or has expired.
+    """
+    path = self._path(key)
+    try:
+      with open(path, "r") as f:
+        entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      self.misses += 1
+      return None
+
+    if not entry["complete"] and time.time() - entry["fetched_at"] > self.latest_ttl:
+      self._remove(path)
+      self.misses += 1
+      return None
+
+    # Touching the file marks it as recently used for the LRU eviction
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      pass
+    self.hits += 1
+    return entry["body"]
+
+  def put(self, key, body, complete: bool):
+    """
+    Stores a page body. Complete pages never expire, incomplete pages are only served for `latest_ttl` seconds.
+    """
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    entry = {
+      "fetched_at": time.time(),
+      "complete": complete,
+      "body": body
+    }
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+      json.dump(entry, f)
+
+    with self.lock:
+      old_size = os.path.getsize(path) if os.path.exists(path) else 0
+      os.replace(tmp_path, path)
+      self.size_bytes += os.path.getsize(path) - old_size
+
+      if self.size_bytes > self.max_size_bytes:
+        self._evict()
+
+  def clear(self):
+    """
+    Removes all cached pages.
+    """
+    with self.lock:
+      for path in self._cached_files():
+        os.remove(path)
+      self.size_bytes = 0
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+  def _cached_files(self):
+    for root, _, files in os.walk(self.cache_dir):
+      for file in files:
+        if file.endswith(".json"):
+          yield os.path.join(root, file)
+
+  def _remove(self, path):
+    with self.lock:
+      try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        self.size_bytes -= size
+      except FileNotFoundError:
+        pass
+
+  def _evict(self):
+    # Evict down to 90% of the bound, so not every following put has to scan the cache again
+    target = self.max_size_bytes * 0.9
+    files = sorted(((os.path.getmtime(path), os.path.getsize(path), path) for path in self._cached_files()))
+
+    evicted = 0
+    for _, size, path in files:
+      if self.size_bytes <= target:
+        break
+      os.remove(path)
+      self.size_bytes -= size
+      evicted += 1
+
+    print(f"Evicted {evicted} pages from the Netatmo cache, {self.size_bytes / 1024**2:.1f} MiB remaining")
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import random
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db import SensorDB, DBConfig
+from db.netatmo_inserter import NetAtmoInserter, NetAtmoFetcher
+from db.rate_limiter import RateLimiter
+from models import Sensor, Rectangle
+
+
+class HarvestCheckpoint:
+  """
+  Append-only record of the harvest progress of every sensor and module.
+  Each stored page appends one JSON line with the last stored timestamp of its module, so writing a checkpoint
+  does not get slower with the number of harvested sensors. Loading replays all lines, the latest line per module wins.
+  Args:
+    path (str): Path of the JSONL checkpoint file.
+  """
+  def __init__(self, path: str):
+    self.path = path
+    self.lock = threading.Lock()
+    self.modules = {}
+    self.sensors_done = set()
+
+    if os.path.exists(path):
+      with open(path, "r") as f:
+        for line in f:
+          line = line.strip()
+          if not line:
+            continue
+          try:
+            self._apply(json.loads(line))
+          except json.JSONDecodeError:
+            # A crash while writing leaves at most one incomplete trailing line
+            print(f"Ignoring incomplete checkpoint line: {line}")
+      print(f"Loaded checkpoint with {len(self.sensors_done)} finished sensors and {len(self.modules)} started modules")
+    else:
+      os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+  def is_sensor_done(self, original_id) -> bool:
+    return original_id in self.sensors_done
+
+  def get_module(self, original_id, module_id) -> dict:
+    return self.modules.get((original_id, module_id), {"last_timestamp": None, "done": False})
+
+  def record_page(self, original_id, module_id, last_timestamp):
+    self._write({"sensor": original_id, "module": module_id, "last_timestamp": last_timestamp, "done": False})
+
+  def record_module_done(self, original_id, module_id):
+    last_timestamp = self.get_module(original_id, module_id)["last_timestamp"]
+    self._write({"sensor": original_id, "module": module_id, "last_timestamp": last_timestamp, "done": True})
+
+  def record_sensor_done(self, original_id):
+    self._write({"sensor": original_id, "done": True})
+
+  def _apply(self, entry):
+    if "module" in entry:
+      self.modules[(entry["sensor"], entry["module"])] = {"last_timestamp": entry["last_timestamp"], "done": entry["done"]}
+    elif entry["done"]:
+      self.sensors_done.add(entry["sensor"])
+
+  def _write(self, entry):
+    with self.lock:
+      self._apply(entry)
+      with open(self.path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class NetAtmoHarvester:
+  """
+  Fetches and stores the measurements of many Netatmo sensors with a pool of worker threads.
+  All workers share one fetcher, and with it one keep-alive session, token and rate limiter. Every worker writes through
+  its own database connection. The progress of every module is recorded in a checkpoint after each stored page,
+  so an interrupted harvest continues exactly where it stopped when it is started again with the same checkpoint.
+  Args:
+    db_config (DBConfig): Configuration of the database the measurements are stored in.
+    checkpoint_path (str, optional): Path of the checkpoint file. Defaults to ".data/output/netatmo_harvest_checkpoint.jsonl".
+    max_workers (int, optional): Number of sensors harvested concurrently. Defaults to 4.
+    rate_limiter (RateLimiter, optional): Global limiter shared by all workers. Defaults to 1 request per second.
+    max_retries (int, optional): Number of retries of a failed module before the sensor is reported as failed. Defaults to 3.
+    retry_delay (float, optional): Base delay in seconds of the exponential backoff between retries. Defaults to 5.
+    fetcher (NetAtmoFetcher, optional): Fetcher to share between the workers. Defaults to a new fetcher using the rate limiter.
+  """
+  def __init__(self, db_config: DBConfig, checkpoint_path = ".data/output/netatmo_harvest_checkpoint.jsonl", max_workers = 4, rate_limiter: RateLimiter = None, max_retries = 3, retry_delay = 5, fetcher: NetAtmoFetcher = None):
+    self.db_config = db_config
+    self.checkpoint = HarvestCheckpoint(checkpoint_path)
+    self.max_workers = max_workers
+    self.max_retries = max_retries
+    self.retry_delay = retry_delay
+
+    if rate_limiter is None:
+      rate_limiter = RateLimiter(requests_per_second=1, burst=max_workers)
+    if fetcher is None:
+      fetcher = NetAtmoFetcher(rate_limiter=rate_limiter, pool_size=max_workers)
+    self.fetcher = fetcher
+    self.local = threading.local()
+
+  def _get_inserter(self) -> NetAtmoInserter:
+    # SensorDB keeps a single connection, so every worker thread gets its own instance
+    if not hasattr(self.local, "inserter"):
+      self.local.inserter = NetAtmoInserter(SensorDB(self.db_config), fetcher=self.fetcher)
+    return self.local.inserter
+
+  def harvest(self, sensors: list[Sensor] = None, area: Rectangle = None, types = 'all', scale = "1day", date_begin = None, date_end = None, optimize = False) -> dict:
+    """
+    Harvests the measurements of a set of sensors.
+    Args:
+      sensors (list[Sensor], optional): The stored Netatmo sensors to harvest.
+      area (Rectangle, optional): Harvest all stored Netatmo sensors within this area instead of a list of sensors.
+      types (list or str, optional): The Netatmo types to fetch, or 'all' for every type of a module. Defaults to 'all'.
+      scale (str, optional): Either "latest" or "1day". Defaults to "1day".
+      date_begin (int, optional): Unix timestamp to start fetching from, if a module has no progress yet. Defaults to None.
+      date_end (int, optional): Unix timestamp to stop fetching at. Defaults to None.
+      optimize (bool, optional): Request the compact wire format and store from NumPy arrays. Defaults to False.
+    Returns:
+      dict: Statistics per sensor original id with the number of stored 'pages' (including pages served from the page cache),
+            'stored' measurements, 'retries', 'errors',
+            the needed 'seconds' and its 'status' ("done", "skipped" or "failed").
+    """
+    if sensors is None:
+      if area is None:
+        raise Exception("Either a list of sensors or an area to harvest must be given.")
+      sensors = SensorDB(self.db_config).get_sensors_from_area(area.south_west.latitude, area.south_west.longitude, area.north_east.latitude, area.north_east.longitude)
+      sensors = [sensor for sensor in sensors if sensor.source == NetAtmoInserter.IDENTIFIER]
+
+    stats = {}
+    pending = []
+    for sensor in sensors:
+      if self.checkpoint.is_sensor_done(sensor.original_id):
+        stats[sensor.original_id] = {"pages": 0, "stored": 0, "retries": 0, "errors": 0, "seconds": 0.0, "status": "skipped"}
+      else:
+        pending.append(sensor)
+
+    print(f"Harvesting {len(pending)} sensors with {self.max_workers} workers, {len(sensors) - len(pending)} already done")
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      futures = {executor.submit(self.harvest_sensor, sensor, types, scale, date_begin, date_end, optimize): sensor for sensor in pending}
+      for done, future in enumerate(as_completed(futures), start=1):
+        sensor = futures[future]
+        sensor_stats = future.result()
+        stats[sensor.original_id] = sensor_stats
+        print(f"Sensor {done}/{len(pending)} ({sensor.original_id}): {sensor_stats['status']}, stored {sensor_stats['stored']} measurements "
+              f"from {sensor_stats['pages']} pages in {sensor_stats['seconds']:.1f}s ({sensor_stats['retries']} retries, {sensor_stats['errors']} errors)")
+
+    self._print_summary(stats, time.monotonic() - started)
+    return stats
+
+  def harvest_sensor(self, sensor: Sensor, types = 'all', scale = "1day", date_begin = None, date_end = None, optimize = False) -> dict:
+    """
+    Harvests all modules of a single sensor, continuing every module from its checkpointed progress.
+    Returns:
+      dict: The statistics of the sensor, see `harvest`.
+    """
+    inserter = self._get_inserter()
+    stats = {"pages": 0, "stored": 0, "retries": 0, "errors": 0, "seconds": 0.0, "status": "done"}
+    started = time.monotonic()
+
+    def on_page(module_id, page, stored):
+      stats["pages"] += 1
+      stats["stored"] += stored
+      last_timestamp = page["timestamp"][-1] if isinstance(page, dict) else page[-1]["timestamp"]
+      self.checkpoint.record_page(sensor.original_id, module_id, int(last_timestamp))
+
+    try:
+      modules = inserter._select_modules(sensor, types, scale)
+    except AssertionError as e:
+      print(f"Skipping sensor {sensor.original_id}: {e}")
+      stats["errors"] += 1
+      stats["status"] = "failed"
+      return stats
+
+    for module_id, _ in modules:
+      if self.checkpoint.get_module(sensor.original_id, module_id)["done"]:
+        continue
+
+      for attempt in range(self.max_retries + 1):
+        last_timestamp = self.checkpoint.get_module(sensor.original_id, module_id)["last_timestamp"]
+        module_begin = last_timestamp + 1 if last_timestamp is not None else date_begin
+
+        try:
+          inserter.stream_data_from_sensor(sensor, types, scale, module_begin, date_end, on_page=on_page, module_ids=[module_id], optimize=optimize)
+          self.checkpoint.record_module_done(sensor.original_id, module_id)
+          break
+        except Exception as e:
+          stats["errors"] += 1
+          if attempt == self.max_retries:
+            print(f"Giving up on module {module_id} of sensor {sensor.original_id}: {e}")
+            stats["status"] = "failed"
+          else:
+            stats["retries"] += 1
+            delay = self.retry_delay * (2 ** attempt) * (1 + random.random())
+            print(f"Module {module_id} of sensor {sensor.original_id} failed, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+    if stats["status"] == "done":
+      self.checkpoint.record_sensor_done(sensor.original_id)
+
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+  def _print_summary(self, stats, seconds):
+    statuses = [sensor_stats["status"] for sensor_stats in stats.values()]
+    pages = sum(sensor_stats["pages"] for sensor_stats in stats.values())
+    stored = sum(sensor_stats["stored"] for sensor_stats in stats.values())
+    retries = sum(sensor_stats["retries"] for sensor_stats in stats.values())
+
+    print(f"Harvest finished in {seconds:.1f}s: {statuses.count('done')} done, {statuses.count('skipped')} skipped, {statuses.count('failed')} failed")
+    if seconds > 0:
+      print(f"{pages} pages ({pages / seconds:.2f}/s), {stored} stored measurements ({stored / seconds:.1f}/s), {retries} retries")
@@ -1,26 +1,161 @@
 import requests
 import time
 import json
+import random
 import datetime
+import threading
+import queue
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 
 from db import SensorDB
-from models import Sensor, Rectangle, Position, Measurement, MeasurementType, AggregatedMeasurement
+from db.rate_limiter import RateLimiter
+from db.netatmo_cache import NetAtmoPageCache
+from models import Sensor, Rectangle, Position, Measurement, MeasurementType, AggregatedMeasurement, QCFlag
+from data_preprocessing.quality_control import grid_from_rows, run_quality_control
 
 class NetAtmoFetcher():
-  def __init__(self):
+  AUTH_STATUS_CODES = [401, 403]
+  RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+  MAX_BACKOFF = 60
+  PAGE_SIZE = 1024
+  SETTLE_SECONDS = 60*60*24
+  API_URL = "https://app.netatmo.net/api"
+  AUTH_URL = "https://auth.netatmo.com"
+  
+  def __init__(self, rate_limiter: RateLimiter = None, max_retries: int = 5, backoff_factor: float = 1, pool_size: int = 10, timeout: float = 30, cache: NetAtmoPageCache = None, api_url: str = None, auth_url: str = None):
+    """
+    Creates a fetcher that sends all requests through one pooled keep-alive session.
+    Args:
+      rate_limiter (RateLimiter, optional): Shared limiter consulted before every request. Defaults to None.
+      max_retries (int, optional): Number of retries for throttled (429), failing (5xx) or dropped requests. Defaults to 5.
+      backoff_factor (float, optional): Base delay in seconds of the jittered exponential backoff. Defaults to 1.
+      pool_size (int, optional): Number of keep-alive connections kept per host. Should be at least the number of worker threads. Defaults to 10.
+      timeout (float, optional): Timeout in seconds for a single request. Defaults to 30.
+      cache (NetAtmoPageCache, optional): On-disk cache for getmeasure pages. Defaults to None.
+      api_url (str, optional): Base URL of the API, e.g. of a local NetAtmoSimulator. Defaults to API_URL.
+      auth_url (str, optional): Base URL of the token endpoint. Defaults to AUTH_URL.
+    """
+    self.api_url = api_url if api_url is not None else self.API_URL
+    self.auth_url = auth_url if auth_url is not None else self.AUTH_URL
+    self.rate_limiter = rate_limiter
+    self.cache = cache
+    self.max_retries = max_retries
+    self.backoff_factor = backoff_factor
+    self.timeout = timeout
+    
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+    
+    self.token_lock = threading.Lock()
     self.token = self.fetch_token()
     
+  def _throttle(self):
+    if self.rate_limiter is not None:
+      self.rate_limiter.acquire()
+
   def fetch_token(self):
-    token_res = requests.get("https://auth.netatmo.com/weathermap/token")
+    token_res = self.session.get(f"{self.auth_url}/weathermap/token", timeout=self.timeout)
+    token_res.raise_for_status()
     return token_res.json()['body']
   
-  def fetch_weather_data(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None):
-    url = "https://app.netatmo.net/api/getmeasure"
+  def refresh_token(self, rejected_token):
+    """
+    Fetches a new token unless another thread already replaced the rejected one.
+    """
+    with self.token_lock:
+      if self.token == rejected_token:
+        print("Token was rejected, fetching a new one")
+        self.token = self.fetch_token()
+      return self.token
+  
+  def _backoff(self, attempt, response = None):
+    if response is not None and "Retry-After" in response.headers:
+      retry_after = response.headers["Retry-After"]
+      try:
+        return float(retry_after)
+      except ValueError:
+        try:
+          retry_at = parsedate_to_datetime(retry_after)
+          return max(0, (retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds())
+        except (TypeError, ValueError):
+          pass
+    
+    return random.uniform(0, min(self.MAX_BACKOFF, self.backoff_factor * (2 ** attempt)))
+  
+  def _request(self, method, url, headers = None, params = None, json = None, token_in_params = False) -> requests.Response:
+    """
+    Sends an authorized request through the pooled session.
+    The current token is added as bearer header, or as 'access_token' parameter if token_in_params is set.
+    A rejected token (401/403) is refreshed once, throttled (429) and failing (5xx) requests as well as
+    connection errors are retried with jittered exponential backoff, honoring a 'Retry-After' header.
+    Returns:
+      requests.Response: The last received response. Its status code must still be checked by the caller.
+    """
+    token_refreshed = False
+    attempt = 0
+    
+    while True:
+      token = self.token
+      request_headers = dict(headers or {})
+      request_params = dict(params or {})
+      if token_in_params:
+        request_params["access_token"] = token
+      else:
+        request_headers["authorization"] = "Bearer " + token
+      
+      self._throttle()
+      try:
+        response = self.session.request(method, url, headers=request_headers, params=request_params or None, json=json, timeout=self.timeout)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        if attempt >= self.max_retries:
+          raise
+        delay = self._backoff(attempt)
+        print(f"Request failed with {e.__class__.__name__}, retrying in {delay:.1f}s")
+        attempt += 1
+        time.sleep(delay)
+        continue
+      
+      if response.status_code in self.AUTH_STATUS_CODES and not token_refreshed:
+        self.refresh_token(token)
+        token_refreshed = True
+        continue
+      
+      if response.status_code in self.RETRY_STATUS_CODES and attempt < self.max_retries:
+        delay = self._backoff(attempt, response)
+        print(f"Request returned {response.status_code}, retrying in {delay:.1f}s")
+        attempt += 1
+        time.sleep(delay)
+        continue
+      
+      return response
+  
+  def fetch_weather_page(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None, optimize = False):
+    """
+    Requests a single page of up to PAGE_SIZE data points from the getmeasure endpoint.
+    If a page cache is configured, cached pages are served without sending a request.
+    Returns:
+      dict or list: The 'body' of the response mapping each timestamp to its list of values, or if optimize is set,
+          the compact list of chunks with 'beg_time', 'step_time' and 'value'. None if the request failed.
+    """
+    cache_key = None
+    if self.cache is not None:
+      optimized = {"optimize": True} if optimize else {}
+      cache_key = self.cache.make_key(device_id, module_id, scale, types, date_begin, date_end, **optimized)
+      body = self.cache.get(cache_key)
+      if body is not None:
+        return body
+    
+    url = f"{self.api_url}/getmeasure"
 
     headers = {
       "accept": "application/json, text/plain, */*",
       "accept-language": "en-US,en;q=0.9,de;q=0.8,de-DE;q=0.7,zh-TW;q=0.6,zh-CN;q=0.5,zh;q=0.4,sv;q=0.3",
-      "authorization": "Bearer " + self.token,
       "content-type": "application/json"
     }
 
@@ -29,7 +164,7 @@ class NetAtmoFetcher():
       "module_id": module_id,
       "scale": scale,
       "type": types,
-      "optimize": False
+      "optimize": optimize
     }
 
     if date_begin is not None:
@@ -37,9 +172,115 @@ class NetAtmoFetcher():
 
     if date_end is not None:
       data['date_end'] = str(date_end)
+    
+    response = self._request("POST", url, headers=headers, json=data)
+    
+    if response.status_code != 200:
+      print(f"Request failed -- StatusCode Expected: 200 -- Actual: {response.status_code}")
+      print(data)
+      print(response.text)
+      return None
+    
+    body = response.json()['body']
+    
+    if self.cache is not None:
+      self.cache.put(cache_key, body, complete=self._is_complete_page(body, date_end))
+    
+    return body
+  
+  def _is_complete_page(self, body, date_end):
+    """
+    A page can't change anymore if it is full, since the following data is requested as the next page,
+    or if its requested range ended long enough ago that no delayed uploads are expected.
+    """
+    if self._count_points(body) >= self.PAGE_SIZE:
+      return True
+    
+    try:
+      return date_end is not None and int(date_end) < time.time() - self.SETTLE_SECONDS
+    except ValueError:
+      return False
+  
+  def _count_points(self, body):
+    if isinstance(body, list):
+      return sum(len(chunk['value']) for chunk in body)
+    return len(body)
+  
+  @staticmethod
+  def decode_optimized_body(body, types):
+    """
+    Decodes the compact optimize=True response of the getmeasure endpoint into NumPy arrays.
+    The body consists of chunks with a 'beg_time', a 'step_time' and a list of value rows (one value per type).
+    Returns:
+      dict: The 'timestamp' array (int64 unix timestamps) and one float64 array per type, with NaN for missing values, in time order.
+    """
+    timestamps = []
+    values = []
+    for chunk in body:
+      rows = chunk['value']
+      if not rows:
+        continue
+      timestamps.append(chunk['beg_time'] + np.arange(len(rows), dtype=np.int64) * chunk.get('step_time', 0))
+      values.append(np.array(rows, dtype=np.float64).reshape(len(rows), len(types)))
+    
+    if not timestamps:
+      columns = {"timestamp": np.empty(0, dtype=np.int64)}
+      columns.update({type: np.empty(0, dtype=np.float64) for type in types})
+      return columns
+    
+    timestamps = np.concatenate(timestamps)
+    values = np.concatenate(values)
+    order = np.argsort(timestamps, kind="stable")
+    
+    columns = {"timestamp": timestamps[order]}
+    for index, type in enumerate(types):
+      columns[type] = values[order, index]
+    return columns
+  
+  def iter_weather_columns(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None, raise_on_error = False):
+    """
+    Pages through the history of a module using the compact optimize=True format and yields every page
+    decoded into NumPy arrays, see `decode_optimized_body`.
+    """
+    while True:
+      response = self.fetch_weather_page(device_id, module_id, types, scale, date_begin, date_end, optimize=True)
       
-    result = []
-
+      if response is None:
+        if raise_on_error:
+          raise Exception(f"Request for module {module_id} of device {device_id} starting at {date_begin} failed")
+        return
+      
+      columns = self.decode_optimized_body(response, types)
+      n_points = len(columns["timestamp"])
+      
+      # A page with a single point still has to be stored, e.g. the last one of a partition
+      if n_points == 0:
+        print("No data points found")
+        return
+      
+      yield columns
+      
+      next_begin = int(columns["timestamp"][-1]) + 1
+      if n_points < self.PAGE_SIZE or (date_begin is not None and next_begin <= int(date_begin)):
+        break
+      
+      date_begin = next_begin
+      print(f"Fetched {n_points} data points, continuing from {datetime.datetime.fromtimestamp(date_begin).isoformat()}")
+  
+  def fetch_weather_columns(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None):
+    pages = list(self.iter_weather_columns(device_id, module_id, types, scale, date_begin, date_end))
+    if not pages:
+      return self.decode_optimized_body([], types)
+    return {key: np.concatenate([page[key] for page in pages]) for key in pages[0]}
+  
+  def iter_weather_data(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None, raise_on_error = False):
+    """
+    Pages through the history of a module and yields every page as soon as it was received,
+    so callers only have to keep a single page in memory.
+    If raise_on_error is set, a failed page request raises an exception instead of silently ending the iteration.
+    Yields:
+      list[dict]: The measurements of one page, each with a 'timestamp' and one value per requested type, in time order.
+    """
     last_timestamp = None
 
     while True:
@@ -47,23 +288,21 @@ class NetAtmoFetcher():
         print("Fetching data starting from begin")
       else:
         print(f"Fetching data starting from {datetime.datetime.fromtimestamp(last_timestamp).isoformat()}")
-        data['date_begin'] = str(last_timestamp)
-      
-      response = requests.post(url, headers=headers, json=data)
+        date_begin = last_timestamp
       
-      if response.status_code != 200:
-        print(f"Request failed -- StatusCode Expected: 200 -- Actual: {response.status_code}")
-        print(data)
-        print(response.json())
-        return result
+      response = self.fetch_weather_page(device_id, module_id, types, scale, date_begin, date_end)
       
-      response = response.json()['body']
+      if response is None:
+        if raise_on_error:
+          raise Exception(f"Request for module {module_id} of device {device_id} starting at {date_begin} failed")
+        return
       
-      if len(response) <= 1:
+      # A page with a single point still has to be stored, e.g. the last one of a partition
+      if len(response) == 0:
         print("No data points found")
-        return result
-      
+        return
       
+      page = []
       timestamps = sorted(list([int(timestamp) for timestamp in response.keys()]))
       for timestamp in timestamps:
         values = response[str(timestamp)]
@@ -73,17 +312,73 @@ class NetAtmoFetcher():
         for index, type in enumerate(types):
           measurement[type] = values[index]
         
-        result.append(measurement)
-        
-      last_timestamp = timestamps[-1] + 1
+        page.append(measurement)
+      
+      yield page
       
-      if len(timestamps) < 1024:
+      if len(timestamps) < self.PAGE_SIZE or (date_begin is not None and timestamps[-1] + 1 <= int(date_begin)):
         break
       
+      last_timestamp = timestamps[-1] + 1
+  
+  def fetch_weather_data(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None):
+    result = []
+    for page in self.iter_weather_data(device_id, module_id, types, scale, date_begin, date_end):
+      result.extend(page)
+    return result
+  
+  def fetch_weather_data_partitioned(self, device_id, module_id, types, scale="1day", date_begin = None, date_end = None, partitions = 8, max_workers = None, optimize = False):
+    """
+    Fetches the history of a single module by splitting [date_begin, date_end] into disjoint sub-ranges that are paginated concurrently.
+    Sequential pagination needs the last timestamp of a page before the next one can be requested, the sub-ranges however are
+    independent, so a long history takes roughly 1/partitions of the round trips in sequence. All requests still pass the rate limiter.
+    The results are merged in time order and timestamps returned by more than one sub-range are only kept once.
+    Args:
+      date_begin (int): Unix timestamp to start fetching from.
+      date_end (int, optional): Unix timestamp to stop fetching at. Defaults to now.
+      partitions (int, optional): Number of sub-ranges. Defaults to 8.
+      max_workers (int, optional): Number of sub-ranges fetched at the same time, should not exceed the pool size of the session. Defaults to partitions.
+      optimize (bool, optional): Use the compact wire format and return NumPy arrays like fetch_weather_columns. Defaults to False.
+    Returns:
+      list[dict] or dict: The measurements like fetch_weather_data returns them, or the arrays like fetch_weather_columns if optimize is set.
+    """
+    if date_begin is None:
+      raise Exception("A partitioned fetch needs a date_begin to split the time range.")
+    date_begin = int(date_begin)
+    date_end = int(time.time()) if date_end is None else int(date_end)
+    
+    bounds = np.unique(np.linspace(date_begin, date_end + 1, max(1, partitions) + 1).astype(np.int64))
+    ranges = [(int(begin), int(end) - 1) for begin, end in zip(bounds[:-1], bounds[1:])]
+    print(f"Fetching module {module_id} of device {device_id} in {len(ranges)} partitions")
+    
+    def fetch_range(begin, end):
+      if optimize:
+        pages = list(self.iter_weather_columns(device_id, module_id, types, scale, begin, end, raise_on_error=True))
+      else:
+        pages = list(self.iter_weather_data(device_id, module_id, types, scale, begin, end, raise_on_error=True))
+      return pages
+    
+    with ThreadPoolExecutor(max_workers=max_workers or len(ranges)) as executor:
+      futures = [executor.submit(fetch_range, begin, end) for begin, end in ranges]
+      pages = [page for future in futures for page in future.result()]
+    
+    if optimize:
+      if not pages:
+        return self.decode_optimized_body([], types)
+      columns = {key: np.concatenate([page[key] for page in pages]) for key in pages[0]}
+      _, first_index = np.unique(columns["timestamp"], return_index=True)
+      return {key: values[first_index] for key, values in columns.items()}
+    
+    result = []
+    seen = set()
+    for measurement in sorted((measurement for page in pages for measurement in page), key=lambda measurement: measurement["timestamp"]):
+      if measurement["timestamp"] not in seen:
+        seen.add(measurement["timestamp"])
+        result.append(measurement)
     return result
   
   def fetch_sensors_for_area(self, area: Rectangle):
-    url = "https://app.netatmo.net/api/getpublicmeasures"
+    url = f"{self.api_url}/getpublicmeasures"
     params = {
       "limit": 1,
       "divider": 7,
@@ -93,8 +388,7 @@ class NetAtmoFetcher():
       "lon_ne": area.north_east.longitude,
       "lat_sw": area.south_west.latitude,
       "lon_sw": area.south_west.longitude,
-      "date_end": "last",
-      "access_token": self.token
+      "date_end": "last"
     }
 
     headers = {
@@ -102,23 +396,22 @@ class NetAtmoFetcher():
         "accept-language": "en-US,en;q=0.9,de;q=0.8,de-DE;q=0.7,zh-TW;q=0.6,zh-CN;q=0.5,zh;q=0.4,sv;q=0.3",
     }
 
-    response = requests.get(url, headers=headers, params=params)
+    response = self._request("GET", url, headers=headers, params=params, token_in_params=True)
 
     if response.status_code != 200:
       print(f"Request failed -- StatusCode Expected: 200 -- Actual: {response.status_code}")
       print(params)
-      print(response.json())
-      return []
+      print(response.text)
+      return params, None
     
     return params, response.json()
 
   def fetch_sensor_data(self, device_id):
-    url = "https://app.netatmo.net/api/getpublicmeasure"
+    url = f"{self.api_url}/getpublicmeasure"
 
     headers = {
         "accept": "application/json, text/plain, */*",
         "accept-language": "en-US,en;q=0.9,de;q=0.8,de-DE;q=0.7,zh-TW;q=0.6,zh-CN;q=0.5,zh;q=0.4,sv;q=0.3",
-        "authorization": "Bearer " + self.token,
         "content-type": "application/json"
     }
 
@@ -127,13 +420,13 @@ class NetAtmoFetcher():
         "get_favorites": False
     }
     
-    response = requests.post(url, headers=headers, json=data)
+    response = self._request("POST", url, headers=headers, json=data)
     
     if response.status_code != 200:
       print(f"Request failed -- StatusCode Expected: 200 -- Actual: {response.status_code}")
       print(data)
-      print(response.json())
-      return None
+      print(response.text)
+      return data, None
     
     return data, response.json()
     
@@ -163,10 +456,12 @@ class NetAtmoInserter():
   NETATMO_INTERVAL_MAPPING = {
     "1day": 60*60*24,
   }
+  LIVE_UPDATE_INTERVAL = 60*5 # Netatmo stations upload roughly every 5 minutes
   
-  def __init__(self, db: SensorDB):
+  def __init__(self, db: SensorDB, rate_limiter: RateLimiter = None, cache: NetAtmoPageCache = None, fetcher: NetAtmoFetcher = None):
     self.db = db
-    self.netatmo_fetcher = NetAtmoFetcher()
+    self.netatmo_fetcher = fetcher if fetcher is not None else NetAtmoFetcher(rate_limiter=rate_limiter, cache=cache)
+    self.failed_squares = []
     
   def get_sensor_by_id(self, original_id) -> Sensor:
     """
@@ -191,7 +486,7 @@ class NetAtmoInserter():
 
     return self.sensor_from_response_item(res['body'][0])
   
-  def fetch_sensors_in_area(self, area_of_interest: Rectangle, store_sensors: bool = False, square_size_m = 1000, request_delay = 2) -> list[Sensor]:   
+  def fetch_sensors_in_area(self, area_of_interest: Rectangle, store_sensors: bool = False, square_size_m = 1000, request_delay = 2, max_workers: int = None) -> list[Sensor]:   
     """
     Fetches sensors located within a specified rectangular area by subdividing the area into smaller squares
     and querying each square for sensors. Ensures that only unique sensors are collected based on their original IDs.
@@ -202,7 +497,12 @@ class NetAtmoInserter():
       square_size_m (int, optional): Determines the number of squares the area is divided into. 
                   Leads to more sensors found, but increases the amount of requests agains the NetAtmo API.
                   Defaults to 1000
-      request_delay (int, optional): Delay in seconds between requests for each square. Defaults to 2.
+      request_delay (int, optional): Delay in seconds between requests for each square. It is not used in concurrent mode.
+                  Defaults to 2.
+      max_workers (int, optional): If set, the squares are requested concurrently by this many worker threads instead of
+                  one after another. The request rate is then governed by the rate limiter of the fetcher. Defaults to None.
+                  Failed requests are retried by the fetcher (see its max_retries), squares that still fail are skipped
+                  and reported, the sensors of all other squares are kept.
     Returns:
       list of sensors: If store_sensors is False, returns a list of unique sensors found in the area.
              If store_sensors is True, returns the result of the store_sensors method.
@@ -211,23 +511,185 @@ class NetAtmoInserter():
     sensor_ids = set()
     sensors = []
     
+    if max_workers is None:
+      square_results = self._scan_squares_serial(squares, request_delay)
+    else:
+      square_results = self._scan_squares_concurrent(squares, max_workers)
+    
+    failed_squares = []
     for index, square in enumerate(squares):
-      _, res = self.netatmo_fetcher.fetch_sensors_for_area(square)
+      body = square_results[index]
+      if body is None:
+        failed_squares.append(square)
+        continue
       
-      for item in res['body']:
+      for item in body:
         sensor = self.sensor_from_response_item(item)
         if sensor.original_id != "" and sensor.original_id not in sensor_ids:
           sensor_ids.add(sensor.original_id)
           sensors.append(sensor)
-      
-      print(f"Square {index}/{len(squares)}: Found {len(res['body'])} sensors. Unique sensors: {len(sensors)}")
-      time.sleep(request_delay)
+    
+    self.failed_squares = failed_squares
+    if failed_squares:
+      print(f"{len(failed_squares)}/{len(squares)} squares failed after {self.netatmo_fetcher.max_retries} retries, their sensors are missing from the result.")
+    print(f"Found {len(sensors)} unique sensors in {len(squares)} squares.")
     
     if store_sensors:
       return self.store_sensors(sensors)
     
     return sensors
   
+  def _scan_squares_serial(self, squares, request_delay):
+    results = []
+    for index, square in enumerate(squares):
+      body = self._fetch_square(square)
+      results.append(body)
+      print(f"Square {index}/{len(squares)}: Found {len(body) if body is not None else 0} sensors.")
+      time.sleep(request_delay)
+    return results
+  
+  def _scan_squares_concurrent(self, squares, max_workers):
+    if self.netatmo_fetcher.rate_limiter is None:
+      print("Warning: scanning concurrently without a rate limiter, requests are only bound by the number of workers.")
+    
+    results = [None] * len(squares)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      futures = {executor.submit(self._fetch_square, square): index for index, square in enumerate(squares)}
+      for done, future in enumerate(as_completed(futures), start=1):
+        index = futures[future]
+        results[index] = future.result()
+        print(f"Square {done}/{len(squares)} done: Found {len(results[index]) if results[index] is not None else 0} sensors.")
+    return results
+  
+  def _fetch_square(self, square: Rectangle):
+    """
+    Requests the sensors of a single square. Throttled, failing and dropped requests are already retried with backoff
+    by the fetcher, so a square is requested only once here and every retry counts against the rate limiter just once.
+    Returns the 'body' of the response or None if the request failed.
+    """
+    try:
+      _, res = self.netatmo_fetcher.fetch_sensors_for_area(square)
+      if res is not None:
+        return res['body']
+    except Exception as e:
+      print(f"Request for square failed: {e}")
+    
+    return None
+  
+  def snapshot_area(self, area_of_interest: Rectangle, square_size_m = 1000, interval = 600, cycles = 1, request_delay = 2, max_workers: int = None, store_unknown_sensors = True) -> list[dict]:
+    """
+    Periodically stores the current readings of every station in an area, using only the area endpoint.
+    The getpublicmeasures response of every square already contains the latest values of all its stations, so a cycle
+    needs one request per square instead of one per station and module. All new values of a cycle are written as
+    "latest" measurements with a single bulk insert. Values that are not newer than the latest stored value of their sensor
+    and type are skipped, whether they were stored by a previous cycle or by an earlier run.
+    Args:
+      area_of_interest (Rectangle): The area to take snapshots of.
+      square_size_m (int, optional): Size of the squares the area is divided into, see fetch_sensors_in_area. Defaults to 1000.
+      interval (int, optional): Seconds between the start of two cycles. Defaults to 600.
+      cycles (int, optional): Number of snapshots to take, None runs until interrupted. Defaults to 1.
+      request_delay (int, optional): Delay between the square requests, see fetch_sensors_in_area. Defaults to 2.
+      max_workers (int, optional): Request the squares concurrently with this many workers, see fetch_sensors_in_area. Defaults to None.
+      store_unknown_sensors (bool, optional): Store stations that are not in the database yet, otherwise their values are skipped. Defaults to True.
+    Returns:
+      list[dict]: Per cycle the number of 'stations' in the responses, 'stored' measurements, 'duplicates' and 'failed_squares'.
+    """
+    squares = area_of_interest.subdivide(square_size_m)
+    known_sensors = {sensor.original_id: sensor for sensor in self.db.get_sensors_by_source(self.IDENTIFIER)}
+    last_snapshot = {}
+    seeded_sensors = set()
+    summaries = []
+    cycle = 0
+    
+    while cycles is None or cycle < cycles:
+      started = time.monotonic()
+      
+      if max_workers is None:
+        square_results = self._scan_squares_serial(squares, request_delay)
+      else:
+        square_results = self._scan_squares_concurrent(squares, max_workers)
+      
+      stations = {}
+      for body in square_results:
+        for item in body or []:
+          if '_id' in item:
+            stations[item['_id']] = item
+      
+      measurements = []
+      newest = {}
+      duplicates = 0
+      for original_id, item in stations.items():
+        sensor = known_sensors.get(original_id)
+        if sensor is None:
+          if not store_unknown_sensors:
+            continue
+          sensor = self.sensor_from_response_item(item)
+          if sensor.original_id == "":
+            continue
+          sensor = self.db.upsert_sensor(sensor)
+          known_sensors[original_id] = sensor
+        
+        if sensor.sensor_id not in seeded_sensors:
+          # Readings stored by earlier runs count as already stored, so scheduled single-cycle runs don't insert them again
+          for measurement_type, timestamp in self.db.get_latest_timestamps_for_sensor(sensor.sensor_id).items():
+            last_snapshot[(sensor.sensor_id, measurement_type)] = timestamp
+          seeded_sensors.add(sensor.sensor_id)
+        
+        for measurement in self.measurements_from_response_item(item, sensor):
+          key = (sensor.sensor_id, measurement.measurement_type)
+          if last_snapshot.get(key) is not None and measurement.timestamp <= last_snapshot[key]:
+            duplicates += 1
+            continue
+          newest[key] = max(measurement.timestamp, newest.get(key, measurement.timestamp))
+          measurements.append(measurement)
+      
+      stored = self.db.insert_batch_measurements(measurements) if measurements else 0
+      if stored == len(measurements):
+        # A failed insert leaves the previous state, so the next cycle stores these values again
+        last_snapshot.update(newest)
+      summary = {"stations": len(stations), "stored": stored, "duplicates": duplicates, "failed_squares": square_results.count(None)}
+      summaries.append(summary)
+      print(f"Snapshot {cycle + 1}: {summary}")
+      
+      cycle += 1
+      if cycles is None or cycle < cycles:
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+    
+    return summaries
+  
+  def measurements_from_response_item(self, item, sensor: Sensor) -> list[Measurement]:
+    """
+    Extracts the current readings contained in the 'measures' of a getpublicmeasures or getpublicmeasure response item.
+    Modules with a 'res' field map timestamps to one value per listed type, rain and wind modules carry their values
+    as single fields together with a 'rain_timeutc' or 'wind_timeutc' timestamp.
+    Args:
+      item (dict): A single station of the Netatmo API response.
+      sensor (Sensor): The stored sensor of the station.
+    Returns:
+      list[Measurement]: The readings of all modules of the station.
+    """
+    measurements = []
+    for module in item.get('measures', {}).values():
+      readings = []
+      if 'res' in module and 'type' in module:
+        for timestamp, values in module['res'].items():
+          readings.extend((m_type, int(timestamp), value) for m_type, value in zip(module['type'], values))
+      else:
+        timestamp = module.get('rain_timeutc', module.get('wind_timeutc'))
+        if timestamp is None:
+          continue
+        readings.extend((m_type, timestamp, value) for m_type, value in module.items()
+                        if m_type in self.NETATMO_TYPE_MAPPING)
+      
+      for m_type, timestamp, value in readings:
+        if value is None or m_type not in self.NETATMO_TYPE_MAPPING:
+          continue
+        measurement_type = self.NETATMO_TYPE_MAPPING[m_type]
+        measurements.append(Measurement(measurement_type.value, sensor.position, datetime.datetime.fromtimestamp(timestamp),
+                                        MeasurementType.get_unit_for_type(measurement_type), value, sensor.sensor_id))
+    
+    return measurements
+  
   def store_sensors(self, sensors) -> list[Sensor]:
     """
     Stores a list of sensor objects in the database.
@@ -247,40 +709,59 @@ class NetAtmoInserter():
       
     return stored_sensors
   
-  def store_measurements(self, sensor: Sensor, received_measurements, scale):
+  def store_measurements(self, sensor: Sensor, received_measurements, scale) -> int:
+    return self._insert_measurements(self.build_measurements(sensor, received_measurements, scale), scale)
+
+  def build_measurements(self, sensor: Sensor, received_measurements, scale) -> list:
+    """
+    Converts received measurements into Measurement (scale "latest") or AggregatedMeasurement objects without storing them.
+    """
     assert scale in ["latest", "1day"], "Currently we can only story daily or latest measurements in the database."
 
     if scale == "latest":
-      self._store_live_measurements(sensor, received_measurements)
-    else:
-      self._store_agr_measurements(sensor, received_measurements, scale)
+      return self._live_measurements(sensor, received_measurements)
+    return self._agr_measurements(sensor, received_measurements, scale)
+
+  def _insert_measurements(self, measurements, scale) -> int:
+    if scale == "latest":
+      return self.db.insert_batch_measurements(measurements)
+    return self.db.insert_batch_aggregated_measurements(measurements)
 
 
-  def _store_live_measurements(self, sensor, received_measurements):
+  def _live_measurements(self, sensor, received_measurements):
     print(f"Starting to store {len(received_measurements)} received measurements for sensor {sensor.original_id}")
     measurements = []
     for received_measurement in received_measurements:
-      for m_type in received_measurement:
-        if m_type == "timestamp":
-          continue
+      if "columns" in received_measurement:
+        measurements.extend(self._measurements_from_columns(sensor, received_measurement["columns"]))
+        continue
+      
+      for module_measurement in received_measurement["measurements"]:
+        for m_type in module_measurement:
+          if m_type == "timestamp":
+            continue
 
-        measurement_type = self.NETATMO_TYPE_MAPPING[m_type]
-        unit = MeasurementType.get_unit_for_type(measurement_type)
+          measurement_type = self.NETATMO_TYPE_MAPPING[m_type]
+          unit = MeasurementType.get_unit_for_type(measurement_type)
 
-        timestamp = datetime.datetime.fromtimestamp(received_measurement['timestamp'])
+          timestamp = datetime.datetime.fromtimestamp(module_measurement['timestamp'])
 
-        measurement = Measurement(measurement_type.value, sensor.position, timestamp, unit,
-                                  received_measurement[m_type], sensor.sensor_id)
-        measurements.append(measurement)
+          measurement = Measurement(measurement_type.value, sensor.position, timestamp, unit,
+                                    module_measurement[m_type], sensor.sensor_id)
+          measurements.append(measurement)
 
     print(f"Storing {len(measurements)} for sensor {sensor.original_id}")
-    self.db.insert_batch_measurements(measurements)
+    return measurements
 
-  def _store_agr_measurements(self, sensor, received_measurements, scale):
+  def _agr_measurements(self, sensor, received_measurements, scale):
     print(f"Starting to store {len(received_measurements)} received measurements for sensor {sensor.original_id} aggregated with a scale of {scale}")
 
     measurements = []
     for received_measurement in received_measurements:
+      if "columns" in received_measurement:
+        measurements.extend(self._measurements_from_columns(sensor, received_measurement["columns"], scale))
+        continue
+      
       for module_measurement in received_measurement["measurements"]:
         for m_type in module_measurement:
           if m_type == "timestamp":
@@ -298,7 +779,37 @@ class NetAtmoInserter():
           measurements.append(measurement)
 
     print(f"Storing {len(measurements)} aggregated measurements for sensor {sensor.original_id}")
-    self.db.insert_batch_aggregated_measurements(measurements)
+    return measurements
+
+  def _measurements_from_columns(self, sensor, columns, scale = "latest"):
+    """
+    Converts the columnar arrays of a module (see NetAtmoFetcher.decode_optimized_body) into measurements.
+    Missing (NaN) values are skipped, and every timestamp is converted only once for all types.
+    """
+    timestamps = columns["timestamp"]
+    if len(timestamps) == 0:
+      return []
+    datetimes = np.array([datetime.datetime.fromtimestamp(timestamp) for timestamp in timestamps.tolist()], dtype=object)
+    
+    measurements = []
+    for m_type, values in columns.items():
+      if m_type == "timestamp":
+        continue
+      
+      measurement_type = self.NETATMO_TYPE_MAPPING[m_type]
+      unit = MeasurementType.get_unit_for_type(measurement_type)
+      valid = ~np.isnan(values)
+      
+      if scale == "latest":
+        measurements.extend(Measurement(measurement_type.value, sensor.position, timestamp, unit, value, sensor.sensor_id)
+                            for timestamp, value in zip(datetimes[valid], values[valid].tolist()))
+      else:
+        interval = self.NETATMO_INTERVAL_MAPPING[scale]
+        aggregation_method = self._get_aggregation_method_for_type(m_type)
+        measurements.extend(AggregatedMeasurement(measurement_type.value, sensor.position, timestamp, unit, value, sensor.sensor_id, interval, aggregation_method)
+                            for timestamp, value in zip(datetimes[valid], values[valid].tolist()))
+    
+    return measurements
 
   def sensor_from_response_item(self, item):
     """
@@ -338,7 +849,128 @@ class NetAtmoInserter():
     
     return Sensor(additional_information="", original_id=item['_id'], position=position, sensor_type=modules, source=self.IDENTIFIER)
   
-  def fetch_data_from_sensor(self, sensor: Sensor, types, scale="1day", date_begin = None, date_end = None):
+  def fetch_data_from_sensor(self, sensor: Sensor, types, scale="1day", date_begin = None, date_end = None, optimize = False, partitions = 1):
+    """
+    Fetches the measurements of all selected modules of a sensor.
+    If optimize is set, the compact wire format is requested and every module carries its data as NumPy arrays
+    under 'columns' instead of a list of 'measurements', which store_measurements accepts as well.
+    With more than one partition, the history of every module is split into that many time ranges which are fetched
+    concurrently, see NetAtmoFetcher.fetch_weather_data_partitioned. This requires a date_begin.
+    """
+    measurements = []
+    
+    for module_id, selected_types in self._select_modules(sensor, types, scale):
+      if partitions > 1:
+        data = self.netatmo_fetcher.fetch_weather_data_partitioned(sensor.original_id, module_id, selected_types, scale, date_begin, date_end, partitions, optimize=optimize)
+        print(f"Received {len(data['timestamp']) if optimize else len(data)} measurements for {selected_types} on sensor {sensor.original_id}")
+        measurements.append({
+          'module_id': module_id,
+          'columns' if optimize else 'measurements': data
+        })
+        continue
+      
+      if optimize:
+        columns = self.netatmo_fetcher.fetch_weather_columns(sensor.original_id, module_id, selected_types, scale, date_begin, date_end)
+        print(f"Received {len(columns['timestamp'])} measurements for {selected_types} on sensor {sensor.original_id}")
+        measurements.append({
+          'module_id': module_id,
+          'columns': columns
+        })
+        continue
+      
+      data = self.netatmo_fetcher.fetch_weather_data(sensor.original_id, module_id, selected_types, scale, date_begin, date_end)
+      print(f"Received {len(data)} measurements for {selected_types} on sensor {sensor.original_id}")
+      measurements.append({
+        'module_id': module_id,
+        'measurements': data
+      })
+    
+    return measurements
+  
+  def stream_data_from_sensor(self, sensor: Sensor, types, scale="1day", date_begin = None, date_end = None, queue_size = 4, on_page = None, module_ids = None, optimize = False) -> int:
+    """
+    Fetches and stores the measurements of a sensor page by page instead of collecting its whole history first.
+    A fetcher thread pages through all selected modules and hands every page to the calling thread through a bounded queue,
+    where it is converted and inserted while the next pages are already requested. Memory therefore stays bound by
+    `queue_size` pages, and the total time approaches the slower of fetching and writing instead of their sum.
+    A page request that still fails after the fetcher's retries raises, so callers can continue from the last stored page.
+    Args:
+      sensor (Sensor): The Netatmo sensor to fetch the measurements of.
+      types (list or str): The Netatmo types to fetch, or 'all' for every type of a module.
+      scale (str, optional): Either "latest" or "1day", the scales that can be stored. Defaults to "1day".
+      date_begin (int, optional): Unix timestamp to start fetching from. Defaults to None.
+      date_end (int, optional): Unix timestamp to stop fetching at. Defaults to None.
+      queue_size (int, optional): Maximum number of fetched pages waiting to be stored. Defaults to 4.
+      on_page (callable, optional): Called as on_page(module_id, page, stored) after every completely stored page.
+        A page that could not be stored raises instead. Defaults to None.
+      module_ids (list, optional): Only stream the modules with these ids. Defaults to all modules of the sensor.
+      optimize (bool, optional): Request the compact wire format and hand the pages on as NumPy arrays. Defaults to False.
+    Returns:
+      int: The number of stored measurements.
+    """
+    assert scale in ["latest", "1day"], "Currently we can only story daily or latest measurements in the database."
+    
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    
+    def put(item):
+      while not stop.is_set():
+        try:
+          pages.put(item, timeout=0.5)
+          return True
+        except queue.Full:
+          continue
+      return False
+    
+    def fetch():
+      try:
+        for module_id, selected_types in self._select_modules(sensor, types, scale):
+          if module_ids is not None and module_id not in module_ids:
+            continue
+          iter_pages = self.netatmo_fetcher.iter_weather_columns if optimize else self.netatmo_fetcher.iter_weather_data
+          for page in iter_pages(sensor.original_id, module_id, selected_types, scale, date_begin, date_end, raise_on_error=True):
+            if not put((module_id, page)):
+              return
+      except Exception as e:
+        put(e)
+        return
+      put(None)
+    
+    fetcher = threading.Thread(target=fetch, name=f"netatmo-fetch-{sensor.original_id}", daemon=True)
+    fetcher.start()
+    
+    stored = 0
+    try:
+      while True:
+        item = pages.get()
+        if item is None:
+          break
+        if isinstance(item, Exception):
+          raise item
+        
+        module_id, page = item
+        page_key = 'columns' if optimize else 'measurements'
+        measurements = self.build_measurements(sensor, [{'module_id': module_id, page_key: page}], scale)
+        page_stored = self._insert_measurements(measurements, scale)
+        if page_stored != len(measurements):
+          # SensorDB reports a failed insert only by its count, the page must not count as stored then
+          raise Exception(f"Storing a page of module {module_id} of sensor {sensor.original_id} failed, "
+                          f"stored {page_stored} of {len(measurements)} measurements")
+        stored += page_stored
+        
+        if on_page is not None:
+          on_page(module_id, page, page_stored)
+    finally:
+      stop.set()
+      fetcher.join()
+    
+    print(f"Streamed {stored} measurements for sensor {sensor.original_id}")
+    return stored
+  
+  def _select_modules(self, sensor: Sensor, types, scale):
+    """
+    Returns the module ids of a sensor together with the selected types to fetch for each of them.
+    """
     assert sensor.source == self.IDENTIFIER, f"Must be a '{self.IDENTIFIER}' sensor to receive measurements, got '{sensor.source}' instead"
     assert scale in ["latest", "30min", "1hour", "3hours", "1day", "1week", "1month"], f"Scale must be one of the following: (latest, 30min, 1hour, 3hours, 1day, 1week, 1month), got {scale} instead"
     assert sensor.sensor_type != "", "The sensor_type field must contain module information, but is empty for this sensor."
@@ -346,10 +978,9 @@ class NetAtmoInserter():
     modules = json.loads(sensor.sensor_type)
     get_all = types == 'all'
     
-    measurements = []
-    
     print(f"Get all: {get_all}")
     
+    selected_modules = []
     for module in modules:
       if get_all:
         selected_types = module['types']
@@ -358,16 +989,228 @@ class NetAtmoInserter():
       
       if selected_types:
         print(f"{module['module_id']}: Found selected types: {selected_types}")
-        
-        data = self.netatmo_fetcher.fetch_weather_data(sensor.original_id, module['module_id'], selected_types, scale, date_begin, date_end)
-        print(f"Received {len(data)} measurements for {selected_types} on sensor {sensor.original_id}")
+        selected_modules.append((module['module_id'], selected_types))
+    
+    return selected_modules
+  
+  def sync_sensors(self, types = 'all', scale = "1day", sensors: list[Sensor] = None) -> dict:
+    """
+    Brings the stored measurements of Netatmo sensors up to date.
+    For every sensor the latest stored timestamp of each measurement type is looked up and only newer data is fetched and stored.
+    Since the progress is read from the database, an interrupted sync can simply be started again and continues
+    with the sensors that are not up to date yet.
+    Args:
+      types (list or str, optional): The Netatmo types to sync, or 'all' for every type of a module. Defaults to 'all'.
+      scale (str, optional): The scale to sync, either "latest" or "1day". Defaults to "1day".
+      sensors (list[Sensor], optional): The sensors to sync. Defaults to all stored Netatmo sensors.
+    Returns:
+      dict: Number of sensors that were 'synced', already 'up_to_date' or 'failed', and the number of 'stored' measurements.
+    """
+    assert scale in ["latest", "1day"], "Currently we can only sync daily or latest measurements."
+    
+    if sensors is None:
+      sensors = self.db.get_sensors_by_source(self.IDENTIFIER)
+    
+    summary = {"synced": 0, "up_to_date": 0, "failed": 0, "stored": 0}
+    
+    for index, sensor in enumerate(sensors):
+      try:
+        stored = self.sync_sensor(sensor, types, scale)
+      except Exception as e:
+        print(f"Sensor {index + 1}/{len(sensors)} ({sensor.original_id}): Sync failed: {e}")
+        summary["failed"] += 1
+        continue
+      
+      if stored is None:
+        summary["up_to_date"] += 1
+      else:
+        summary["synced"] += 1
+        summary["stored"] += stored
+      print(f"Sensor {index + 1}/{len(sensors)} ({sensor.original_id}): {'up to date' if stored is None else f'stored {stored} measurements'}")
+    
+    print(f"Sync finished: {summary}")
+    return summary
+  
+  def sync_sensor(self, sensor: Sensor, types = 'all', scale = "1day") -> int:
+    """
+    Fetches and stores all data of a sensor that is newer than its latest stored measurement of each type.
+    Returns:
+      int: The number of stored measurements, or None if every module of the sensor was already up to date.
+    """
+    assert sensor.source == self.IDENTIFIER, f"Must be a '{self.IDENTIFIER}' sensor to sync, got '{sensor.source}' instead"
+    assert sensor.sensor_type != "", "The sensor_type field must contain module information, but is empty for this sensor."
+    
+    aggregated = scale != "latest"
+    interval = self.NETATMO_INTERVAL_MAPPING[scale] if aggregated else self.LIVE_UPDATE_INTERVAL
+    latest_timestamps = self.db.get_latest_timestamps_for_sensor(sensor.sensor_id, aggregated=aggregated, aggregation_interval=interval if aggregated else None)
+    
+    modules = json.loads(sensor.sensor_type)
+    now = time.time()
+    measurements = []
+    
+    for module in modules:
+      if types == 'all':
+        selected_types = module['types']
+      else:
+        selected_types = self._select_types_with_subtypes(module['types'], types)
+      
+      if not selected_types:
+        continue
+      
+      watermarks = {m_type: self._get_watermark(latest_timestamps, m_type, aggregated) for m_type in selected_types}
+      
+      if None in watermarks.values():
+        date_begin = None
+      else:
+        date_begin = int(min(watermarks.values())) + 1
+        if date_begin + interval > now:
+          continue
+      
+      data = self.netatmo_fetcher.fetch_weather_data(sensor.original_id, module['module_id'], selected_types, scale, date_begin)
+      data = self._drop_stored_values(data, watermarks)
+      
+      if data:
         measurements.append({
           'module_id': module['module_id'],
           'measurements': data
         })
     
-    return measurements
+    if not measurements:
+      return None
     
+    return self.store_measurements(sensor, measurements, scale)
+  
+  def _get_watermark(self, latest_timestamps, m_type, aggregated):
+    measurement_type = self.NETATMO_TYPE_MAPPING[m_type].value
+    if aggregated:
+      latest = latest_timestamps.get((measurement_type, self._get_aggregation_method_for_type(m_type)))
+    else:
+      latest = latest_timestamps.get(measurement_type)
+    
+    return latest.timestamp() if latest is not None else None
+  
+  def _drop_stored_values(self, data, watermarks):
+    """
+    Removes the values of types that were already stored up to a later timestamp than the module's fetch started from.
+    """
+    filtered = []
+    for measurement in data:
+      kept = {m_type: value for m_type, value in measurement.items()
+              if m_type == "timestamp" or watermarks.get(m_type) is None or measurement['timestamp'] > watermarks[m_type]}
+      if len(kept) > 1:
+        filtered.append(kept)
+    return filtered
+  
+  def quality_control(self, sensors: list[Sensor], m_type = "temperature", scale = "1day", from_timestamp = None, to_timestamp = None, **qc_params) -> dict:
+    """
+    Runs the quality control checks over the stored measurements of a group of sensors and stores a QCFlag for every measurement.
+    Nothing is deleted, so the checks can be rerun with other parameters and every consumer decides which flags to filter by.
+    All sensors are loaded with a single query and checked together, since the spatial check compares them with each other.
+    Args:
+      sensors (list[Sensor]): The stored sensors to check, usually all sensors of an area.
+      m_type (str, optional): The Netatmo type to check. Aggregated data is checked for the aggregation method of the type,
+                              e.g. "min_temp" for the daily minimum. Defaults to "temperature".
+      scale (str, optional): Either "latest" or "1day". Defaults to "1day".
+      from_timestamp (str, optional): Only check measurements from this timestamp on (YYYY-MM-DD HH:MI:SS). Defaults to None.
+      to_timestamp (str, optional): Only check measurements up to this timestamp (YYYY-MM-DD HH:MI:SS). Defaults to None.
+      **qc_params: Parameters of the checks, see data_preprocessing.quality_control.run_quality_control.
+    Returns:
+      dict: Number of flagged measurements per QCFlag name.
+    """
+    assert scale in ["latest", "1day"], "Currently we can only check daily or latest measurements."
+    
+    measurement_type = self.NETATMO_TYPE_MAPPING[m_type]
+    aggregation = self._qc_aggregation(m_type, scale)
+    rows = self.db.get_measurement_arrays([sensor.sensor_id for sensor in sensors], measurement_type.value, from_timestamp, to_timestamp, **aggregation)
+    
+    return self._flag_rows(sensors, measurement_type, rows, scale, aggregation, **qc_params)
+  
+  def fetch_and_store_with_qc(self, sensors: list[Sensor], types = 'all', scale = "1day", date_begin = None, date_end = None, qc_type = "temperature", **qc_params) -> dict:
+    """
+    Fetches and stores the measurements of a group of sensors and checks one type of them before they reach any consumer.
+    The data is fetched in the compact wire format, so the checks run directly on the fetched arrays instead of
+    reading the stored rows back. Flagged values are stored like all others, their flags are stored next to them.
+    Args:
+      sensors (list[Sensor]): The stored sensors to fetch.
+      types (list or str, optional): The Netatmo types to fetch, or 'all' for every type of a module. Defaults to 'all'.
+      scale (str, optional): Either "latest" or "1day". Defaults to "1day".
+      date_begin (int, optional): Unix timestamp to start fetching from. Defaults to None.
+      date_end (int, optional): Unix timestamp to stop fetching at. Defaults to None.
+      qc_type (str, optional): The fetched Netatmo type to check. Defaults to "temperature".
+      **qc_params: Parameters of the checks, see data_preprocessing.quality_control.run_quality_control.
+    Returns:
+      dict: Number of 'stored' measurements and the number of flagged measurements per QCFlag name under 'flags'.
+    """
+    assert scale in ["latest", "1day"], "Currently we can only store daily or latest measurements in the database."
+    
+    stored = 0
+    sensor_ids, timestamps, values = [], [], []
+    
+    for sensor in sensors:
+      fetched = self.fetch_data_from_sensor(sensor, types, scale, date_begin, date_end, optimize=True)
+      stored += self.store_measurements(sensor, fetched, scale)
+      
+      for module in fetched:
+        columns = module['columns']
+        if qc_type not in columns or len(columns['timestamp']) == 0:
+          continue
+        
+        valid = ~np.isnan(columns[qc_type])
+        # Measurements are stored with local time stamps, the flags have to refer to the same stored values
+        local_timestamps = np.array([datetime.datetime.fromtimestamp(timestamp) for timestamp in columns['timestamp'][valid].tolist()], dtype="datetime64[s]")
+        sensor_ids.append(np.full(np.count_nonzero(valid), sensor.sensor_id, dtype=np.int64))
+        timestamps.append(local_timestamps.astype(np.int64))
+        values.append(columns[qc_type][valid])
+    
+    rows = {
+      "sensor_id": np.concatenate(sensor_ids) if sensor_ids else np.empty(0, dtype=np.int64),
+      "timestamp": np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.int64),
+      "value": np.concatenate(values) if values else np.empty(0),
+    }
+    flags = self._flag_rows(sensors, self.NETATMO_TYPE_MAPPING[qc_type], rows, scale, self._qc_aggregation(qc_type, scale), **qc_params)
+    
+    return {"stored": stored, "flags": flags}
+  
+  def _qc_aggregation(self, m_type, scale):
+    """
+    Returns the aggregation of the checked rows as keyword arguments of get_measurement_arrays and upsert_batch_qc_flags,
+    so flags of raw and aggregated rows, and of e.g. the daily minimum and maximum of the same measurement type, are kept apart.
+    """
+    aggregated = scale != "latest"
+    return {
+      "aggregated": aggregated,
+      "aggregation_interval": self.NETATMO_INTERVAL_MAPPING[scale] if aggregated else None,
+      "aggregation_method": self._get_aggregation_method_for_type(m_type) if aggregated else None,
+    }
+  
+  def _flag_rows(self, sensors, measurement_type, rows, scale, aggregation, **qc_params):
+    """
+    Places measurement rows of many sensors onto one grid, runs the checks on it and stores the flag of every row
+    together with the aggregation of the rows (see _qc_aggregation).
+    """
+    if len(rows["timestamp"]) == 0:
+      print(f"No {measurement_type.name} measurements to check for {len(sensors)} sensors")
+      return {}
+    
+    sensor_ids = np.array([sensor.sensor_id for sensor in sensors])
+    order = np.argsort(sensor_ids)
+    sensor_index = order[np.searchsorted(sensor_ids, rows["sensor_id"], sorter=order)]
+    step = self.NETATMO_INTERVAL_MAPPING[scale] if scale != "latest" else self.LIVE_UPDATE_INTERVAL
+    
+    grid, _, time_index = grid_from_rows(sensor_index, rows["timestamp"], rows["value"], len(sensors), step)
+    positions = np.array([[sensor.position.latitude, sensor.position.longitude] for sensor in sensors])
+    flags = run_quality_control(grid, positions, **qc_params)
+    row_flags = flags[time_index, sensor_index]
+    
+    self.db.create_qc_flag_table()
+    self.db.upsert_batch_qc_flags(rows["sensor_id"], measurement_type.value, rows["timestamp"], row_flags, **aggregation)
+    
+    # OK is no bit of its own, it counts the rows without any flag. Iterating QCFlag skips it on newer Python versions.
+    counts = {flag.name: int(np.count_nonzero(row_flags == 0 if flag == QCFlag.OK else row_flags & np.uint8(flag)))
+              for flag in QCFlag.__members__.values()}
+    print(f"Checked {len(row_flags)} {measurement_type.name} measurements of {len(sensors)} sensors: {counts}")
+    return counts
+  
   def _select_types_with_subtypes(self, module_types, type_filter):
     selected_types = []
     for mtype in module_types:
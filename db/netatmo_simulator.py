@@ -0,0 +1,259 @@
+import json
+import time
+import threading
+import numpy as np
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from db.rate_limiter import RateLimiter
+from models import Rectangle
+
+
+class NetAtmoSimulator:
+  """
+  Local stand-in for the Netatmo weathermap API to load-test and profile the ingestion without using the real API.
+  It serves 'weathermap/token', 'getpublicmeasures', 'getpublicmeasure' and the paged 'getmeasure' endpoint
+  (including the page size of 1024 points and both optimize modes) for deterministic synthetic stations spread over an area.
+  Args:
+    area (Rectangle): The area the stations are placed in.
+    n_stations (int, optional): Number of synthetic stations. Defaults to 100.
+    seed (int, optional): Seed of the station placement, the same seed always creates the same stations and values. Defaults to 0.
+    history_days (int, optional): Number of days of history every station has. Defaults to 365.
+    latency (float, optional): Seconds every request is delayed by. Defaults to 0.
+    throttle_rps (float, optional): If set, requests above this rate are answered with 429 and a 'Retry-After' header. Defaults to None.
+    throttle_burst (int, optional): Burst of the throttling token bucket. Defaults to 10.
+    host (str, optional): Host to bind to. Defaults to "127.0.0.1".
+    port (int, optional): Port to bind to, 0 picks a free port. Defaults to 0.
+  """
+  PAGE_SIZE = 1024
+  TOKEN = "simulated-token"
+  SCALE_SECONDS = {
+    "latest": 60*5,
+    "max": 60*5,
+    "30min": 60*30,
+    "1hour": 60*60,
+    "3hours": 60*60*3,
+    "1day": 60*60*24,
+    "1week": 60*60*24*7,
+    "1month": 60*60*24*30,
+  }
+
+  def __init__(self, area: Rectangle, n_stations = 100, seed = 0, history_days = 365, latency = 0.0, throttle_rps = None, throttle_burst = 10, host = "127.0.0.1", port = 0):
+    self.area = area
+    self.seed = seed
+    self.latency = latency
+    self.now = int(time.time())
+    self.history_begin = self.now - history_days * 60*60*24
+    self.throttle = RateLimiter(throttle_rps, throttle_burst) if throttle_rps is not None else None
+    self.stations = self._create_stations(n_stations)
+    self.stations_by_id = {station["_id"]: station for station in self.stations}
+
+    self.stats_lock = threading.Lock()
+    self.request_counts = {}
+    self.throttled = 0
+
+    self.server = ThreadingHTTPServer((host, port), self._create_handler())
+    self.server.daemon_threads = True
+    self.thread = None
+
+  @property
+  def api_url(self) -> str:
+    return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}/api"
+
+  @property
+  def auth_url(self) -> str:
+    return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+  @property
+  def total_requests(self) -> int:
+    return sum(self.request_counts.values())
+
+  def start(self) -> 'NetAtmoSimulator':
+    self.thread = threading.Thread(target=self.server.serve_forever, name="netatmo-simulator", daemon=True)
+    self.thread.start()
+    print(f"Netatmo simulator with {len(self.stations)} stations listening on {self.auth_url}")
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+    if self.thread is not None:
+      self.thread.join()
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *_):
+    self.stop()
+
+  def _create_stations(self, n_stations):
+    rng = np.random.default_rng(self.seed)
+    latitudes = rng.uniform(self.area.south_west.latitude, self.area.north_east.latitude, n_stations)
+    longitudes = rng.uniform(self.area.south_west.longitude, self.area.north_east.longitude, n_stations)
+    offsets = rng.normal(0, 1.5, n_stations)
+
+    stations = []
+    for index in range(n_stations):
+      suffix = ":".join(f"{byte:02x}" for byte in index.to_bytes(3, "big"))
+      modules = {
+        f"70:ee:50:{suffix}": ["pressure"],
+        f"02:00:00:{suffix}": ["temperature", "humidity"],
+      }
+      if index % 3 == 0:
+        modules[f"05:00:00:{suffix}"] = ["rain_60min", "rain_24h", "rain_live"]
+      if index % 5 == 0:
+        modules[f"06:00:00:{suffix}"] = ["wind_strength", "wind_angle", "gust_strength", "gust_angle"]
+
+      stations.append({
+        "_id": f"70:ee:50:{suffix}",
+        "index": index,
+        "location": [float(longitudes[index]), float(latitudes[index])],
+        "offset": float(offsets[index]),
+        "modules": modules,
+      })
+    return stations
+
+  def _values(self, station, m_type, timestamps):
+    """
+    Deterministic synthetic values of a type for an array of timestamps: an annual and a daily cycle plus a station offset
+    and pseudo-random but reproducible noise.
+    """
+    days = timestamps / (60*60*24)
+    annual = np.sin(2 * np.pi * (days - 110) / 365.25)
+    daily = np.sin(2 * np.pi * (days % 1 - 0.375))
+    noise = np.sin(timestamps * 12.9898 + station["index"] * 78.233) * 43758.5453 % 1 - 0.5
+
+    if m_type.endswith("temp") or m_type == "temperature":
+      values = 9 + 9 * annual + 4 * daily + station["offset"] + noise
+      if m_type.startswith("min_"):
+        values -= 4
+      elif m_type.startswith("max_"):
+        values += 4
+    elif m_type.endswith("hum") or m_type == "humidity":
+      values = np.clip(78 - 10 * annual - 12 * daily + 10 * noise, 20, 100)
+    elif "pressure" in m_type:
+      values = 1013 + 8 * np.sin(2 * np.pi * days / 5) + 2 * noise
+    elif m_type.startswith("rain"):
+      values = np.maximum(0, noise * 4 - 1)
+    elif m_type.endswith("angle"):
+      values = (180 + 170 * noise) // 1
+    else:
+      values = np.abs(12 + 6 * annual + 10 * noise)
+
+    return np.round(values, 1)
+
+  def _public_item(self, station):
+    timestamp = self.now - self.now % 600
+    measures = {}
+    for module_id, types in station["modules"].items():
+      values = [float(self._values(station, m_type, np.array([timestamp]))[0]) for m_type in types]
+      if types[0] == "rain_60min":
+        measures[module_id] = {**dict(zip(types, values)), "rain_timeutc": timestamp}
+      elif types[0] == "wind_strength":
+        measures[module_id] = {**dict(zip(types, values)), "wind_timeutc": timestamp}
+      else:
+        measures[module_id] = {"res": {str(timestamp): values}, "type": types}
+
+    return {
+      "_id": station["_id"],
+      "place": {"location": station["location"]},
+      "mark": 10,
+      "measures": measures,
+      "modules": [module_id for module_id in station["modules"] if module_id != station["_id"]],
+    }
+
+  def _getpublicmeasures(self, params):
+    lat_ne, lon_ne = float(params["lat_ne"][0]), float(params["lon_ne"][0])
+    lat_sw, lon_sw = float(params["lat_sw"][0]), float(params["lon_sw"][0])
+    body = [self._public_item(station) for station in self.stations
+            if lat_sw <= station["location"][1] <= lat_ne and lon_sw <= station["location"][0] <= lon_ne]
+    return 200, {"status": "ok", "body": body}
+
+  def _getpublicmeasure(self, data):
+    station = self.stations_by_id.get(data.get("device_id"))
+    return 200, {"status": "ok", "body": [self._public_item(station)] if station is not None else []}
+
+  def _getmeasure(self, data):
+    station = self.stations_by_id.get(data.get("device_id"))
+    if station is None or data.get("module_id") not in station["modules"]:
+      return 400, {"error": {"code": 9, "message": "Device not found"}}
+
+    types = data["type"] if isinstance(data["type"], list) else data["type"].split(",")
+    step = self.SCALE_SECONDS.get(data.get("scale"), self.SCALE_SECONDS["1day"])
+    date_begin = max(int(data.get("date_begin") or self.history_begin), self.history_begin)
+    date_end = min(int(data.get("date_end") or self.now), self.now)
+
+    first = date_begin + (-date_begin) % step
+    last = min(date_end, first + (self.PAGE_SIZE - 1) * step)
+    timestamps = np.arange(first, last + 1, step, dtype=np.int64)
+    values = np.stack([self._values(station, m_type, timestamps) for m_type in types], axis=1) if len(timestamps) else np.empty((0, len(types)))
+
+    if data.get("optimize"):
+      body = [{"beg_time": int(timestamps[0]), "step_time": step, "value": values.tolist()}] if len(timestamps) else []
+    else:
+      body = {str(timestamp): row for timestamp, row in zip(timestamps.tolist(), values.tolist())}
+    return 200, {"status": "ok", "body": body}
+
+  def _count(self, endpoint):
+    with self.stats_lock:
+      self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+  def _create_handler(self):
+    simulator = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+
+      def log_message(self, *args):
+        pass
+
+      def _send(self, status, payload, headers = None):
+        content = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+          self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+      def _handle(self, method):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        data = json.loads(self.rfile.read(length)) if length else {}
+        endpoint = url.path.rstrip("/").split("/")[-1]
+        simulator._count(endpoint)
+
+        if simulator.latency:
+          time.sleep(simulator.latency)
+
+        if simulator.throttle is not None and not simulator.throttle.try_acquire():
+          with simulator.stats_lock:
+            simulator.throttled += 1
+          return self._send(429, {"error": {"code": 26, "message": "User usage reached"}}, {"Retry-After": "1"})
+
+        if endpoint == "token":
+          return self._send(200, {"body": simulator.TOKEN})
+
+        token = params.get("access_token", [None])[0] or self.headers.get("authorization", "").removeprefix("Bearer ")
+        if token != simulator.TOKEN:
+          return self._send(403, {"error": {"code": 3, "message": "Access token expired"}})
+
+        if method == "GET" and endpoint == "getpublicmeasures":
+          return self._send(*simulator._getpublicmeasures(params))
+        if method == "POST" and endpoint == "getpublicmeasure":
+          return self._send(*simulator._getpublicmeasure(data))
+        if method == "POST" and endpoint == "getmeasure":
+          return self._send(*simulator._getmeasure(data))
+
+        return self._send(404, {"error": {"code": 404, "message": f"Unknown endpoint {url.path}"}})
+
+      def do_GET(self):
+        self._handle("GET")
+
+      def do_POST(self):
+        self._handle("POST")
+
+    return Handler
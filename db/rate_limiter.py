@@ -0,0 +1,55 @@
+import threading
+import time
+
+
+class RateLimiter:
+  """
+  Thread-safe token bucket that limits how many requests are started per second.
+  Tokens refill continuously at `requests_per_second` up to `burst`. Every request consumes one token
+  and blocks until a token is available, so any number of worker threads can share one limiter.
+  Args:
+    requests_per_second (float): Sustained number of requests allowed per second.
+    burst (int, optional): Maximum number of requests that may be started back to back after an idle period. Defaults to 1.
+  """
+  def __init__(self, requests_per_second: float, burst: int = 1):
+    if requests_per_second <= 0:
+      raise Exception(f"requests_per_second must be positive, got {requests_per_second}")
+
+    self.requests_per_second = requests_per_second
+    self.burst = max(1, int(burst))
+    self.tokens = float(self.burst)
+    self.last_refill = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    """
+    Blocks until a token is available and consumes it.
+    """
+    while True:
+      with self.lock:
+        wait = self._take()
+        if wait == 0:
+          return
+
+      time.sleep(wait)
+
+  def try_acquire(self) -> bool:
+    """
+    Consumes a token if one is available without blocking.
+    Returns:
+      bool: True if a token was consumed, False if the rate is currently exceeded.
+    """
+    with self.lock:
+      return self._take() == 0
+
+  def _take(self) -> float:
+    # Refills the bucket and consumes a token, returns the time to wait for the next token if none is available
+    now = time.monotonic()
+    self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.requests_per_second)
+    self.last_refill = now
+
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return 0
+
+    return (1 - self.tokens) / self.requests_per_second
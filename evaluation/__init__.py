@@ -4,90 +4,262 @@ import os
 import pandas as pd
 import numpy as np
 
-from .preparation import load_dwd_sensor_data
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from .preparation import load_dwd_sensor_data, get_dwd_sensor_watermark
 from .eval_saits import run_saits
 from .eval_brits import run_brits
 from .eval_csdi import run_csdi
+from .eval_baselines import run_locf, run_nocb, run_linear, run_seasonal, run_climatology, run_knn
+from . import eval_saits, eval_brits, eval_csdi, eval_baselines
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from data_preprocessing.dwd import preprocess_dwd
+import data_preprocessing.dwd
+from data_preprocessing.dwd import preprocess_dwd, preprocess_dwd_shared, select_masks, apply_missingness
+from data_preprocessing.dataset_cache import DatasetCache
+from data_preprocessing.hdf5_export import export_dataset_hdf5, dataset_nbytes
+from . import preparation
+from .parallel import run_parallel
+from .results_store import ResultsStore
 
-def evaluate_methods(methods: list, sensorid: str, timespans: list, repeats: int = 1):
-    df = load_dwd_sensor_data(sensorid=sensorid)
+# Every runner takes the same arguments and returns (mae, rmse), see run_saits
+METHOD_RUNNERS = {
+    "SAITS": run_saits,
+    "BRITS": run_brits,
+    "CSDI": run_csdi,
+    "LOCF": run_locf,
+    "NOCB": run_nocb,
+    "LINEAR": run_linear,
+    "SEASONAL": run_seasonal,
+    "CLIMATOLOGY": run_climatology,
+    "KNN": run_knn,
+}
 
-    # Get the latest timestamp in the data
-    latest_date = pd.to_datetime(df['timestamp']).max()
+def evaluation_config(sensorid: str, seed: int = None, sliding_window_size: int = 150, gap_len: int = 10, miss_rate: float = 0.2,
+                      shared_masks: bool = False) -> dict:
+    """
+    Returns the configuration an evaluation's results are stored and looked up with, see ResultsStore.
+    Besides the parameters it holds the watermark of the sensor's data and a fingerprint of the preprocessing and method code,
+    so new data or changed code doesn't resume from or aggregate with results of the old one.
+    """
+    return {
+        "sliding_window_size": sliding_window_size,
+        "gap_len": gap_len,
+        "miss_rate": miss_rate,
+        "seed": seed,
+        "shared_masks": shared_masks,
+        "watermark": get_dwd_sensor_watermark(sensorid),
+        "code_version": DatasetCache.source_fingerprint(data_preprocessing.dwd, preparation,
+                                                        eval_saits, eval_brits, eval_csdi, eval_baselines),
+    }
 
-    results = {timespan: [] for timespan in timespans}
-    
-    for timespan in timespans:
-        print(f"Evaluating over a timespan with {timespan} years.")
-        offset = latest_date - pd.DateOffset(years=timespan)
+def evaluate_methods(methods: list, sensorid: str, timespans: list, repeats: int = 1, cache: DatasetCache = None, seed: int = None,
+                     sliding_window_size: int = 150, gap_len: int = 10, miss_rate: float = 0.2,
+                     hdf5_threshold_bytes: int = None, hdf5_dir: str = ".data/imputation/hdf5", shared_masks: bool = False,
+                     max_workers: int = None, loader_workers: int = 0, store: ResultsStore = None):
+    """
+    Evaluates imputation methods on the DWD data of a sensor over several timespans.
+    Within a repeat, all methods get the very same dataset.
+    With a cache, the preprocessed dataset of every timespan and repeat is looked up by its fingerprint first,
+    and the data of the sensor is only loaded from the database if one of them is missing. Cached datasets need a
+    deterministic missingness, so with a cache every repeat uses the seed `seed + repeat` (`repeat` without a seed).
+    With `shared_masks`, the split, scaler and windows of a timespan are computed once and the missingness masks of all
+    repeats are drawn up front from `seed` (see preprocess_dwd_shared), so repeats only differ in their masks and
+    no repeat preprocesses the data again.
+    Datasets larger than `hdf5_threshold_bytes` are exported to HDF5 files in `hdf5_dir` and the methods get the file paths
+    instead of the arrays, so PyPOTS loads them lazily batch by batch instead of holding them in memory.
+    With `max_workers` > 1, every (method, timespan, repeat) is a job of a process pool that gets its own share of the cores,
+    see run_parallel. The datasets are prepared one repeat after the other then and moved into shared memory, so the
+    parent only keeps the handles of the shared copies.
+    `loader_workers` is the number of DataLoader worker processes of every method.
+    With a `store`, every finished (method, timespan, repeat) is recorded right away together with the evaluation's
+    configuration (see evaluation_config), and jobs the store already holds for the same sensor and configuration are not
+    run again, so an interrupted evaluation resumes where it stopped.
+    Jobs that fail in the process pool are listed under "failed" of every result and left out of its averages,
+    which are None if no repeat succeeded.
+    """
+    config = evaluation_config(sensorid, seed, sliding_window_size, gap_len, miss_rate, shared_masks) if store is not None else None
+    job_results = store.completed(sensorid, config) if store is not None else {}
+    if job_results:
+        print(f"Resuming evaluation, {len(job_results)} results are already stored")
 
-        # Filter the DataFrame
-        timespan_df = df[pd.to_datetime(df['timestamp']) >= offset]
-        print(f"Data points from the last {timespan} years: {len(timespan_df)}")
+    def pending_methods(timespan, repeat):
+        return [method for method in methods if method in METHOD_RUNNERS and (method, timespan, repeat) not in job_results]
 
-        method_results = {method: [] for method in methods}
+    def record(method, timespan, repeat, mae, rmse):
+        job_results[(method, timespan, repeat)] = (mae, rmse)
+        if store is not None:
+            store.record(sensorid, method, timespan, repeat, config, mae, rmse)
 
-        for i in range(repeats):
-            # Preprocess for model input
-            dataset = preprocess_dwd(timespan_df)
+    failed_jobs = {}
+    def record_failure(method, timespan, repeat, error):
+        failed_jobs[(method, timespan, repeat)] = error
 
-            dataset_for_training = {
-                "X": dataset['train_X'],
-            }
+    inputs = iter_evaluation_inputs(sensorid, timespans, repeats, cache, seed, sliding_window_size, gap_len, miss_rate,
+                                    hdf5_threshold_bytes, hdf5_dir, shared_masks,
+                                    skip=lambda timespan, repeat: not pending_methods(timespan, repeat),
+                                    watermark=config["watermark"] if config is not None else None)
 
-            dataset_for_validating = {
-                "X": dataset['val_X'],
-                "X_ori": dataset['val_X_ori'],
-            }
+    if max_workers is not None and max_workers > 1:
+        # A generator, so every repeat's arrays are only held until they are copied into shared memory
+        jobs = ((method, timespan, repeat, repeat_inputs)
+                for timespan, repeat, repeat_inputs in inputs for method in pending_methods(timespan, repeat))
+        run_parallel(jobs, max_workers, loader_workers, on_result=record, on_failure=record_failure)
+    else:
+        for timespan, repeat, repeat_inputs in inputs:
+            for method in pending_methods(timespan, repeat):
+                mae, rmse = METHOD_RUNNERS[method](**repeat_inputs, num_workers=loader_workers)
+                record(method, timespan, repeat, float(mae), float(rmse))
+
+    for method in methods:
+        if method not in METHOD_RUNNERS:
+            print(f"Skipping unknown method {method}")
+
+    results = {timespan: [] for timespan in timespans}
+    for timespan in timespans:
+        method_results = {method: [{"mae": float(job_results[(method, timespan, repeat)][0]),
+                                    "rmse": float(job_results[(method, timespan, repeat)][1])}
+                                   for repeat in range(repeats) if (method, timespan, repeat) in job_results]
+                          for method in methods}
 
-            dataset_for_testing = {
-                "X": dataset['test_X'],
-                "X_ori": dataset['test_X_ori'],
-            }
-            
-            # TODO: going over each method once this makes sure that the data sets are identical and a real comparison is happening.
-            for method in methods:
-                if method == "SAITS":
-                    mae, rmse = run_saits(n_steps=dataset['n_steps'], n_features=dataset['n_features'], dataset_for_training=dataset_for_training, dataset_for_validating=dataset_for_validating, dataset_for_testing=dataset_for_testing)
-                
-                    method_results[method].append({
-                        "mae": float(mae),
-                        "rmse": float(rmse)
-                    })
-                elif method == "BRITS":
-                    mae, rmse = run_brits(n_steps=dataset['n_steps'], n_features=dataset['n_features'], dataset_for_training=dataset_for_training, dataset_for_validating=dataset_for_validating, dataset_for_testing=dataset_for_testing)
-                
-                    method_results[method].append({
-                        "mae": float(mae),
-                        "rmse": float(rmse)
-                    })
-                elif method == "CSDI":
-                    mae, rmse = run_csdi(n_steps=dataset['n_steps'], n_features=dataset['n_features'], dataset_for_training=dataset_for_training, dataset_for_validating=dataset_for_validating, dataset_for_testing=dataset_for_testing)
-                
-                    method_results[method].append({
-                        "mae": float(mae),
-                        "rmse": float(rmse)
-                    })
-                else:
-                    print(f"Skipping unknown method {method}")
-                
-                
         for method_result in method_results:
             
             # Extrahiere nur die mae- und rmse-Werte aus den Ergebnissen
             maes = [res["mae"] for res in method_results[method_result]]
             rmses = [res["rmse"] for res in method_results[method_result]]
+            failed = [repeat for repeat in range(repeats) if (method_result, timespan, repeat) in failed_jobs]
+            if failed:
+                print(f"Warning: {method_result} failed on {timespan} years in repeats {[repeat + 1 for repeat in failed]}, "
+                      f"they are left out of its averages")
             
             results[timespan].append({
                 "method": method_result,
                 "rmse": rmses,
                 "mae": maes,
-                "average_rmse": float(np.mean(rmses)),
-                "average_mae":  float(np.mean(maes))
+                "failed": failed,
+                "average_rmse": float(np.mean(rmses)) if rmses else None,
+                "average_mae":  float(np.mean(maes)) if maes else None
             })
             
 
-    return results
\ No newline at end of file
+    return results
+
+
+def iter_evaluation_inputs(sensorid, timespans, repeats, cache, seed, sliding_window_size, gap_len, miss_rate,
+                           hdf5_threshold_bytes, hdf5_dir, shared_masks, skip = None, watermark = None):
+    """
+    Yields (timespan, repeat, inputs) for every dataset of an evaluation, where inputs are the keyword arguments of the
+    method runners, see evaluate_methods. The data is only loaded and preprocessed when a dataset is requested,
+    datasets for which skip(timespan, repeat) is True are neither prepared nor yielded.
+    The watermark of the sensor's data is read from the database unless it is given.
+    """
+    df = None
+    if watermark is None and cache is not None:
+        watermark = get_dwd_sensor_watermark(sensorid)
+    code_version = DatasetCache.source_fingerprint(data_preprocessing.dwd, preparation) if cache is not None else None
+
+    for timespan in timespans:
+        print(f"Evaluating over a timespan with {timespan} years.")
+        timespan_df = None
+        repeats_to_run = [i for i in range(repeats) if skip is None or not skip(timespan, i)]
+        if not repeats_to_run:
+            print(f"All repeats over {timespan} years are already evaluated.")
+            continue
+
+        def get_timespan_df():
+            nonlocal df, timespan_df
+            if df is None:
+                df = load_dwd_sensor_data(sensorid=sensorid)
+            if timespan_df is None:
+                # Get the latest timestamp in the data and filter the DataFrame
+                latest_date = pd.to_datetime(df['timestamp']).max()
+                offset = latest_date - pd.DateOffset(years=timespan)
+                timespan_df = df[pd.to_datetime(df['timestamp']) >= offset]
+                print(f"Data points from the last {timespan} years: {len(timespan_df)}")
+            return timespan_df
+
+        shared_dataset = None
+        if shared_masks:
+            key = None
+            if cache is not None:
+                key = DatasetCache.make_key(sensorid, watermark, timespan, sliding_window_size, gap_len, miss_rate, seed, code_version,
+                                            shared_masks=True, n_masks=repeats)
+                shared_dataset = cache.get(key)
+            if shared_dataset is None:
+                shared_dataset = preprocess_dwd_shared(get_timespan_df(), sliding_window_size=sliding_window_size, gap_len=gap_len,
+                                                       miss_rate=miss_rate, n_masks=repeats, seed=seed)
+                if cache is not None:
+                    shared_dataset = cache.put(key, shared_dataset)
+            else:
+                print(f"Using cached shared dataset {key[:12]}")
+
+        for i in repeats_to_run:
+            if shared_dataset is not None:
+                dataset = select_masks(shared_dataset, i)
+            else:
+                dataset = get_repeat_dataset(get_timespan_df, cache, sensorid, watermark, timespan, i, seed, code_version,
+                                             sliding_window_size, gap_len, miss_rate)
+
+            if hdf5_threshold_bytes is not None and dataset_nbytes(dataset) > hdf5_threshold_bytes:
+                print(f"Dataset takes {dataset_nbytes(dataset) / 1024**2:.1f} MiB, training from HDF5 files")
+                paths = export_dataset_hdf5(dataset, os.path.join(hdf5_dir, f"{sensorid}_{timespan}y_{i}"))
+                dataset_for_training = paths["train"]
+                dataset_for_validating = paths["val"]
+                dataset_for_testing = paths["test"]
+            else:
+                dataset_for_training = {
+                    "X": get_X(dataset, "train"),
+                }
+
+                dataset_for_validating = {
+                    "X": get_X(dataset, "val"),
+                    "X_ori": dataset['val_X_ori'],
+                }
+
+                dataset_for_testing = {
+                    "X": get_X(dataset, "test"),
+                    "X_ori": dataset['test_X_ori'],
+                }
+
+                # The day of year of every time step, for the climatology based baselines
+                if 'train_doy' in dataset:
+                    dataset_for_training["doy"] = dataset['train_doy']
+                    dataset_for_validating["doy"] = dataset['val_doy']
+                    dataset_for_testing["doy"] = dataset['test_doy']
+
+            yield timespan, i, {
+                "n_steps": dataset['n_steps'],
+                "n_features": dataset['n_features'],
+                "dataset_for_training": dataset_for_training,
+                "dataset_for_validating": dataset_for_validating,
+                "dataset_for_testing": dataset_for_testing,
+            }
+
+
+def get_repeat_dataset(get_timespan_df, cache, sensorid, watermark, timespan, repeat, seed, code_version,
+                       sliding_window_size, gap_len, miss_rate) -> dict:
+    """
+    Returns the dataset of a single repeat, from the cache if possible, otherwise preprocessed with its own missingness.
+    """
+    repeat_seed = None if seed is None and cache is None else (seed or 0) + repeat
+    key = None
+    if cache is not None:
+        key = DatasetCache.make_key(sensorid, watermark, timespan, sliding_window_size, gap_len, miss_rate, repeat_seed, code_version)
+        dataset = cache.get(key)
+        if dataset is not None:
+            print(f"Using cached dataset {key[:12]} for repeat {repeat + 1}")
+            return dataset
+
+    # Preprocess for model input
+    dataset = preprocess_dwd(get_timespan_df(), sliding_window_size=sliding_window_size, gap_len=gap_len, miss_rate=miss_rate, seed=repeat_seed)
+    if cache is not None:
+        dataset = cache.put(key, dataset)
+    return dataset
+
+
+def get_X(dataset, split) -> np.ndarray:
+    """
+    Returns the windows of a split with their artificially missing values as NaN, for eager as well as lazy datasets.
+    """
+    if f"{split}_X" in dataset:
+        return dataset[f"{split}_X"]
+    return apply_missingness(dataset[f"{split}_X_ori"], dataset[f"{split}_X_mask"])
@@ -0,0 +1,197 @@
+import numpy as np
+
+from data_preprocessing.hdf5_export import load_array
+
+# Classical imputation baselines. Each imputes all windows [windows, n_steps, features] at once with NumPy,
+# so a screening pass over all of them takes well below a second, and their runners return (mae, rmse) like run_saits.
+
+# Upper bound of the number of distances knn holds in memory at once (128 MiB of float64)
+MAX_DISTANCES = 2**24
+
+
+def _previous_observed(observed):
+    """
+    Returns the index of the last observed time step at or before every time step, -1 if there is none.
+    """
+    steps = np.arange(observed.shape[1])[None, :, None]
+    return np.maximum.accumulate(np.where(observed, steps, -1), axis=1)
+
+
+def _next_observed(observed):
+    """
+    Returns the index of the first observed time step at or after every time step, n_steps if there is none.
+    """
+    n_steps = observed.shape[1]
+    steps = np.arange(n_steps)[None, :, None]
+    return np.minimum.accumulate(np.where(observed, steps, n_steps)[:, ::-1], axis=1)[:, ::-1]
+
+
+def _take_steps(X, index):
+    return np.take_along_axis(X, np.clip(index, 0, X.shape[1] - 1), axis=1)
+
+
+def locf(X) -> np.ndarray:
+    """
+    Last observation carried forward. Values before the first observation of a window take the next observation,
+    features without any observation in a window are set to 0, the mean of the standardized training data.
+    """
+    observed = ~np.isnan(X)
+    previous = _previous_observed(observed)
+    following = _next_observed(observed)
+    imputed = np.where(previous >= 0, _take_steps(X, previous), _take_steps(X, following))
+    return np.nan_to_num(imputed, nan=0.0)
+
+
+def nocb(X) -> np.ndarray:
+    """
+    Next observation carried backward, the mirror image of locf.
+    """
+    return locf(X[:, ::-1])[:, ::-1]
+
+
+def linear_interpolation(X) -> np.ndarray:
+    """
+    Interpolates linearly between the observations around every gap, gaps at the edges of a window are filled like locf.
+    """
+    observed = ~np.isnan(X)
+    previous = _previous_observed(observed)
+    following = _next_observed(observed)
+    inner = (previous >= 0) & (following < X.shape[1])
+
+    steps = np.arange(X.shape[1])[None, :, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = np.where(observed, 0.0, (steps - previous) / (following - previous))
+    before, after = _take_steps(X, previous), _take_steps(X, following)
+    return np.where(inner, before + weight * (after - before), locf(X))
+
+
+def climatology(X, doy) -> np.ndarray:
+    """
+    Per feature and day of year mean of the observed values, see impute_climatology.
+    Args:
+        X (np.ndarray): Windows [windows, n_steps, features], e.g. of the training split.
+        doy (np.ndarray): Day of year of every time step [windows, n_steps].
+    Returns:
+        np.ndarray: The climatology [367, features], indexed by the day of year, smoothed over a centered 15 day window.
+    """
+    n_features = X.shape[2]
+    values = X.reshape(-1, n_features)
+    days = np.asarray(doy, dtype=np.int64).reshape(-1)
+
+    observed = ~np.isnan(values)
+    cells = days[:, None] * n_features + np.arange(n_features)[None, :]
+    sums = np.bincount(cells[observed], weights=values[observed], minlength=367 * n_features).reshape(367, n_features)
+    counts = np.bincount(cells[observed], minlength=367 * n_features).reshape(367, n_features)
+
+    # Smoothing over neighbouring days (wrapping around the year) fills days without data and reduces noise
+    kernel = np.ones(15)
+    wrapped_sums = np.concatenate([sums[-7:], sums[1:], sums[1:8]])
+    wrapped_counts = np.concatenate([counts[-7:], counts[1:], counts[1:8]])
+    smooth_sums = np.stack([np.convolve(wrapped_sums[:, f], kernel, mode="valid") for f in range(n_features)], axis=1)
+    smooth_counts = np.stack([np.convolve(wrapped_counts[:, f], kernel, mode="valid") for f in range(n_features)], axis=1)
+
+    means = np.zeros((367, n_features))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means[1:] = np.where(smooth_counts > 0, smooth_sums / smooth_counts, 0.0)
+    return means
+
+
+def impute_climatology(X, doy, means) -> np.ndarray:
+    """
+    Fills every missing value with the climatological mean of its feature and day of year.
+    """
+    expected = means[np.asarray(doy, dtype=np.int64)]
+    return np.where(np.isnan(X), expected, X)
+
+
+def seasonal_interpolation(X, doy, means) -> np.ndarray:
+    """
+    Interpolates the anomalies from the seasonal cycle linearly and adds the cycle back, so gaps follow the climatology's
+    course between the observations around them instead of a straight line.
+    """
+    expected = means[np.asarray(doy, dtype=np.int64)]
+    return linear_interpolation(X - expected) + expected
+
+
+def knn(X, donors, k = 5, chunk_size = 4096) -> np.ndarray:
+    """
+    Fills the missing features of every time step with the mean of the k donor time steps that are closest in the observed
+    features (Euclidean distance), like scikit-learn's KNNImputer. Time steps without any observed feature are filled
+    by linear_interpolation.
+    Args:
+        X (np.ndarray): Windows [windows, n_steps, features].
+        donors (np.ndarray): Completely observed time steps [donors, features], e.g. of the training split.
+        k (int, optional): Number of neighbours. Defaults to 5.
+        chunk_size (int, optional): Maximum number of time steps whose distances to all donors are computed at once,
+            fewer if there are so many donors that the distances would take more than MAX_DISTANCES values. Defaults to 4096.
+    """
+    rows = X.reshape(-1, X.shape[2])
+    imputed = linear_interpolation(X).reshape(-1, X.shape[2])
+    k = min(k, len(donors))
+    if k == 0:
+        return imputed.reshape(X.shape)
+
+    observed = ~np.isnan(rows)
+    incomplete = np.flatnonzero(observed.any(axis=1) & ~observed.all(axis=1))
+    squared_donors = donors ** 2
+    chunk_size = max(1, min(chunk_size, MAX_DISTANCES // len(donors)))
+
+    for begin in range(0, len(incomplete), chunk_size):
+        index = incomplete[begin:begin + chunk_size]
+        mask = observed[index].astype(np.float64)
+        values = np.nan_to_num(rows[index])
+        # Squared distances over the observed features only: sum of m * (x - d)^2 = m·x² - 2 (m·x)·d + m·d²
+        distances = (values ** 2).sum(axis=1)[:, None] - 2 * values @ donors.T + mask @ squared_donors.T
+        neighbours = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        estimates = donors[neighbours].mean(axis=1)
+        imputed[index] = np.where(observed[index], rows[index], estimates)
+
+    return imputed.reshape(X.shape)
+
+
+def calc_errors(imputation, X_ori) -> tuple:
+    """
+    Mean absolute and root mean square error over all values, like calc_mae and calc_rmse of PyPOTS without a mask.
+    """
+    valid = ~np.isnan(X_ori)
+    errors = imputation[valid] - X_ori[valid]
+    return float(np.abs(errors).mean()), float(np.sqrt((errors ** 2).mean()))
+
+
+def _training_climatology(dataset_for_training):
+    try:
+        doy = load_array(dataset_for_training, "doy")
+    except KeyError:
+        print("The climatology baselines need the day of year of the windows")
+        raise Exception("The dataset has no day of year windows, preprocess data with a 'timestamp' column")
+    return climatology(load_array(dataset_for_training, "X"), doy)
+
+
+def run_locf(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=None):
+    return calc_errors(locf(load_array(dataset_for_testing, "X")), load_array(dataset_for_testing, "X_ori"))
+
+
+def run_nocb(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=None):
+    return calc_errors(nocb(load_array(dataset_for_testing, "X")), load_array(dataset_for_testing, "X_ori"))
+
+
+def run_linear(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=None):
+    return calc_errors(linear_interpolation(load_array(dataset_for_testing, "X")), load_array(dataset_for_testing, "X_ori"))
+
+
+def run_seasonal(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=None):
+    means = _training_climatology(dataset_for_training)
+    imputation = seasonal_interpolation(load_array(dataset_for_testing, "X"), load_array(dataset_for_testing, "doy"), means)
+    return calc_errors(imputation, load_array(dataset_for_testing, "X_ori"))
+
+
+def run_climatology(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=None):
+    means = _training_climatology(dataset_for_training)
+    imputation = impute_climatology(load_array(dataset_for_testing, "X"), load_array(dataset_for_testing, "doy"), means)
+    return calc_errors(imputation, load_array(dataset_for_testing, "X_ori"))
+
+
+def run_knn(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=None):
+    train_X = load_array(dataset_for_training, "X").reshape(-1, n_features)
+    donors = train_X[~np.isnan(train_X).any(axis=1)].astype(np.float64)
+    return calc_errors(knn(load_array(dataset_for_testing, "X"), donors), load_array(dataset_for_testing, "X_ori"))
@@ -2,7 +2,9 @@ from pypots.optim import Adam
 from pypots.imputation import BRITS
 from pypots.nn.functional import calc_mae, calc_rmse
 
-def run_brits(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing):
+from data_preprocessing.hdf5_export import load_array
+
+def run_brits(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=".data/imputation/brits"):
     brits = BRITS(
         n_steps=n_steps,
         n_features=n_features,
@@ -11,9 +13,9 @@ def run_brits(n_steps, n_features, dataset_for_training, dataset_for_validating,
         epochs=100,
         patience=3,
         optimizer=Adam(lr=1e-3),
-        num_workers=0,
+        num_workers=num_workers,
         device=None,
-        saving_path=".data/imputation/brits",
+        saving_path=saving_path,
         model_saving_strategy="best",
     )
 
@@ -23,14 +25,17 @@ def run_brits(n_steps, n_features, dataset_for_training, dataset_for_validating,
     brits_results = brits.predict(dataset_for_testing)
     brits_imputation = brits_results["imputation"]
 
+    # The test set is either a dict of arrays or the path of an HDF5 file
+    X_ori = load_array(dataset_for_testing, "X_ori")
+
     mae = calc_mae(
         brits_imputation,
-        dataset_for_testing['X_ori'],
+        X_ori,
     )
     
     rmse = calc_rmse(
         brits_imputation,
-        dataset_for_testing['X_ori'],
+        X_ori,
     )
     
     return mae, rmse
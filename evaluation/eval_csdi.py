@@ -2,9 +2,11 @@ from pypots.optim import Adam
 from pypots.imputation import CSDI
 from pypots.nn.functional import calc_mae, calc_rmse
 
+from data_preprocessing.hdf5_export import load_array
 
 
-def run_csdi(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing):
+
+def run_csdi(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=".data/imputation/csdi"):
     # Initialize and train CSDI model
     csdi = CSDI(
         n_steps=n_steps,
@@ -21,9 +23,9 @@ def run_csdi(n_steps, n_features, dataset_for_training, dataset_for_validating,
         epochs=100,
         patience=3,
         optimizer=Adam(lr=1e-3),
-        num_workers=0,
+        num_workers=num_workers,
         device=None,
-        saving_path=".data/imputation/csdi",
+        saving_path=saving_path,
         model_saving_strategy="best",
     )
 
@@ -36,14 +38,17 @@ def run_csdi(n_steps, n_features, dataset_for_training, dataset_for_validating,
     # for error calculation, we need to take the mean value of the multiple samplings for each data sample
     mean_csdi_imputation = csdi_imputation.mean(axis=1)
 
+    # The test set is either a dict of arrays or the path of an HDF5 file
+    X_ori = load_array(dataset_for_testing, "X_ori")
+
     mae = calc_mae(
         mean_csdi_imputation,
-        dataset_for_testing['X_ori'],
+        X_ori,
     )
     
     rmse = calc_rmse(
         mean_csdi_imputation,
-        dataset_for_testing['X_ori'],
+        X_ori,
     )
     
     return mae, rmse
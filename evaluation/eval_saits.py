@@ -2,7 +2,9 @@ from pypots.optim import Adam
 from pypots.imputation import SAITS
 from pypots.nn.functional import calc_mae, calc_rmse
 
-def run_saits(n_steps, n_features,dataset_for_training, dataset_for_validating, dataset_for_testing):
+from data_preprocessing.hdf5_export import load_array
+
+def run_saits(n_steps, n_features, dataset_for_training, dataset_for_validating, dataset_for_testing, num_workers=0, saving_path=".data/imputation/saits"):
     saits = SAITS(
         n_steps=n_steps,
         n_features=n_features,
@@ -30,12 +32,12 @@ def run_saits(n_steps, n_features,dataset_for_training, dataset_for_validating,
         # this num_workers argument is for torch.utils.data.Dataloader. It's the number of subprocesses to use for data loading.
         # Leaving it to default as 0 means data loading will be in the main process, i.e. there won't be subprocesses.
         # You can increase it to >1 if you think your dataloading is a bottleneck to your model training speed
-        num_workers=0,
+        num_workers=num_workers,
         # just leave it to default as None, PyPOTS will automatically assign the best device for you.
         # Set it as 'cpu' if you don't have CUDA devices. You can also set it to 'cuda:0' or 'cuda:1' if you have multiple CUDA devices, even parallelly on ['cuda:0', 'cuda:1']
         device=None,  
         # set the path for saving tensorboard and trained model files 
-        saving_path=".data/imputation/saits",
+        saving_path=saving_path,
         # only save the best model after training finished.
         # You can also set it as "better" to save models performing better ever during training.
         model_saving_strategy="best",
@@ -47,14 +49,17 @@ def run_saits(n_steps, n_features,dataset_for_training, dataset_for_validating,
     saits_results = saits.predict(dataset_for_testing)
     saits_imputation = saits_results["imputation"]
 
+    # The test set is either a dict of arrays or the path of an HDF5 file
+    X_ori = load_array(dataset_for_testing, "X_ori")
+
     mae = calc_mae(
         saits_imputation,
-        dataset_for_testing['X_ori'],
+        X_ori,
     )
     
     rmse = calc_rmse(
         saits_imputation,
-        dataset_for_testing['X_ori'],
+        X_ori,
     )
     
     return mae, rmse
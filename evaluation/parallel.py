@@ -0,0 +1,170 @@
+import os
+import weakref
+import multiprocessing
+import numpy as np
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
+
+# Reference to an array in shared memory, which is all a worker process receives instead of the array itself
+SharedArray = namedtuple("SharedArray", ["name", "shape", "dtype"])
+
+
+class SharedArrays:
+    """
+    Copies the arrays of the evaluation inputs into shared memory once, so all worker processes read the same pages.
+    Arrays used by several inputs, e.g. the windows of a shared dataset (see preprocess_dwd_shared), are only copied once
+    as long as they are alive. The arrays themselves aren't referenced, so the caller can free every array as soon as it
+    is shared and only the copy in shared memory remains.
+    Use as context manager, the shared memory is released when leaving it.
+    """
+    def __init__(self):
+        self.segments = []
+        self.shared = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def share(self, array: np.ndarray) -> SharedArray:
+        key = id(array)
+        if key not in self.shared:
+            segment = SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            self.segments.append(segment)
+            self.shared[key] = SharedArray(segment.name, array.shape, array.dtype.str)
+            # Once the array is freed its id may be reused by another array, which must not be mistaken for it
+            weakref.finalize(array, self.shared.pop, key, None)
+        return self.shared[key]
+
+    def share_inputs(self, inputs: dict) -> dict:
+        """
+        Replaces the arrays of the datasets of evaluation inputs by references to shared memory.
+        Datasets given as HDF5 file paths are passed on as they are.
+        """
+        shared = dict(inputs)
+        for name in ["dataset_for_training", "dataset_for_validating", "dataset_for_testing"]:
+            if isinstance(inputs[name], dict):
+                shared[name] = {key: self.share(value) if isinstance(value, np.ndarray) else value for key, value in inputs[name].items()}
+        return shared
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments.clear()
+        self.shared.clear()
+
+
+def attach_inputs(inputs: dict) -> tuple:
+    """
+    Maps the shared arrays of evaluation inputs into the current process as read-only arrays, without copying them.
+    Returns:
+        tuple: The inputs with arrays and the attached segments, which have to stay open as long as the arrays are used.
+    """
+    segments = []
+    attached = dict(inputs)
+    for name in ["dataset_for_training", "dataset_for_validating", "dataset_for_testing"]:
+        if not isinstance(inputs[name], dict):
+            continue
+        dataset = {}
+        for key, value in inputs[name].items():
+            if isinstance(value, SharedArray):
+                segment = SharedMemory(name=value.name)
+                segments.append(segment)
+                value = np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=segment.buf)
+                value.setflags(write=False)
+            dataset[key] = value
+        attached[name] = dataset
+    return attached, segments
+
+
+def partition_cores(max_workers: int, loader_workers: int = 0, n_cores: int = None) -> int:
+    """
+    Splits the cores between the parallel jobs. Every job gets the same share, of which its DataLoader workers take
+    loader_workers cores and torch's intra-op threads the rest.
+    Returns:
+        int: Number of torch threads per job.
+    """
+    n_cores = n_cores or os.cpu_count()
+    return max(1, n_cores // max_workers - loader_workers)
+
+
+def _init_worker(torch_threads: int):
+    # The thread pools of OpenMP and MKL are sized when they are first used, so the environment has to be set before torch runs
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[variable] = str(torch_threads)
+
+    import torch
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+
+
+def _run_job(method: str, inputs: dict, loader_workers: int, saving_path: str) -> tuple:
+    from evaluation import METHOD_RUNNERS
+
+    attached, segments = attach_inputs(inputs)
+    try:
+        mae, rmse = METHOD_RUNNERS[method](**attached, num_workers=loader_workers, saving_path=saving_path)
+        return float(mae), float(rmse)
+    finally:
+        del attached
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # Something still holds a view, the mapping is released when the worker exits
+                pass
+
+
+def run_parallel(jobs, max_workers: int, loader_workers: int = 0, saving_dir: str = ".data/imputation/parallel", on_result = None,
+                 on_failure = None) -> dict:
+    """
+    Runs evaluation jobs in a pool of processes, each with its own share of the cores (see partition_cores).
+    The datasets are put into shared memory once and attached by the workers, so no job copies them.
+    Args:
+        jobs (iterable): Tuples (method, timespan, repeat, inputs), where inputs are the keyword arguments of the method's
+            runner without num_workers and saving_path, see METHOD_RUNNERS. The inputs of every job are moved into shared
+            memory as soon as it is taken from jobs, so a generator lets the caller free them right away.
+        max_workers (int): Number of jobs that run at the same time.
+        loader_workers (int, optional): Number of DataLoader worker processes of every job. Defaults to 0.
+        saving_dir (str, optional): Directory the jobs save their models to, every job in its own subdirectory.
+        on_result (callable, optional): Called with (method, timespan, repeat, mae, rmse) as soon as a job finished.
+            An exception of the callback isn't caught, so e.g. a failing store stops the evaluation.
+        on_failure (callable, optional): Called with (method, timespan, repeat, error message) as soon as a job failed.
+    Returns:
+        dict: (mae, rmse) of every job by (method, timespan, repeat). Failed jobs are reported, passed to on_failure and left out.
+    """
+    torch_threads = partition_cores(max_workers, loader_workers)
+    print(f"Running evaluation jobs in {max_workers} processes with {torch_threads} torch threads and {loader_workers} loader workers each")
+
+    results = {}
+    # torch doesn't support forking a process that already initialized its thread pools, so the workers are spawned
+    context = multiprocessing.get_context("spawn")
+    with SharedArrays() as shared, ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                                       initializer=_init_worker, initargs=(torch_threads,)) as executor:
+        futures = {}
+        for method, timespan, repeat, inputs in jobs:
+            saving_path = os.path.join(saving_dir, f"{method.lower()}_{timespan}y_{repeat}")
+            future = executor.submit(_run_job, method, shared.share_inputs(inputs), loader_workers, saving_path)
+            futures[future] = (method, timespan, repeat)
+
+        for future in as_completed(futures):
+            method, timespan, repeat = futures[future]
+            try:
+                mae, rmse = future.result()
+            except Exception as e:
+                print(f"Failed to evaluate {method} on {timespan} years, repeat {repeat + 1}: {e}")
+                if on_failure is not None:
+                    on_failure(method, timespan, repeat, str(e))
+                continue
+
+            results[(method, timespan, repeat)] = (mae, rmse)
+            print(f"Finished {method} on {timespan} years, repeat {repeat + 1}")
+            if on_result is not None:
+                on_result(method, timespan, repeat, mae, rmse)
+
+    return results
@@ -9,10 +9,10 @@ from models import MeasurementType
 
 from functools import reduce
 
-def load_dwd_sensor_data(sensorid: str) -> pd.DataFrame:
+def _connect_db() -> SensorDB:
   load_dotenv()
 
-  db = SensorDB(DBConfig(
+  return SensorDB(DBConfig(
       dbname=os.getenv("DB_NAME"),
       user=os.getenv("DB_USER"),
       password=os.getenv("DB_PASSWORD"),
@@ -20,17 +20,49 @@ def load_dwd_sensor_data(sensorid: str) -> pd.DataFrame:
       port=os.getenv("DB_PORT")
   ))
 
+# The daily types and the time range of the data load_dwd_sensor_data reads
+DWD_SENSOR_TYPES = [
+  MeasurementType.TEMPERATURE_24H,
+  MeasurementType.HUMIDITY_24H,
+  MeasurementType.PRESSURE_24H,
+  MeasurementType.RAIN_24H,
+  MeasurementType.WIND_STRENGTH_24H,
+  MeasurementType.SUN_24H,
+  MeasurementType.CLOUD_COVERAGE_24H,
+]
+DWD_FROM_TIMESTAMP = "1980-04-30 12:00:00"
+DWD_TO_TIMESTAMP = "2025-05-01 12:00:00"
+
+def get_dwd_sensor_watermark(sensorid: str) -> str:
+  """
+  Returns the number and the latest timestamp of the measurements load_dwd_sensor_data reads, with a single cheap query.
+  It changes whenever the data of the sensor in that range changes, also by backfilled or deleted rows,
+  but not by data load_dwd_sensor_data doesn't read.
+  """
+  db = _connect_db()
+  sensor = DWDInserter(db).get_sensor_by_id(sensorid)
+  if sensor is None:
+    raise Exception(f"DWD sensor {sensorid} does not exist.")
+
+  watermark = db.get_measurement_watermark(sensor.sensor_id, [measurement_type.value for measurement_type in DWD_SENSOR_TYPES],
+                                           from_timestamp=DWD_FROM_TIMESTAMP, to_timestamp=DWD_TO_TIMESTAMP)
+  if watermark is None:
+    raise Exception(f"Can't read the watermark of DWD sensor {sensorid}.")
+
+  count, latest_timestamp = watermark
+  return f"{count}@{latest_timestamp}"
+
+def load_dwd_sensor_data(sensorid: str) -> pd.DataFrame:
+  db = _connect_db()
+
   inserter = DWDInserter(db)
 
   sensor = inserter.get_sensor_by_id(sensorid)
   
-  temp_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.TEMPERATURE_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
-  humi_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.HUMIDITY_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
-  pres_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.PRESSURE_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
-  rain_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.RAIN_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
-  wind_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.WIND_STRENGTH_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
-  sun_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.SUN_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
-  cloud_measurements = db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=MeasurementType.CLOUD_COVERAGE_24H.value, from_timestamp="1980-04-30 12:00:00", to_timestamp="2025-05-01 12:00:00")
+  temp_measurements, humi_measurements, pres_measurements, rain_measurements, wind_measurements, sun_measurements, cloud_measurements = [
+    db.get_measurements_for_sensor(sensor.sensor_id, measurement_type=measurement_type.value, from_timestamp=DWD_FROM_TIMESTAMP, to_timestamp=DWD_TO_TIMESTAMP)
+    for measurement_type in DWD_SENSOR_TYPES
+  ]
 
   # Create DataFrames for each measurement series with timestamp as key
   # Each DataFrame contains one variable and its timestamps
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+from contextlib import closing
+
+
+class ResultsStore:
+    """
+    Durable store of evaluation results, one row per finished (sensor, method, timespan, repeat) and configuration.
+    Every result is committed as soon as it is recorded, so a crashed or interrupted evaluation keeps everything it finished
+    and a restart with the same configuration skips it (see evaluate_methods). Results of many runs are aggregated by SQLite,
+    without loading them into memory.
+    Args:
+        path (str, optional): Path of the SQLite database. Defaults to ".data/results/results.sqlite".
+    """
+    GROUP_COLUMNS = ["sensor_id", "method", "timespan", "repeat", "fingerprint"]
+
+    def __init__(self, path = ".data/results/results.sqlite"):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            # WAL keeps the store readable while an evaluation writes to it
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    sensor_id TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    timespan INTEGER NOT NULL,
+                    repeat INTEGER NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    mae REAL NOT NULL,
+                    rmse REAL NOT NULL,
+                    finished_at REAL NOT NULL,
+                    PRIMARY KEY (sensor_id, method, timespan, repeat, fingerprint)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def config_fingerprint(config: dict) -> str:
+        """
+        Hashes the configuration of an evaluation, results are only reused for the same configuration.
+        """
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+    def record(self, sensor_id, method, timespan, repeat, config: dict, mae, rmse):
+        """
+        Stores the result of a finished job, replacing an earlier result of the same job and configuration.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (str(sensor_id), method, int(timespan), int(repeat), self.config_fingerprint(config),
+                          json.dumps(config, sort_keys=True, default=str), float(mae), float(rmse), time.time()))
+
+    def completed(self, sensor_id, config: dict) -> dict:
+        """
+        Returns the results of all finished jobs of a sensor and configuration.
+        Returns:
+            dict: (mae, rmse) by (method, timespan, repeat).
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT method, timespan, repeat, mae, rmse FROM results WHERE sensor_id = ? AND fingerprint = ?",
+                                (str(sensor_id), self.config_fingerprint(config))).fetchall()
+        return {(method, timespan, repeat): (mae, rmse) for method, timespan, repeat, mae, rmse in rows}
+
+    def aggregate(self, group_by = ("method", "timespan"), sensor_id = None, method = None, config: dict = None) -> list:
+        """
+        Aggregates the stored results of all runs.
+        Args:
+            group_by (tuple, optional): Columns to group by, of GROUP_COLUMNS. Defaults to ("method", "timespan").
+            sensor_id (str, optional): Only results of this sensor. Defaults to None.
+            method (str, optional): Only results of this method. Defaults to None.
+            config (dict, optional): Only results of this configuration. Defaults to None.
+        Returns:
+            list: One dict per group with the group columns, the number of results 'n' and the 'average_mae', 'average_rmse',
+                  'std_mae' and 'std_rmse' (population standard deviation).
+        """
+        for column in group_by:
+            if column not in self.GROUP_COLUMNS:
+                raise Exception(f"Can't group results by {column}, use one of {self.GROUP_COLUMNS}")
+
+        conditions, parameters = [], []
+        for column, value in [("sensor_id", sensor_id), ("method", method)]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(str(value))
+        if config is not None:
+            conditions.append("fingerprint = ?")
+            parameters.append(self.config_fingerprint(config))
+
+        columns = ", ".join(group_by)
+        query = f"""
+            SELECT {columns + ', ' if group_by else ''}COUNT(*), AVG(mae), AVG(rmse), AVG(mae * mae), AVG(rmse * rmse)
+            FROM results
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            {'GROUP BY ' + columns + ' ORDER BY ' + columns if group_by else ''}
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, parameters).fetchall()
+
+        results = []
+        for row in rows:
+            n, average_mae, average_rmse, mean_square_mae, mean_square_rmse = row[len(group_by):]
+            if n == 0:
+                continue
+            results.append({
+                **dict(zip(group_by, row)),
+                "n": n,
+                "average_mae": average_mae,
+                "average_rmse": average_rmse,
+                "std_mae": max(mean_square_mae - average_mae ** 2, 0.0) ** 0.5,
+                "std_rmse": max(mean_square_rmse - average_rmse ** 2, 0.0) ** 0.5,
+            })
+        return results
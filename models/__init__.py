@@ -3,4 +3,5 @@ from .measurement_type import MeasurementType
 from .measurement import Measurement, AggregatedMeasurement
 from .position import Position
 from .sensor import Sensor
-from .rectangle import Rectangle
\ No newline at end of file
+from .rectangle import Rectangle
+from .qc_flag import QCFlag
\ No newline at end of file
@@ -0,0 +1,13 @@
+from enum import IntFlag
+
+
+class QCFlag(IntFlag):
+  """
+  Bit flags of the quality control checks a measurement failed. Flags are combined, OK means no check failed.
+  """
+  OK = 0
+  MISSING = 1
+  SPATIAL_OUTLIER = 2
+  SPIKE = 4
+  CONSTANT = 8
+  LOW_COVERAGE = 16
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.dwd_inserter import DWDInserter
+from db.dwd_mirror import DWDMirror
+from models import Position, Sensor
+
+PRODUCT_NAME = "produkt_klima_tag_20240101_20240103_01975.txt"
+PRODUCT_ROWS = [
+  "STATIONS_ID;MESS_DATUM;QN_3;  FX;  FM;QN_4; RSK;RSKF; SDK;SHK_TAG;  NM; VPM;  PM; TMK; UPM; TXK; TNK; TGK;eor",
+  " 1975;20240101;   10;  12.0;   4.1;    3;   0.5;   6;   1.2;   0;   7.0;   8.1; 1012.3;   5.2;  88.0;   7.0;   3.1;   1.0;eor",
+  " 1975;20240102;   10;  10.0;   3.2;    3;   0.0;   0;   3.4;   0;   5.0;   7.9; 1015.1;   4.1;  85.0;   6.2;   2.0;   0.1;eor",
+]
+
+
+class StubDB:
+  """
+  Stands in for SensorDB. Like SensorDB, a failed insert is only reported by storing nothing.
+  """
+  def __init__(self, fail_inserts):
+    self.fail_inserts = fail_inserts
+
+  def get_sensor_by_original_id_and_source(self, original_id, source):
+    return Sensor("", original_id, Position(53.63, 9.99), "", source, sensor_id=1)
+
+  def get_latest_timestamps_for_sensor(self, sensor_id, aggregated = False, aggregation_interval = None):
+    return {}
+
+  def insert_batch_aggregated_measurements(self, measurements):
+    return 0 if self.fail_inserts else len(measurements)
+
+
+@pytest.fixture
+def mirror_root(tmp_path):
+  root = tmp_path / "mirror"
+  root.mkdir()
+  (root / PRODUCT_NAME).write_text("\n".join(PRODUCT_ROWS) + "\n", encoding="latin-1")
+  return root
+
+
+def test_failed_insert_is_not_recorded_in_the_manifest(mirror_root, tmp_path):
+  manifest_path = str(tmp_path / "manifest.jsonl")
+
+  mirror = DWDMirror(DWDInserter(StubDB(fail_inserts=True)), str(mirror_root), manifest_path)
+  summary = mirror.sync(max_workers=1)
+  assert summary["failed"] == 1
+  assert summary["ingested"] == 0
+  assert mirror.manifest.get(PRODUCT_NAME) is None
+
+  # The next sync tries the file again instead of skipping it as unchanged
+  mirror = DWDMirror(DWDInserter(StubDB(fail_inserts=False)), str(mirror_root), manifest_path)
+  summary = mirror.sync(max_workers=1)
+  assert summary["unchanged"] == 0
+  assert summary["ingested"] == 1
+  assert summary["stored"] == 2 * len(DWDInserter.DWD_PRODUCTS["klima_tag"]["columns"])
+  assert mirror.manifest.get(PRODUCT_NAME) is not None
+
+
+def test_failed_insert_of_an_appended_part_keeps_the_previous_offset(mirror_root, tmp_path):
+  manifest_path = str(tmp_path / "manifest.jsonl")
+  DWDMirror(DWDInserter(StubDB(fail_inserts=False)), str(mirror_root), manifest_path).sync(max_workers=1)
+  recorded_size = os.path.getsize(mirror_root / PRODUCT_NAME)
+
+  with open(mirror_root / PRODUCT_NAME, "a", encoding="latin-1") as f:
+    f.write(" 1975;20240103;   10;  11.0;   3.0;    3;   1.5;   6;   0.2;   0;   8.0;   8.0; 1009.8;   3.3;  91.0;   4.0;   2.5;   0.3;eor\n")
+
+  mirror = DWDMirror(DWDInserter(StubDB(fail_inserts=True)), str(mirror_root), manifest_path)
+  summary = mirror.sync(max_workers=1)
+  assert summary["failed"] == 1
+  assert summary["appended"] == 0
+  assert mirror.manifest.get(PRODUCT_NAME)["size"] == recorded_size